@@ -45,6 +45,74 @@ class Config:
 
     # Database settings
     DB_PATH = 'bot.db'
+    # Количество read-only соединений (WAL) для SELECT-запросов; запись идёт через 1 writer
+    DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+    # Write-behind буфер (активность, генерации, меню): сброс раз в N мс или по M строк
+    DB_WRITE_FLUSH_MS = int(os.getenv('DB_WRITE_FLUSH_MS', '250'))
+    DB_WRITE_BATCH_ROWS = int(os.getenv('DB_WRITE_BATCH_ROWS', '200'))
+    # Кэш сводки админ-панели (get_dashboard_snapshot), секунды; 0 = без кэша
+    DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', '30'))
+    # Веб-сервер для входящих вебхуков (callback Kie.ai)
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+    # Общий HTTP клиент (services/http_client.py): пул соединений и keep-alive
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))
+    HTTP_DEFAULT_TIMEOUT = float(os.getenv('HTTP_DEFAULT_TIMEOUT', '30'))
+    # Хранение user_activity: старше N дней → архив (gzip по месяцам) и удаление; 0 = не чистить
+    ACTIVITY_RETENTION_DAYS = int(os.getenv('ACTIVITY_RETENTION_DAYS', '90'))
+    ACTIVITY_ARCHIVE_DIR = os.getenv('ACTIVITY_ARCHIVE_DIR', 'archive/user_activity')
+    ACTIVITY_RETENTION_INTERVAL_HOURS = int(os.getenv('ACTIVITY_RETENTION_INTERVAL_HOURS', '24'))
+    ACTIVITY_RETENTION_BATCH_ROWS = int(os.getenv('ACTIVITY_RETENTION_BATCH_ROWS', '5000'))
+    # Однократный перевод существующей БД на auto_vacuum=INCREMENTAL (полный VACUUM при старте,
+    # до начала polling; на большой БД - минуты). Новые БД создаются сразу с INCREMENTAL
+    DB_ENABLE_INCREMENTAL_VACUUM = os.getenv('DB_ENABLE_INCREMENTAL_VACUUM', 'false').lower() == 'true'
+    # Задания генерации (services/generation_jobs.py): после перезапуска продолжаем задания
+    # не старше N минут (старше - возврат), завершённые храним N дней
+    GENERATION_JOB_MAX_AGE_MINUTES = int(os.getenv('GENERATION_JOB_MAX_AGE_MINUTES', '60'))
+    GENERATION_JOB_KEEP_DAYS = int(os.getenv('GENERATION_JOB_KEEP_DAYS', '7'))
+    # Планировщик генераций (services/generation_scheduler.py): одновременно на весь бот / на пользователя
+    GENERATION_MAX_CONCURRENT = int(os.getenv('GENERATION_MAX_CONCURRENT', '10'))
+    GENERATION_MAX_PER_USER = int(os.getenv('GENERATION_MAX_PER_USER', '1'))
+    # Hedging KIE → Replicate (services/hedging.py): сколько успешных KIE нужно для p90
+    # и через сколько секунд запускать Replicate, пока истории мало.
+    # Включение и дневной лимит - в settings (hedging_enabled, hedging_daily_cap), команда /hedging
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '10'))
+    HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', '120'))
+    # Circuit breaker провайдеров (services/circuit_breaker.py): окно последних вызовов,
+    # порог ошибок / медленных вызовов и сколько секунд провайдер пропускается после срабатывания
+    CIRCUIT_WINDOW = int(os.getenv('CIRCUIT_WINDOW', '20'))
+    CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))
+    CIRCUIT_FAILURE_RATE = float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5'))
+    CIRCUIT_SLOW_CALL_RATE = float(os.getenv('CIRCUIT_SLOW_CALL_RATE', '0.8'))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '60'))
+    CIRCUIT_KIE_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_KIE_SLOW_CALL_SECONDS', '180'))
+    CIRCUIT_REPLICATE_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_REPLICATE_SLOW_CALL_SECONDS', '120'))
+    # Replicate predictions API (services/replicate_api.py): интервал опроса статуса и общий тайм-аут, сек
+    REPLICATE_POLL_INTERVAL = float(os.getenv('REPLICATE_POLL_INTERVAL', '2'))
+    REPLICATE_TIMEOUT = float(os.getenv('REPLICATE_TIMEOUT', '300'))
+    # Кэш getFile Telegram (services/telegram_files.py): file_id → URL, ссылка живёт ~1 час
+    TELEGRAM_FILE_URL_TTL = float(os.getenv('TELEGRAM_FILE_URL_TTL', '3300'))
+    TELEGRAM_FILE_CACHE_SIZE = int(os.getenv('TELEGRAM_FILE_CACHE_SIZE', '1000'))
+    # Результаты генераций (services/result_images.py): дисковый кэш картинок и file_id Telegram по URL
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', 'cache/results')
+    RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', '200'))
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))
+    RESULT_DOWNLOAD_TIMEOUT = float(os.getenv('RESULT_DOWNLOAD_TIMEOUT', '30'))
+    # Максимальный размер скачиваемого результата (лимит Telegram на загрузку фото - 10 МБ)
+    RESULT_DOWNLOAD_MAX_MB = int(os.getenv('RESULT_DOWNLOAD_MAX_MB', '10'))
+    # Кэш результатов генераций (services/generation_cache.py): одинаковый запрос (фото + промпт + модель)
+    # за GENERATION_CACHE_TTL сек получает готовый URL без вызова провайдера (и без списания). 0 - выключено.
+    # Коротко: двойное нажатие / повтор после ошибки отправки; осознанный повтор стиля идёт к провайдеру
+    GENERATION_CACHE_TTL = float(os.getenv('GENERATION_CACHE_TTL', '20'))
+    GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', '500'))
+    # YooKassa API (services/payment_api.py): одновременных запросов и тайм-аут запроса, сек
+    YOOKASSA_MAX_CONCURRENT = int(os.getenv('YOOKASSA_MAX_CONCURRENT', '5'))
+    YOOKASSA_TIMEOUT = float(os.getenv('YOOKASSA_TIMEOUT', '15'))
+    # Повторы при сетевой ошибке / 5xx (POST - с тем же Idempotence-Key, второй платёж не создаётся)
+    YOOKASSA_RETRIES = int(os.getenv('YOOKASSA_RETRIES', '2'))
 
     # Free generations for new users
     FREE_GENERATIONS = 3
@@ -1,6 +1,9 @@
 # ========================================
 # ФАЙЛ: bot/config_kie.py
 # НАЗНАЧЕНИЕ: Конфигурация Nano Banana API по Kie.ai
+# ВЕРСИЯ: 2.5 (2026-10-18) - SECURITY: CALLBACK ТОЛЬКО С KIE_CALLBACK_SECRET
+# ВЕРСИЯ: 2.4 (2026-10-18) - PERF: ПРЕДОБРАБОТКА ВХОДНЫХ ФОТО (уменьшение, без EXIF)
+# ВЕРСИЯ: 2.3 (2026-10-18) - ДОБАВЛЕНЫ CALLBACK (вебхук завершения задач Kie.ai)
 # ВЕРСИЯ: 2.2 (2025-12-24) - ДОБАВЛЕНА ПОДДЕРЖКА PRO РЕЖИМА
 # ========================================
 # ИНСТРУКЦИЯ:
@@ -61,6 +64,49 @@ class KieConfig:
     KIE_API_TIMEOUT_BASE: int = int(os.getenv('KIE_API_TIMEOUT_BASE', '300'))
     KIE_API_TIMEOUT_PRO: int = int(os.getenv('KIE_API_TIMEOUT_PRO', '600'))
     
+    # ===== АДАПТИВНЫЙ POLLING [НОВОЕ 2026-10-18] =====
+    # Границы интервала опроса (сек) и сколько задач модели нужно, чтобы начать подстраиваться
+    KIE_POLL_MIN_INTERVAL: float = float(os.getenv('KIE_POLL_MIN_INTERVAL', '1'))
+    KIE_POLL_MAX_INTERVAL: float = float(os.getenv('KIE_POLL_MAX_INTERVAL', '20'))
+    KIE_POLL_MIN_SAMPLES: int = int(os.getenv('KIE_POLL_MIN_SAMPLES', '5'))
+
+    # ===== ТРЕКЕР ЗАДАЧ [НОВОЕ 2026-10-18] =====
+    # Сколько recordInfo одновременно на одном тике и сколько ждать один ответ (сек)
+    KIE_TRACKER_MAX_CONCURRENT_CHECKS: int = int(os.getenv('KIE_TRACKER_MAX_CONCURRENT_CHECKS', '10'))
+    KIE_TRACKER_CHECK_TIMEOUT: float = float(os.getenv('KIE_TRACKER_CHECK_TIMEOUT', '15'))
+
+    # ===== CALLBACK ЗАВЕРШЕНИЯ ЗАДАЧ [НОВОЕ 2026-10-18] =====
+    # Публичный адрес бота (https://bot.example.com). Пусто = callback выключен, только polling
+    KIE_CALLBACK_BASE_URL: str = os.getenv('KIE_CALLBACK_BASE_URL', '').rstrip('/')
+    KIE_CALLBACK_PATH: str = os.getenv('KIE_CALLBACK_PATH', '/webhook/kie')
+    # Секрет в query (?token=...) - чужие запросы на endpoint отбрасываются.
+    # Обязателен: без него callback выключен (иначе кто угодно подставит свой resultUrls)
+    KIE_CALLBACK_SECRET: str = os.getenv('KIE_CALLBACK_SECRET', '')
+    # С callback polling остаётся страховкой - редкий опрос, секунды
+    KIE_CALLBACK_SAFETY_POLL_INTERVAL: int = int(os.getenv('KIE_CALLBACK_SAFETY_POLL_INTERVAL', '30'))
+
+    # ===== ПРЕДОБРАБОТКА ВХОДНЫХ ФОТО [НОВОЕ 2026-10-18] =====
+    # Фото уменьшается до разрешения модели и раздаётся веб-сервером callback (нужен KIE_CALLBACK_BASE_URL)
+    KIE_INPUT_PREPROCESS: bool = os.getenv('KIE_INPUT_PREPROCESS', 'True').lower() == 'true'
+    KIE_INPUT_PATH: str = os.getenv('KIE_INPUT_PATH', '/kie/input')
+    KIE_INPUT_DIR: str = os.getenv('KIE_INPUT_DIR', 'cache/inputs')
+    # Длинная сторона для BASE модели (PRO - по KIE_NANO_BANANA_PRO_RESOLUTION)
+    KIE_INPUT_BASE_MAX_SIDE: int = int(os.getenv('KIE_INPUT_BASE_MAX_SIDE', '1024'))
+    KIE_INPUT_JPEG_QUALITY: int = int(os.getenv('KIE_INPUT_JPEG_QUALITY', '90'))
+    # Сколько секунд файл доступен Kie.ai, секунды
+    KIE_INPUT_TTL: int = int(os.getenv('KIE_INPUT_TTL', '1800'))
+    # Процессов для обработки (Pillow держит GIL - поэтому не потоки)
+    KIE_INPUT_WORKERS: int = int(os.getenv('KIE_INPUT_WORKERS', '2'))
+    # Предел на скачивание + обработку одного фото, секунды (дольше - отправляем ссылку Telegram как есть)
+    KIE_INPUT_TIMEOUT: float = float(os.getenv('KIE_INPUT_TIMEOUT', '30'))
+
+    @property
+    def KIE_CALLBACK_URL(self) -> Optional[str]:
+        """Полный callBackUrl для createTask или None, если callback не настроен (нет адреса или секрета)"""
+        if not self.KIE_CALLBACK_BASE_URL or not self.KIE_CALLBACK_SECRET:
+            return None
+        return f"{self.KIE_CALLBACK_BASE_URL}{self.KIE_CALLBACK_PATH}?token={self.KIE_CALLBACK_SECRET}"
+
     @property
     def KIE_API_TIMEOUT(self) -> int:
         """
@@ -96,6 +142,8 @@ class KieConfig:
   Timeout (BASE): {cls.KIE_API_TIMEOUT_BASE}s
   Timeout (PRO): {cls.KIE_API_TIMEOUT_PRO}s
   Fallback: {cls.KIE_FALLBACK_TO_REPLICATE}
+  Callback: {cls.KIE_CALLBACK_BASE_URL or 'выключен'}
+  Input preprocess: {cls.KIE_INPUT_PREPROCESS}
         """
 
 
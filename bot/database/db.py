@@ -1,4 +1,15 @@
 # bot/database/db.py
+# --- ОБНОВЛЕНО: 2026-10-18 21:00 - auto_vacuum=INCREMENTAL для новой БД (до WAL и создания таблиц) ---
+# --- ОБНОВЛЕНО: 2026-10-18 20:00 - НОВОЕ: generation_jobs (задания генерации), возврат по заданию атомарно со статусом ---
+# --- ОБНОВЛЕНО: 2026-10-18 19:00 - PERF: Кэш настроек в памяти (get_setting/get_settings/get_setting_int), сброс в set_setting ---
+# --- ОБНОВЛЕНО: 2026-10-18 17:00 - НОВОЕ: search_user()/search_users() - поиск по id, username и префиксу username по индексу ---
+# --- ОБНОВЛЕНО: 2026-10-18 16:00 - PERF: get_users_page() - keyset-пагинация вместо get_recent_users(limit=1000) ---
+# --- ОБНОВЛЕНО: 2026-10-18 15:00 - PERF: get_dashboard_snapshot() - один запрос + общий TTL-кэш для всех админов ---
+# --- ОБНОВЛЕНО: 2026-10-18 14:00 - PERF: Статистика читает дневные rollup-таблицы, периоды считаются календарными днями (UTC) ---
+# --- ОБНОВЛЕНО: 2026-10-18 13:00 - PERF: Версионные миграции с индексами, SQL статистики в models.py, get_revenue_by_period/get_average_payment ---
+# --- ОБНОВЛЕНО: 2026-10-18 12:00 - НОВОЕ: try_reserve_generation() - атомарное списание + GenerationReservation ---
+# --- ОБНОВЛЕНО: 2026-10-18 11:00 - PERF: Write-behind буфер для log_activity/log_generation/save_chat_menu ---
+# --- ОБНОВЛЕНО: 2026-10-18 10:00 - PERF: Настоящий пул: 1 writer + N read-only WAL readers, метрики пула ---
 # --- ОБНОВЛЕНО: 2026-01-09 01:09 - CRITICAL FIX: Удалены вложенные функции из init_db, исправлен lifecycle пула ---
 # --- ОБНОВЛЕНО: 2026-01-03 18:56 - CLEAN: Убрано все миграции, таблица со всеми полями авто с начала ---
 # --- ОБНОВЛЕНО: 2026-01-03 17:51 - КРИТИЧНО: Добавлены методы save_sample_photo и get_user_photos ---
@@ -11,12 +22,18 @@
 # --- ОБНОВЛЕНО: 2025-12-04 11:36 - Добавлены методы для уведомлений и источников трафика ---
 # Добавлены методы get_user_recent_payments и get_referrer_info для расширенного поиска
 
+import asyncio
 import aiosqlite
+import json
 import logging
 import secrets
+import time
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, List, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
+from config import config
+from database.write_buffer import WriteBehindBuffer
 from database.models import (
     # Таблицы
     CREATE_USERS_TABLE, CREATE_PAYMENTS_TABLE,
@@ -27,17 +44,25 @@ from database.models import (
     CREATE_CHAT_MENUS_TABLE,
     CREATE_USER_PHOTOS_TABLE,
     CREATE_USER_SESSION_MODES_TABLE,
-    DEFAULT_SETTINGS,
+    DEFAULT_SETTINGS, MIGRATIONS,
     # Пользователи
-    GET_USER, CREATE_USER, UPDATE_BALANCE, DECREASE_BALANCE, GET_BALANCE, UPDATE_LAST_ACTIVITY,
+    GET_USER, CREATE_USER, GET_USER_CREATED_AT,
+    GET_USERS_PAGE_FIRST, GET_USERS_PAGE_AFTER, GET_USERS_PAGE_BEFORE,
+    SEARCH_USER_BY_ID, SEARCH_USER_BY_USERNAME, SEARCH_USER_BY_REFERRAL_CODE, SEARCH_USERS_BY_USERNAME_PREFIX,
+    UPDATE_BALANCE, DECREASE_BALANCE, RESERVE_BALANCE, GET_BALANCE,
     # Реферальные коды
     UPDATE_REFERRAL_CODE, GET_USER_BY_REFERRAL_CODE, UPDATE_REFERRED_BY, INCREMENT_REFERRALS_COUNT,
     # Платежи
-    CREATE_PAYMENT, GET_PENDING_PAYMENT, UPDATE_PAYMENT_STATUS,
-    # Генерации
-    CREATE_GENERATION, INCREMENT_TOTAL_GENERATIONS,
-    # Активность
-    LOG_USER_ACTIVITY,
+    CREATE_PAYMENT, GET_PENDING_PAYMENT, UPDATE_PAYMENT_STATUS, GET_PAYMENT_BY_YOOKASSA_ID,
+    # Задания генерации
+    CREATE_GENERATION_JOB, SET_GENERATION_JOB_TASK, SET_GENERATION_JOB_RESULT, FINISH_GENERATION_JOB,
+    GET_GENERATION_JOB_COST, GET_GENERATION_JOB_STATUS, GET_UNFINISHED_GENERATION_JOBS, DELETE_OLD_GENERATION_JOBS,
+    # Статистика
+    GET_TOTAL_USERS_COUNT, GET_NEW_USERS_COUNT_SINCE, GET_ACTIVE_USERS_COUNT_SINCE, GET_CONVERSION_RATE,
+    GET_TOTAL_GENERATIONS, GET_GENERATIONS_COUNT_SINCE, GET_FAILED_GENERATIONS_COUNT_SINCE,
+    GET_POPULAR_ROOMS, GET_POPULAR_STYLES,
+    GET_TOTAL_REVENUE, GET_REVENUE_SINCE, GET_SUCCESSFUL_PAYMENTS_COUNT, GET_AVERAGE_PAYMENT,
+    GET_DASHBOARD_SNAPSHOT,
     # Реферальный баланс
     GET_REFERRAL_BALANCE, ADD_REFERRAL_BALANCE, DECREASE_REFERRAL_BALANCE, UPDATE_TOTAL_PAID,
     # Реферальные начисления
@@ -49,9 +74,9 @@ from database.models import (
     # Реквизиты
     SET_PAYMENT_DETAILS, GET_PAYMENT_DETAILS,
     # Настройки
-    GET_SETTING, SET_SETTING, GET_ALL_SETTINGS,
+    SET_SETTING, GET_ALL_SETTINGS,
     # Единое меню
-    SAVE_CHAT_MENU, GET_CHAT_MENU, DELETE_CHAT_MENU,
+    GET_CHAT_MENU,
     # ФОТО
     SAVE_USER_PHOTO, GET_LAST_USER_PHOTO, SAVE_SAMPLE_PHOTO, GET_USER_PHOTOS,
     # PRO MODE
@@ -60,58 +85,260 @@ from database.models import (
 
 logger = logging.getLogger(__name__)
 
+
+class GenerationReservation:
+    """
+    🎟️ Зарезервированные (уже списанные) генерации.
+
+    Создаётся Database.try_reserve_generation(). После генерации обязательно
+    вызвать commit() (успех) или refund() (ошибка) - повторные вызовы безопасны.
+
+    Если резерв привязан к заданию генерации (job_id), возврат идёт через
+    refund_generation_job - баланс и статус задания меняются одной транзакцией,
+    и после перезапуска бота деньги не вернутся дважды.
+    """
+
+    def __init__(self, database: 'Database', user_id: int, cost: int):
+        self._database = database
+        self.user_id = user_id
+        self.cost = cost
+        self.state = 'reserved'  # reserved → committed | refunded
+        self.job_id: Optional[int] = None
+
+    def commit(self) -> None:
+        """✅ Генерация доставлена - списание окончательное"""
+        if self.state == 'reserved':
+            self.state = 'committed'
+
+    async def refund(self) -> bool:
+        """↩️ Генерация не удалась - вернуть списанное (только один раз)"""
+        if self.state != 'reserved':
+            return self.state == 'refunded'
+        self.state = 'refunded'
+        if self.job_id is not None:
+            refunded = await self._database.refund_generation_job(self.job_id)
+        else:
+            refunded = await self._database.increase_balance(self.user_id, self.cost)
+        if not refunded:
+            self.state = 'reserved'
+            return False
+        return True
+
+
 class Database:
-    def __init__(self, db_path: str = "bot.db"):
+    def __init__(self, db_path: str = "bot.db", read_pool_size: int = 4,
+                 write_flush_ms: int = 250, write_batch_rows: int = 200,
+                 dashboard_cache_ttl: int = 30):
         self.db_path = db_path
-        self.pool = None
+        self.read_pool_size = read_pool_size
+        self.pool = None  # writer-соединение (единственное, через которое идут записи)
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._writer_lock = asyncio.Lock()
+        self._init_lock = asyncio.Lock()
+        self._pool_stats = self._empty_pool_stats()
+        # Отложенная запись статистики и меню (write_flush_ms=0 → запись сразу)
+        self.write_buffer = WriteBehindBuffer(
+            self._write, flush_interval_ms=write_flush_ms, max_rows=write_batch_rows
+        )
+        # Сводка админ-панели: (время расчёта, данные), общая для всех админов
+        self.dashboard_cache_ttl = dashboard_cache_ttl
+        self._dashboard_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._dashboard_lock = asyncio.Lock()
+        # Таблица settings целиком в памяти (read-through, загружается один раз)
+        self._settings_cache: Optional[Dict[str, str]] = None
+        self._settings_lock = asyncio.Lock()
+
+    @staticmethod
+    def _empty_pool_stats() -> Dict[str, Any]:
+        return {
+            'writer_checkouts': 0,
+            'writer_wait_total': 0.0,
+            'writer_wait_max': 0.0,
+            'reader_checkouts': 0,
+            'reader_wait_total': 0.0,
+            'reader_wait_max': 0.0,
+            'reader_waiting': 0,
+        }
 
     async def init_pool(self) -> None:
-        """🔧 Инициализация пула (1 соединение на весь бот)"""
-        if self.pool is None:
-            self.pool = await aiosqlite.connect(self.db_path)
-            await self.pool.execute("PRAGMA journal_mode=WAL")
-            await self.pool.execute("PRAGMA busy_timeout=5000")
-            await self.pool.commit()
-            logger.info("✅ Пул соединений создан")
+        """🔧 Инициализация пула: 1 writer + read_pool_size read-only readers (WAL)"""
+        async with self._init_lock:
+            if self.pool is not None:
+                return
+
+            writer = await aiosqlite.connect(self.db_path)
+            writer.row_factory = aiosqlite.Row
+            # Действует только на пустой БД и только до перехода в WAL; на существующей
+            # БД ничего не меняет (перевод - DB_ENABLE_INCREMENTAL_VACUUM, см. retention.py)
+            await writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            await writer.execute("PRAGMA journal_mode=WAL")
+            await writer.execute("PRAGMA busy_timeout=5000")
+            await writer.execute("PRAGMA synchronous=NORMAL")
+            await writer.commit()
+
+            # ":memory:" у каждого соединения своя - читаем через writer
+            reader_count = 0 if self.db_path == ":memory:" else max(0, self.read_pool_size)
+            self._idle_readers = asyncio.Queue()
+            for _ in range(reader_count):
+                reader = await aiosqlite.connect(self.db_path)
+                reader.row_factory = aiosqlite.Row
+                await reader.execute("PRAGMA busy_timeout=5000")
+                await reader.execute("PRAGMA query_only=ON")
+                self._readers.append(reader)
+                self._idle_readers.put_nowait(reader)
+
+            self.pool = writer
+            logger.info(f"✅ Пул соединений создан (writer=1, readers={reader_count})")
 
     async def close_pool(self) -> None:
-        """🔧 Закрытие пула при выключении бота"""
+        """🔧 Закрытие пула при выключении бота (сначала дописывает write-behind буфер)"""
         if self.pool:
+            await self.write_buffer.close()
+
+            for reader in self._readers:
+                try:
+                    await reader.close()
+                except Exception as e:
+                    logger.warning(f"⚠️ Ошибка закрытия reader: {e}")
+            self._readers = []
+            self._idle_readers = None
+
             await self.pool.close()
             self.pool = None
-            logger.info("✅ Пул соединений закрыт")
+            logger.info(f"✅ Пул соединений закрыт: {self.get_pool_stats()}")
 
     async def _get_db(self) -> aiosqlite.Connection:
-        """🔧 Получить соединение (не закрывать его!)"""
+        """🔧 Получить writer-соединение (не закрывать его!)"""
         if self.pool is None:
             await self.init_pool()
         return self.pool
 
+    @asynccontextmanager
+    async def _write(self):
+        """
+        ✍️ Эксклюзивный доступ к writer: одна транзакция на блок.
+
+        Commit при успешном выходе, rollback при исключении (исключение пробрасывается).
+        """
+        db = await self._get_db()
+        started = time.monotonic()
+        async with self._writer_lock:
+            self._record_wait('writer', time.monotonic() - started)
+            try:
+                yield db
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+
+    @asynccontextmanager
+    async def _read(self):
+        """📖 Взять read-only соединение из пула (вернётся в пул автоматически)"""
+        if self.pool is None:
+            await self.init_pool()
+
+        if not self._readers:
+            yield self.pool
+            return
+
+        started = time.monotonic()
+        self._pool_stats['reader_waiting'] += 1
+        try:
+            reader = await self._idle_readers.get()
+        finally:
+            self._pool_stats['reader_waiting'] -= 1
+        self._record_wait('reader', time.monotonic() - started)
+
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+
+    def _record_wait(self, kind: str, waited: float) -> None:
+        stats = self._pool_stats
+        stats[f'{kind}_checkouts'] += 1
+        stats[f'{kind}_wait_total'] += waited
+        if waited > stats[f'{kind}_wait_max']:
+            stats[f'{kind}_wait_max'] = waited
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        📊 Метрики пула соединений.
+
+        Возвращает размер пула, число checkout'ов и время ожидания (сек)
+        отдельно для writer и readers.
+        """
+        stats = self._pool_stats
+        idle = self._idle_readers.qsize() if self._idle_readers is not None else 0
+        return {
+            'readers_total': len(self._readers),
+            'readers_idle': idle,
+            'readers_busy': len(self._readers) - idle,
+            'reader_waiting': stats['reader_waiting'],
+            'reader_checkouts': stats['reader_checkouts'],
+            'reader_wait_avg': round(stats['reader_wait_total'] / stats['reader_checkouts'], 6)
+            if stats['reader_checkouts'] else 0.0,
+            'reader_wait_max': round(stats['reader_wait_max'], 6),
+            'writer_checkouts': stats['writer_checkouts'],
+            'writer_wait_avg': round(stats['writer_wait_total'] / stats['writer_checkouts'], 6)
+            if stats['writer_checkouts'] else 0.0,
+            'writer_wait_max': round(stats['writer_wait_max'], 6),
+        }
+
+    def reset_pool_stats(self) -> None:
+        """📊 Сбросить накопленные метрики пула"""
+        self._pool_stats = self._empty_pool_stats()
+
+    @staticmethod
+    def _period_start_day(days: int) -> str:
+        """Первый день периода «последние N дней» (включая сегодня) в формате rollup-таблиц"""
+        today = datetime.now(timezone.utc).date()
+        return (today - timedelta(days=max(days, 1) - 1)).isoformat()
+
     async def init_db(self):
         """Инициализация таблиц БД"""
-        db = await self._get_db()
-        # Создаем все таблицы
-        await db.execute(CREATE_USERS_TABLE)
-        await db.execute(CREATE_PAYMENTS_TABLE)
-        await db.execute(CREATE_GENERATIONS_TABLE)
-        await db.execute(CREATE_USER_ACTIVITY_TABLE)
-        await db.execute(CREATE_ADMIN_NOTIFICATIONS_TABLE)
-        await db.execute(CREATE_USER_SOURCES_TABLE)
-        await db.execute(CREATE_CHAT_MENUS_TABLE)
-        await db.execute(CREATE_USER_PHOTOS_TABLE)  # Тут уже со всеми полями!
-        await db.execute(CREATE_USER_SESSION_MODES_TABLE)
-        await db.execute(CREATE_REFERRAL_EARNINGS_TABLE)
-        await db.execute(CREATE_REFERRAL_EXCHANGES_TABLE)
-        await db.execute(CREATE_REFERRAL_PAYOUTS_TABLE)
-        await db.execute(CREATE_SETTINGS_TABLE)
-
-        # Инициализируем дефолтные настройки
-        for key, value in DEFAULT_SETTINGS.items():
-            await db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
-
-        await db.commit()
+        async with self._write() as db:
+            # Создаем все таблицы
+            await db.execute(CREATE_USERS_TABLE)
+            await db.execute(CREATE_PAYMENTS_TABLE)
+            await db.execute(CREATE_GENERATIONS_TABLE)
+            await db.execute(CREATE_USER_ACTIVITY_TABLE)
+            await db.execute(CREATE_ADMIN_NOTIFICATIONS_TABLE)
+            await db.execute(CREATE_USER_SOURCES_TABLE)
+            await db.execute(CREATE_CHAT_MENUS_TABLE)
+            await db.execute(CREATE_USER_PHOTOS_TABLE)  # Тут уже со всеми полями!
+            await db.execute(CREATE_USER_SESSION_MODES_TABLE)
+            await db.execute(CREATE_REFERRAL_EARNINGS_TABLE)
+            await db.execute(CREATE_REFERRAL_EXCHANGES_TABLE)
+            await db.execute(CREATE_REFERRAL_PAYOUTS_TABLE)
+            await db.execute(CREATE_SETTINGS_TABLE)
+
+            # Инициализируем дефолтные настройки
+            for key, value in DEFAULT_SETTINGS.items():
+                await db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+            await self._apply_migrations(db)
+
+        self.invalidate_settings_cache()
         logger.info("✅ База данных инициализирована")
 
+    async def _apply_migrations(self, db: aiosqlite.Connection) -> None:
+        """🔧 Применить версионные миграции из models.MIGRATIONS (PRAGMA user_version)"""
+        async with db.execute("PRAGMA user_version") as cursor:
+            row = await cursor.fetchone()
+            current_version = row[0] if row else 0
+
+        for version, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            for statement in statements:
+                await db.execute(statement)
+            # PRAGMA не поддерживает параметры, version - int из models.py
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            current_version = version
+            logger.info(f"✅ Миграция БД v{version} применена ({len(statements)} команд)")
+
     # ===== 🔧 НОВОЕ: МЕТОДЫ ДЛЯ ФОТО (2026-01-03) =====
 
     async def save_main_photo(self, user_id: int, photo_id: str) -> bool:
@@ -127,10 +354,9 @@ class Database:
         Возвращает:
         - True если успешно сохранено, False при ошибке
         """
-        db = await self._get_db()
         try:
-            await db.execute(SAVE_USER_PHOTO, (user_id, photo_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SAVE_USER_PHOTO, (user_id, photo_id))
             logger.info(f"📷 ОСНОВНОЕ фото сохранено для user_id={user_id}")
             return True
         except Exception as e:
@@ -150,10 +376,9 @@ class Database:
         Возвращает:
         - True если успешно сохранено, False при ошибке
         """
-        db = await self._get_db()
         try:
-            await db.execute(SAVE_SAMPLE_PHOTO, (user_id, photo_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SAVE_SAMPLE_PHOTO, (user_id, photo_id))
             logger.info(f"🎨 ОБРАЗЕЦ фото сохранен для user_id={user_id}")
             return True
         except Exception as e:
@@ -170,34 +395,33 @@ class Database:
             'sample_photo_id': 'file_id или None'
         }
         """
-        db = await self._get_db()
-        try:
-            async with db.execute(GET_USER_PHOTOS, (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return {
-                        'main_photo_id': row[0],
-                        'sample_photo_id': row[1]
-                    }
-                else:
-                    logger.debug(f"⚠️ Фото не найдены для user_id={user_id}")
-                    return {
-                        'main_photo_id': None,
-                        'sample_photo_id': None
-                    }
-        except Exception as e:
-            logger.error(f"❌ Ошибка get_user_photos: {e}")
-            return {
-                'main_photo_id': None,
-                'sample_photo_id': None
-            }
+        async with self._read() as db:
+            try:
+                async with db.execute(GET_USER_PHOTOS, (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+                    if row:
+                        return {
+                            'main_photo_id': row[0],
+                            'sample_photo_id': row[1]
+                        }
+                    else:
+                        logger.debug(f"⚠️ Фото не найдены для user_id={user_id}")
+                        return {
+                            'main_photo_id': None,
+                            'sample_photo_id': None
+                        }
+            except Exception as e:
+                logger.error(f"❌ Ошибка get_user_photos: {e}")
+                return {
+                    'main_photo_id': None,
+                    'sample_photo_id': None
+                }
 
     async def save_user_photo(self, user_id: int, photo_id: str) -> bool:
         """📄 Сохранить фото (скомонат для обратной совместимости)"""
-        db = await self._get_db()
         try:
-            await db.execute(SAVE_USER_PHOTO, (user_id, photo_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SAVE_USER_PHOTO, (user_id, photo_id))
             logger.info(f"📄 Фото сохранена для user_id={user_id}")
             return True
         except Exception as e:
@@ -206,58 +430,56 @@ class Database:
 
     async def get_last_user_photo(self, user_id: int) -> Optional[str]:
         """📄 Получить последнюю фото (скомонат для обратной совместимости)"""
-        db = await self._get_db()
-        try:
-            async with db.execute(GET_LAST_USER_PHOTO, (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    photo_id = row[0]
-                    logger.info(f"✅ Найдена фото для user_id={user_id}")
-                    return photo_id
-                else:
-                    logger.debug(f"⚠️ Фото не найдена для user_id={user_id}")
-                    return None
-        except Exception as e:
-            logger.error(f"❌ Ошибка get_last_user_photo: {e}")
-            return None
+        async with self._read() as db:
+            try:
+                async with db.execute(GET_LAST_USER_PHOTO, (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+                    if row:
+                        photo_id = row[0]
+                        logger.info(f"✅ Найдена фото для user_id={user_id}")
+                        return photo_id
+                    else:
+                        logger.debug(f"⚠️ Фото не найдена для user_id={user_id}")
+                        return None
+            except Exception as e:
+                logger.error(f"❌ Ошибка get_last_user_photo: {e}")
+                return None
 
     # ===== PRO MODE FUNCTIONS =====
 
     async def get_user_pro_settings(self, user_id: int) -> Dict[str, Any]:
         """Получить все параметры PRO режима пользователя"""
-        db = await self._get_db()
-        try:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(GET_USER_PRO_SETTINGS, (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
+        async with self._read() as db:
+            try:
+                async with db.execute(GET_USER_PRO_SETTINGS, (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+                    if row:
+                        return {
+                            'pro_mode': bool(row['pro_mode']),
+                            'pro_aspect_ratio': row['pro_aspect_ratio'],
+                            'pro_resolution': row['pro_resolution'],
+                            'pro_mode_changed_at': row['pro_mode_changed_at']
+                        }
                     return {
-                        'pro_mode': bool(row['pro_mode']),
-                        'pro_aspect_ratio': row['pro_aspect_ratio'],
-                        'pro_resolution': row['pro_resolution'],
-                        'pro_mode_changed_at': row['pro_mode_changed_at']
+                        'pro_mode': False,
+                        'pro_aspect_ratio': '16:9',
+                        'pro_resolution': '1K',
+                        'pro_mode_changed_at': None
                     }
+            except Exception as e:
+                logger.error(f"❌ Ошибка get_user_pro_settings: {e}")
                 return {
                     'pro_mode': False,
                     'pro_aspect_ratio': '16:9',
                     'pro_resolution': '1K',
                     'pro_mode_changed_at': None
                 }
-        except Exception as e:
-            logger.error(f"❌ Ошибка get_user_pro_settings: {e}")
-            return {
-                'pro_mode': False,
-                'pro_aspect_ratio': '16:9',
-                'pro_resolution': '1K',
-                'pro_mode_changed_at': None
-            }
 
     async def set_user_pro_mode(self, user_id: int, mode: bool) -> bool:
         """Установить режим (True = PRO, False = СТАНДАРТ)"""
-        db = await self._get_db()
         try:
-            await db.execute(SET_USER_PRO_MODE, (1 if mode else 0, user_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SET_USER_PRO_MODE, (1 if mode else 0, user_id))
             mode_name = "PRO 🔧" if mode else "СТАНДАРТ 📋"
             logger.info(f"✅ Режим изменён на {mode_name} для user_id={user_id}")
             return True
@@ -272,10 +494,9 @@ class Database:
             logger.warning(f"❌ Неверное соотношение: {ratio}")
             return False
 
-        db = await self._get_db()
         try:
-            await db.execute(SET_PRO_ASPECT_RATIO, (ratio, user_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SET_PRO_ASPECT_RATIO, (ratio, user_id))
             logger.info(f"✅ Соотношение {ratio}")
             return True
         except Exception as e:
@@ -289,10 +510,9 @@ class Database:
             logger.warning(f"❌ Неверное разрешение: {resolution}")
             return False
 
-        db = await self._get_db()
         try:
-            await db.execute(SET_PRO_RESOLUTION, (resolution, user_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SET_PRO_RESOLUTION, (resolution, user_id))
             logger.info(f"✅ Разрешение {resolution}")
             return True
         except Exception as e:
@@ -303,12 +523,9 @@ class Database:
 
     async def save_chat_menu(self, chat_id: int, user_id: int, menu_message_id: int,
                              screen_code: str = 'main_menu') -> bool:
-        """Сохранить/обновить menu"""
-        db = await self._get_db()
+        """Сохранить/обновить menu (через write-behind буфер)"""
         try:
-            await db.execute(SAVE_CHAT_MENU,
-                             (chat_id, user_id, menu_message_id, screen_code))
-            await db.commit()
+            await self.write_buffer.put_chat_menu(chat_id, user_id, menu_message_id, screen_code)
             logger.debug(f"📃 Saved menu: chat={chat_id}, msgid={menu_message_id}")
             return True
         except Exception as e:
@@ -316,21 +533,22 @@ class Database:
             return False
 
     async def get_chat_menu(self, chat_id: int) -> Optional[Dict[str, Any]]:
-        """Получить данные меню"""
-        db = await self._get_db()
-        db.row_factory = aiosqlite.Row
-        async with db.execute(GET_CHAT_MENU, (chat_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+        """Получить данные меню (буфер ещё не записанных меню имеет приоритет)"""
+        found, pending = self.write_buffer.pending_chat_menu(chat_id)
+        if found:
+            return pending
+
+        async with self._read() as db:
+            async with db.execute(GET_CHAT_MENU, (chat_id,)) as cursor:
+                row = await cursor.fetchone()
+                if row:
+                    return dict(row)
+                return None
 
     async def delete_chat_menu(self, chat_id: int) -> bool:
-        """Удалить запись о меню"""
-        db = await self._get_db()
+        """Удалить запись о меню (через буфер, чтобы не обогнать отложенное сохранение)"""
         try:
-            await db.execute(DELETE_CHAT_MENU, (chat_id,))
-            await db.commit()
+            await self.write_buffer.drop_chat_menu(chat_id)
             logger.debug(f"🗑️ Deleted menu")
             return True
         except Exception as e:
@@ -382,21 +600,20 @@ class Database:
     # ===== ПОЛЬЗОВАТЕЛИ =====
 
     async def create_user(self, user_id: int, username: str = None, referrer_code: str = None) -> bool:
-        db = await self._get_db()
         try:
-            async with db.execute(GET_USER, (user_id,)) as cursor:
-                existing = await cursor.fetchone()
-                if existing:
-                    return False
+            async with self._write() as db:
+                async with db.execute(GET_USER, (user_id,)) as cursor:
+                    existing = await cursor.fetchone()
+                    if existing:
+                        return False
 
-            ref_code = secrets.token_urlsafe(8)
-            initial_balance = int(await self.get_setting('welcome_bonus') or '3')
-            await db.execute(CREATE_USER, (user_id, username, initial_balance, ref_code))
+                ref_code = secrets.token_urlsafe(8)
+                initial_balance = await self.get_setting_int('welcome_bonus', 3)
+                await db.execute(CREATE_USER, (user_id, username, initial_balance, ref_code))
 
-            if referrer_code:
-                await self._process_referral(db, user_id, referrer_code)
+                if referrer_code:
+                    await self._process_referral(db, user_id, referrer_code)
 
-            await db.commit()
             logger.info(f"Пользователь {user_id} создан")
             return True
         except Exception as e:
@@ -414,8 +631,8 @@ class Database:
             await db.execute(UPDATE_REFERRED_BY, (referrer_id, user_id))
             await db.execute(INCREMENT_REFERRALS_COUNT, (referrer_id,))
 
-            inviter_bonus = int(await self.get_setting('referral_bonus_inviter') or '2')
-            invited_bonus = int(await self.get_setting('referral_bonus_invited') or '2')
+            inviter_bonus = await self.get_setting_int('referral_bonus_inviter', 2)
+            invited_bonus = await self.get_setting_int('referral_bonus_invited', 2)
 
             await db.execute(UPDATE_BALANCE, (inviter_bonus, referrer_id))
             await db.execute(UPDATE_BALANCE, (invited_bonus, user_id))
@@ -424,25 +641,128 @@ class Database:
             logger.error(f"Ошибка: {e}")
 
     async def get_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
-        db = await self._get_db()
-        db.row_factory = aiosqlite.Row
-        async with db.execute(GET_USER, (user_id,)) as cursor:
-            row = await cursor.fetchone()
+        async with self._read() as db:
+            async with db.execute(GET_USER, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                if row:
+                    return dict(row)
+                return None
+
+    async def get_users_page(self, after_created_at: Optional[str] = None, after_user_id: Optional[int] = None,
+                             page_size: int = 10, reverse: bool = False) -> List[Dict[str, Any]]:
+        """
+        👥 Страница пользователей (новые сверху), keyset-пагинация по (created_at, user_id).
+
+        Без курсора - первая страница. Курсор - последняя строка предыдущей страницы;
+        если передан только after_user_id, created_at берётся из БД.
+        reverse=True - страница ПЕРЕД курсором (кнопка «назад»), курсор - первая строка текущей.
+        Стоимость O(page_size) независимо от числа пользователей.
+        """
+        async with self._read() as db:
+            if after_user_id is not None and after_created_at is None:
+                async with db.execute(GET_USER_CREATED_AT, (after_user_id,)) as cursor:
+                    row = await cursor.fetchone()
+                if not row:
+                    after_user_id = None
+                else:
+                    after_created_at = row[0]
+
+            if after_user_id is None:
+                query, params = GET_USERS_PAGE_FIRST, (page_size,)
+            elif reverse:
+                query, params = GET_USERS_PAGE_BEFORE, (after_created_at, after_user_id, page_size)
+            else:
+                query, params = GET_USERS_PAGE_AFTER, (after_created_at, after_user_id, page_size)
+
+            async with db.execute(query, params) as cursor:
+                rows = [dict(row) for row in await cursor.fetchall()]
+
+        if reverse and after_user_id is not None:
+            rows.reverse()
+        return rows
+
+    # ===== ПОИСК ПОЛЬЗОВАТЕЛЕЙ (АДМИНКА) =====
+
+    @staticmethod
+    def _normalize_username(query: str) -> str:
+        """'@Ivan_Petrov ' → 'ivan_petrov' (как в индексе idx_users_username_lower)"""
+        return query.strip().lstrip('@').lower()
+
+    async def search_user(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        🔍 Найти одного пользователя: точный ID → точный username → реферальный код →
+        первый по алфавиту username с таким префиксом. Все шаги идут по индексам.
+        """
+        query = (query or '').strip()
+        if not query:
+            return None
+
+        async with self._read() as db:
+            if query.isdigit():
+                async with db.execute(SEARCH_USER_BY_ID, (int(query),)) as cursor:
+                    row = await cursor.fetchone()
+                if row:
+                    return dict(row)
+
+            username = self._normalize_username(query)
+            if username:
+                async with db.execute(SEARCH_USER_BY_USERNAME, (username,)) as cursor:
+                    row = await cursor.fetchone()
+                if row:
+                    return dict(row)
+
+            async with db.execute(SEARCH_USER_BY_REFERRAL_CODE, (query,)) as cursor:
+                row = await cursor.fetchone()
             if row:
                 return dict(row)
-            return None
+
+        matches = await self.search_users(query, limit=1)
+        return matches[0] if matches else None
+
+    async def search_users(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """🔍 Пользователи, чей username начинается с prefix (без учёта регистра, '@' можно)"""
+        prefix = self._normalize_username(prefix or '')
+        if not prefix:
+            return []
+        # Верхняя граница диапазона: последний символ +1 ('ivan' → 'ivao')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        async with self._read() as db:
+            async with db.execute(SEARCH_USERS_BY_USERNAME_PREFIX, (prefix, upper, limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
 
     async def get_balance(self, user_id: int) -> int:
-        db = await self._get_db()
-        async with db.execute(GET_BALANCE, (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        async with self._read() as db:
+            async with db.execute(GET_BALANCE, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+
+    async def try_reserve_generation(self, user_id: int, cost: int = 1) -> Optional[GenerationReservation]:
+        """
+        🎟️ Атомарно проверить и списать cost генераций одним UPDATE ... WHERE balance >= ?
+
+        Возвращает GenerationReservation (commit()/refund()) или None,
+        если баланса не хватает (или ошибка БД). Двойное нажатие не уведёт баланс в минус.
+        """
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(RESERVE_BALANCE, (cost, user_id, cost))
+                reserved = cursor.rowcount == 1
+                await cursor.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка try_reserve_generation: {e}")
+            return None
+
+        if not reserved:
+            logger.info(f"💰 Недостаточно баланса: user_id={user_id}, cost={cost}")
+            return None
+
+        logger.debug(f"🎟️ Зарезервировано {cost} для user_id={user_id}")
+        return GenerationReservation(self, user_id, cost)
 
     async def decrease_balance(self, user_id: int) -> bool:
-        db = await self._get_db()
         try:
-            await db.execute(DECREASE_BALANCE, (user_id,))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(DECREASE_BALANCE, (user_id,))
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
@@ -450,21 +770,125 @@ class Database:
 
     async def increase_balance(self, user_id: int, tokens: int) -> bool:
         """Увеличить баланс на N токенов"""
-        db = await self._get_db()
         try:
-            await db.execute(UPDATE_BALANCE, (tokens, user_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(UPDATE_BALANCE, (tokens, user_id))
             logger.info(f"✅ Возвращено {tokens}")
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка: {e}")
             return False
 
+    # ===== ЗАДАНИЯ ГЕНЕРАЦИИ =====
+
+    async def create_generation_job(self, user_id: int, chat_id: int, mode: str,
+                                    params: Optional[Dict[str, Any]] = None, cost: int = 0) -> Optional[int]:
+        """🧾 Создать задание генерации (status='running'), вернуть его id"""
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(
+                    CREATE_GENERATION_JOB,
+                    (user_id, chat_id, mode, json.dumps(params or {}, ensure_ascii=False), cost)
+                )
+                job_id = cursor.lastrowid
+                await cursor.close()
+            return job_id
+        except Exception as e:
+            logger.error(f"❌ Ошибка create_generation_job: {e}")
+            return None
+
+    async def set_generation_job_task(self, job_id: int, provider: str, task_id: str,
+                                      model_key: Optional[str] = None) -> bool:
+        """Запомнить задачу провайдера - по ней задание продолжится после перезапуска"""
+        try:
+            async with self._write() as db:
+                await db.execute(SET_GENERATION_JOB_TASK, (provider, task_id, model_key, job_id))
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка set_generation_job_task: {e}")
+            return False
+
+    async def set_generation_job_result(self, job_id: int, result_url: str) -> bool:
+        try:
+            async with self._write() as db:
+                await db.execute(SET_GENERATION_JOB_RESULT, (result_url, job_id))
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка set_generation_job_result: {e}")
+            return False
+
+    async def finish_generation_job(self, job_id: int, status: str, error: Optional[str] = None) -> bool:
+        """Финальный статус (delivered/failed). False - задание уже завершено или ошибка БД"""
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(FINISH_GENERATION_JOB, (status, error, job_id))
+                finished = cursor.rowcount == 1
+                await cursor.close()
+            return finished
+        except Exception as e:
+            logger.error(f"❌ Ошибка finish_generation_job: {e}")
+            return False
+
+    async def refund_generation_job(self, job_id: int, error: Optional[str] = None) -> bool:
+        """
+        ↩️ Вернуть cost задания и пометить его refunded - одной транзакцией.
+
+        True - возврат сделан сейчас или раньше; False - задание уже доставлено или ошибка БД.
+        """
+        try:
+            async with self._write() as db:
+                async with db.execute(GET_GENERATION_JOB_COST, (job_id,)) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    return False
+                cursor = await db.execute(FINISH_GENERATION_JOB, ('refunded', error, job_id))
+                finished = cursor.rowcount == 1
+                await cursor.close()
+                if finished and row['cost']:
+                    await db.execute(UPDATE_BALANCE, (row['cost'], row['user_id']))
+            if finished:
+                logger.info(f"↩️ Задание #{job_id}: возвращено {row['cost']} user_id={row['user_id']}")
+                return True
+            return await self._generation_job_status(job_id) == 'refunded'
+        except Exception as e:
+            logger.error(f"❌ Ошибка refund_generation_job: {e}")
+            return False
+
+    async def _generation_job_status(self, job_id: int) -> Optional[str]:
+        async with self._read() as db:
+            async with db.execute(GET_GENERATION_JOB_STATUS, (job_id,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+
+    async def get_unfinished_generation_jobs(self) -> List[Dict[str, Any]]:
+        """Задания, не доведённые до конца (бот остановился во время генерации)"""
+        async with self._read() as db:
+            async with db.execute(GET_UNFINISHED_GENERATION_JOBS) as cursor:
+                jobs = [dict(row) for row in await cursor.fetchall()]
+        for job in jobs:
+            try:
+                job['params'] = json.loads(job['params'] or '{}')
+            except ValueError:
+                job['params'] = {}
+        return jobs
+
+    async def delete_old_generation_jobs(self, keep_days: int) -> int:
+        """Удалить завершённые задания старше keep_days дней"""
+        threshold = (datetime.now(timezone.utc) - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(DELETE_OLD_GENERATION_JOBS, (threshold,))
+                deleted = cursor.rowcount
+                await cursor.close()
+            return deleted
+        except Exception as e:
+            logger.error(f"❌ Ошибка delete_old_generation_jobs: {e}")
+            return 0
+
     async def add_tokens(self, user_id: int, tokens: int) -> bool:
-        db = await self._get_db()
         try:
-            await db.execute(UPDATE_BALANCE, (tokens, user_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(UPDATE_BALANCE, (tokens, user_id))
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
@@ -473,42 +897,38 @@ class Database:
     # ===== ПЛАТЕЖИ =====
 
     async def create_payment(self, payment_id: str, user_id: int, amount: int, tokens: int) -> bool:
-        db = await self._get_db()
         try:
-            await db.execute(CREATE_PAYMENT, (user_id, payment_id, amount, tokens, 'pending'))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(CREATE_PAYMENT, (user_id, payment_id, amount, tokens, 'pending'))
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
             return False
 
     async def update_payment_status(self, payment_id: str, status: str) -> bool:
-        db = await self._get_db()
         try:
-            await db.execute(UPDATE_PAYMENT_STATUS, (status, payment_id))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(UPDATE_PAYMENT_STATUS, (status, payment_id))
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
             return False
 
     async def get_payment(self, payment_id: str) -> Optional[Dict[str, Any]]:
-        db = await self._get_db()
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM payments WHERE yookassa_payment_id = ?", (payment_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+        async with self._read() as db:
+            async with db.execute(GET_PAYMENT_BY_YOOKASSA_ID, (payment_id,)) as cursor:
+                row = await cursor.fetchone()
+                if row:
+                    return dict(row)
+                return None
 
     async def get_last_pending_payment(self, user_id: int) -> Optional[Dict[str, Any]]:
-        db = await self._get_db()
-        db.row_factory = aiosqlite.Row
-        async with db.execute(GET_PENDING_PAYMENT, (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+        async with self._read() as db:
+            async with db.execute(GET_PENDING_PAYMENT, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                if row:
+                    return dict(row)
+                return None
 
     async def set_payment_success(self, payment_id: str) -> bool:
         return await self.update_payment_status(payment_id, 'succeeded')
@@ -517,162 +937,252 @@ class Database:
 
     async def log_generation(self, user_id: int, room_type: str, style_type: str,
                              operation_type: str = 'design', success: bool = True) -> bool:
-        db = await self._get_db()
+        """Записать генерацию (через write-behind буфер)"""
         try:
-            await db.execute(CREATE_GENERATION, (user_id, room_type, style_type, operation_type, success))
-            await db.execute(INCREMENT_TOTAL_GENERATIONS, (user_id,))
-            await db.execute(UPDATE_LAST_ACTIVITY, (user_id,))
-            await db.commit()
+            await self.write_buffer.add_generation(user_id, room_type, style_type, operation_type, success)
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
             return False
 
     async def get_total_generations(self) -> int:
-        db = await self._get_db()
-        async with db.execute("SELECT COUNT(*) FROM generations") as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        async with self._read() as db:
+            async with db.execute(GET_TOTAL_GENERATIONS) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
 
     async def get_generations_count(self, days: int = 1) -> int:
-        date_threshold = datetime.now() - timedelta(days=days)
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT COUNT(*) FROM generations WHERE created_at >= ?",
-                (date_threshold.isoformat(),)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        first_day = self._period_start_day(days)
+        async with self._read() as db:
+            async with db.execute(
+                    GET_GENERATIONS_COUNT_SINCE,
+                    (first_day,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
 
     async def get_failed_generations_count(self, days: int = 1) -> int:
-        date_threshold = datetime.now() - timedelta(days=days)
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT COUNT(*) FROM generations WHERE success = 0 AND created_at >= ?",
-                (date_threshold.isoformat(),)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        first_day = self._period_start_day(days)
+        async with self._read() as db:
+            async with db.execute(
+                    GET_FAILED_GENERATIONS_COUNT_SINCE,
+                    (first_day,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
 
     async def get_conversion_rate(self) -> float:
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT AVG(total_generations) FROM users WHERE total_generations > 0"
-        ) as cursor:
-            row = await cursor.fetchone()
-            return round(row[0], 2) if row and row[0] else 0.0
+        async with self._read() as db:
+            async with db.execute(
+                    GET_CONVERSION_RATE
+            ) as cursor:
+                row = await cursor.fetchone()
+                return round(row[0], 2) if row and row[0] else 0.0
 
     async def get_popular_rooms(self, limit: int = 10) -> List[Dict[str, Any]]:
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT room_type, COUNT(*) as count FROM generations GROUP BY room_type ORDER BY count DESC LIMIT ?",
-                (limit,)
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [{'room_type': row[0], 'count': row[1]} for row in rows]
+        async with self._read() as db:
+            async with db.execute(
+                    GET_POPULAR_ROOMS,
+                    (limit,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [{'room_type': row[0], 'count': row[1]} for row in rows]
 
     async def get_popular_styles(self, limit: int = 10) -> List[Dict[str, Any]]:
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT style_type, COUNT(*) as count FROM generations GROUP BY style_type ORDER BY count DESC LIMIT ?",
-                (limit,)
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [{'style_type': row[0], 'count': row[1]} for row in rows]
+        async with self._read() as db:
+            async with db.execute(
+                    GET_POPULAR_STYLES,
+                    (limit,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [{'style_type': row[0], 'count': row[1]} for row in rows]
 
     # ===== АКТИВНОСТЬ =====
 
     async def log_activity(self, user_id: int, action_type: str) -> bool:
-        db = await self._get_db()
+        """Записать действие пользователя (через write-behind буфер)"""
         try:
-            await db.execute(LOG_USER_ACTIVITY, (user_id, action_type))
-            await db.execute(UPDATE_LAST_ACTIVITY, (user_id,))
-            await db.commit()
+            await self.write_buffer.add_activity(user_id, action_type)
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
             return False
 
     async def get_active_users_count(self, days: int = 1) -> int:
-        date_threshold = datetime.now() - timedelta(days=days)
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT COUNT(DISTINCT user_id) FROM user_activity WHERE created_at >= ?",
-                (date_threshold.isoformat(),)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        first_day = self._period_start_day(days)
+        async with self._read() as db:
+            async with db.execute(
+                    GET_ACTIVE_USERS_COUNT_SINCE,
+                    (first_day,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
 
     # ===== ДОПОЛНИТЕЛЬНЫЕ МЕТОДЫ =====
 
     async def get_total_users_count(self) -> int:
-        db = await self._get_db()
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        async with self._read() as db:
+            async with db.execute(GET_TOTAL_USERS_COUNT) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+
+    # ===== НАСТРОЙКИ (кэш в памяти) =====
+
+    async def _get_settings_cache(self) -> Dict[str, str]:
+        """Загрузить таблицу settings один раз; дальше все чтения из памяти"""
+        cache = self._settings_cache
+        if cache is not None:
+            return cache
+        async with self._settings_lock:
+            if self._settings_cache is None:
+                async with self._read() as db:
+                    async with db.execute(GET_ALL_SETTINGS) as cursor:
+                        rows = await cursor.fetchall()
+                self._settings_cache = {row['key']: row['value'] for row in rows}
+            return self._settings_cache
+
+    def invalidate_settings_cache(self) -> None:
+        """🔄 Сбросить кэш настроек (следующее чтение перечитает таблицу)"""
+        self._settings_cache = None
 
     async def get_setting(self, key: str) -> Optional[str]:
-        db = await self._get_db()
-        async with db.execute(GET_SETTING, (key,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+        return (await self._get_settings_cache()).get(key)
+
+    async def get_settings(self, *keys: str) -> Dict[str, Optional[str]]:
+        """⚙️ Несколько настроек за раз: {key: value или None}"""
+        cache = await self._get_settings_cache()
+        return {key: cache.get(key) for key in keys}
+
+    async def get_setting_int(self, key: str, default: int = 0) -> int:
+        """⚙️ Числовая настройка; нет значения или не число → default"""
+        value = await self.get_setting(key)
+        try:
+            return int(value) if value not in (None, '') else default
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️ Настройка {key}={value!r} не число, используем {default}")
+            return default
 
     async def set_setting(self, key: str, value: str) -> bool:
-        db = await self._get_db()
         try:
-            await db.execute(SET_SETTING, (key, value))
-            await db.commit()
+            async with self._write() as db:
+                await db.execute(SET_SETTING, (key, value))
+            # Обновляем кэш только после commit
+            if self._settings_cache is not None:
+                self._settings_cache[key] = str(value)
             return True
         except Exception as e:
             logger.error(f"Ошибка: {e}")
+            self.invalidate_settings_cache()
             return False
 
     async def get_all_settings(self) -> Dict[str, str]:
-        db = await self._get_db()
-        db.row_factory = aiosqlite.Row
-        async with db.execute(GET_ALL_SETTINGS) as cursor:
-            rows = await cursor.fetchall()
-            return {row['key']: row['value'] for row in rows}
+        return dict(await self._get_settings_cache())
 
 
 # 💰 Получить общую выручку из успешных платежей
 #===============================================
     async def get_total_revenue(self) -> int:
 
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE status = 'succeeded'"
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        async with self._read() as db:
+            async with db.execute(
+                    GET_TOTAL_REVENUE
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+
+    async def get_revenue_by_period(self, days: int = 1) -> int:
+        """💰 Выручка из успешных платежей за последние N дней"""
+        first_day = self._period_start_day(days)
+        async with self._read() as db:
+            async with db.execute(GET_REVENUE_SINCE, (first_day,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+
+    async def get_average_payment(self) -> float:
+        """💳 Средний чек по успешным платежам"""
+        async with self._read() as db:
+            async with db.execute(GET_AVERAGE_PAYMENT) as cursor:
+                row = await cursor.fetchone()
+                return round(row[0], 2) if row and row[0] else 0.0
+
+
+# 📊 Сводка админ-панели одним запросом (с TTL-кэшем)
+#====================================================
+    async def get_dashboard_snapshot(self, top_limit: int = 5, force: bool = False) -> Dict[str, Any]:
+        """
+        📊 Вся статистика админки одним multi-CTE запросом по rollup-таблицам.
+
+        Результат кэшируется на dashboard_cache_ttl секунд и общий для всех админов:
+        одновременные запросы ждут один расчёт, а не делают свой.
+        force=True - пересчитать, не глядя в кэш.
+        """
+        cached = self._dashboard_cache
+        if not force and cached and self._dashboard_fresh(cached, top_limit):
+            return dict(cached[1])
+
+        async with self._dashboard_lock:
+            cached = self._dashboard_cache
+            if not force and cached and self._dashboard_fresh(cached, top_limit):
+                return dict(cached[1])
+
+            params = {
+                'today': self._period_start_day(1),
+                'week_start': self._period_start_day(7),
+                'top_limit': top_limit,
+            }
+            async with self._read() as db:
+                async with db.execute(GET_DASHBOARD_SNAPSHOT, params) as cursor:
+                    row = await cursor.fetchone()
+
+            snapshot = dict(row)
+            snapshot['popular_rooms'] = json.loads(snapshot['popular_rooms'] or '[]')
+            snapshot['popular_styles'] = json.loads(snapshot['popular_styles'] or '[]')
+            snapshot['top_limit'] = top_limit
+            snapshot['generated_at'] = datetime.now(timezone.utc).isoformat()
+            self._dashboard_cache = (time.monotonic(), snapshot)
+            return dict(snapshot)
+
+    def _dashboard_fresh(self, cached: Tuple[float, Dict[str, Any]], top_limit: int) -> bool:
+        computed_at, snapshot = cached
+        return (snapshot['top_limit'] == top_limit
+                and time.monotonic() - computed_at < self.dashboard_cache_ttl)
+
+    def invalidate_dashboard_cache(self) -> None:
+        """🔄 Сбросить кэш сводки админ-панели"""
+        self._dashboard_cache = None
 
 
 # Количество новых пользователей за последние N дней
 #========================================================
     async def get_new_users_count(self, days: int = 1) -> int:
         """👥 Количество новых пользователей за последние N дней"""
-        from datetime import datetime, timedelta
-        date_threshold = datetime.now() - timedelta(days=days)
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT COUNT(*) FROM users WHERE created_at >= ?",
-                (date_threshold.isoformat(),)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        first_day = self._period_start_day(days)
+        async with self._read() as db:
+            async with db.execute(
+                    GET_NEW_USERS_COUNT_SINCE,
+                    (first_day,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
 
 
 #Количество успешных платежей
 #===============================
     async def get_successful_payments_count(self) -> int:
         """💳 Количество успешных платежей"""
-        db = await self._get_db()
-        async with db.execute(
-                "SELECT COUNT(*) FROM payments WHERE status = 'succeeded'"
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+        async with self._read() as db:
+            async with db.execute(
+                    GET_SUCCESSFUL_PAYMENTS_COUNT
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
 
 
 # Объект
-db = Database()
+db = Database(
+    db_path=config.DB_PATH,
+    read_pool_size=config.DB_READ_POOL_SIZE,
+    write_flush_ms=config.DB_WRITE_FLUSH_MS,
+    write_batch_rows=config.DB_WRITE_BATCH_ROWS,
+    dashboard_cache_ttl=config.DASHBOARD_CACHE_TTL,
+)
@@ -1,4 +1,11 @@
 # bot/database/models.py
+# --- ОБНОВЛЕНО: 2026-10-18 20:00 - НОВОЕ: Таблица generation_jobs (генерации переживают перезапуск бота), миграция v4 ---
+# --- ОБНОВЛЕНО: 2026-10-18 18:00 - НОВОЕ: SQL для архивации старой user_activity (retention) ---
+# --- ОБНОВЛЕНО: 2026-10-18 17:00 - PERF: Индексированный поиск пользователей (id, username, префикс username), миграция v3 ---
+# --- ОБНОВЛЕНО: 2026-10-18 16:00 - PERF: Keyset-пагинация списка пользователей (GET_USERS_PAGE_*) ---
+# --- ОБНОВЛЕНО: 2026-10-18 15:00 - PERF: GET_DASHBOARD_SNAPSHOT - вся статистика админки одним запросом ---
+# --- ОБНОВЛЕНО: 2026-10-18 14:00 - PERF: Дневные rollup-таблицы статистики (триггеры на вставку), миграция v2 ---
+# --- ОБНОВЛЕНО: 2026-10-18 13:00 - PERF: Версионные миграции (PRAGMA user_version) + индексы, SQL статистики вынесен сюда ---
 # --- ОБНОВЛЕНО: 2026-01-03 18:56 - CLEAN: Убрано всё про миграции, user_photos создаётся с sample_photo_id ---
 # --- ОБНОВЛЕНО: 2026-01-03 17:58 - HOTFIX: Вернули photo_id вместо main_photo_id для совместимости ---
 # --- ОБНОВЛЕНО: 2026-01-02 11:53 - НОВОЕ: Добавлены методы save_user_photo/get_last_user_photo ---
@@ -208,6 +215,183 @@ CREATE TABLE IF NOT EXISTS settings (
 )
 """
 
+# ===== ДНЕВНЫЕ ROLLUP-ТАБЛИЦЫ СТАТИСТИКИ =====
+# Заполняются триггерами при вставке сырых строк (day = date(created_at), UTC).
+# Экран статистики читает только их: строка за сегодня и есть «дельта дня».
+
+CREATE_STATS_DAILY_USERS_TABLE = """
+CREATE TABLE IF NOT EXISTS stats_daily_users (
+    day TEXT PRIMARY KEY,
+    new_users INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Одна строка на (день, пользователь) - для COUNT(DISTINCT) за период
+CREATE_STATS_DAILY_ACTIVE_USERS_TABLE = """
+CREATE TABLE IF NOT EXISTS stats_daily_active_users (
+    day TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+) WITHOUT ROWID
+"""
+
+CREATE_STATS_DAILY_GENERATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS stats_daily_generations (
+    day TEXT NOT NULL,
+    room_type TEXT NOT NULL,
+    style_type TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, room_type, style_type, success)
+) WITHOUT ROWID
+"""
+
+# Только успешные платежи (day = дата создания платежа)
+CREATE_STATS_DAILY_REVENUE_TABLE = """
+CREATE TABLE IF NOT EXISTS stats_daily_revenue (
+    day TEXT PRIMARY KEY,
+    payments_count INTEGER NOT NULL DEFAULT 0,
+    amount INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+CREATE_TRIGGER_STATS_USERS = """
+CREATE TRIGGER IF NOT EXISTS trg_stats_daily_users AFTER INSERT ON users
+BEGIN
+    INSERT INTO stats_daily_users (day, new_users)
+    VALUES (COALESCE(date(NEW.created_at), date('now')), 1)
+    ON CONFLICT(day) DO UPDATE SET new_users = new_users + 1;
+END
+"""
+
+CREATE_TRIGGER_STATS_ACTIVITY = """
+CREATE TRIGGER IF NOT EXISTS trg_stats_daily_active_users AFTER INSERT ON user_activity
+BEGIN
+    INSERT OR IGNORE INTO stats_daily_active_users (day, user_id)
+    VALUES (COALESCE(date(NEW.created_at), date('now')), NEW.user_id);
+END
+"""
+
+CREATE_TRIGGER_STATS_GENERATIONS = """
+CREATE TRIGGER IF NOT EXISTS trg_stats_daily_generations AFTER INSERT ON generations
+BEGIN
+    INSERT INTO stats_daily_generations (day, room_type, style_type, success, count)
+    VALUES (COALESCE(date(NEW.created_at), date('now')), NEW.room_type, NEW.style_type,
+            CASE WHEN NEW.success THEN 1 ELSE 0 END, 1)
+    ON CONFLICT(day, room_type, style_type, success) DO UPDATE SET count = count + 1;
+END
+"""
+
+CREATE_TRIGGER_STATS_REVENUE_INSERT = """
+CREATE TRIGGER IF NOT EXISTS trg_stats_daily_revenue_insert AFTER INSERT ON payments
+WHEN NEW.status = 'succeeded'
+BEGIN
+    INSERT INTO stats_daily_revenue (day, payments_count, amount)
+    VALUES (COALESCE(date(NEW.created_at), date('now')), 1, NEW.amount)
+    ON CONFLICT(day) DO UPDATE SET payments_count = payments_count + 1, amount = amount + NEW.amount;
+END
+"""
+
+CREATE_TRIGGER_STATS_REVENUE_UPDATE = """
+CREATE TRIGGER IF NOT EXISTS trg_stats_daily_revenue_update AFTER UPDATE OF status ON payments
+WHEN NEW.status = 'succeeded' AND OLD.status IS NOT 'succeeded'
+BEGIN
+    INSERT INTO stats_daily_revenue (day, payments_count, amount)
+    VALUES (COALESCE(date(NEW.created_at), date('now')), 1, NEW.amount)
+    ON CONFLICT(day) DO UPDATE SET payments_count = payments_count + 1, amount = amount + NEW.amount;
+END
+"""
+
+# Перенос уже накопленных данных в rollup-таблицы (один раз, в миграции v2)
+BACKFILL_STATS_DAILY = [
+    """INSERT OR REPLACE INTO stats_daily_users (day, new_users)
+       SELECT COALESCE(date(created_at), date('now')), COUNT(*) FROM users GROUP BY 1""",
+    """INSERT OR IGNORE INTO stats_daily_active_users (day, user_id)
+       SELECT DISTINCT COALESCE(date(created_at), date('now')), user_id FROM user_activity""",
+    """INSERT OR REPLACE INTO stats_daily_generations (day, room_type, style_type, success, count)
+       SELECT COALESCE(date(created_at), date('now')), room_type, style_type,
+              CASE WHEN success THEN 1 ELSE 0 END, COUNT(*)
+       FROM generations GROUP BY 1, 2, 3, 4""",
+    """INSERT OR REPLACE INTO stats_daily_revenue (day, payments_count, amount)
+       SELECT COALESCE(date(created_at), date('now')), COUNT(*), SUM(amount)
+       FROM payments WHERE status = 'succeeded' GROUP BY 1""",
+]
+
+# ===== ЗАДАНИЯ ГЕНЕРАЦИИ (services/generation_jobs.py) =====
+# Живут дольше обработчика: после перезапуска бота незавершённые задания
+# дожидаются задачи Kie.ai (task_id) и доставляются или возвращают cost.
+# status: running → generated → delivered | refunded | failed
+
+CREATE_GENERATION_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    params TEXT,
+    cost INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'running',
+    provider TEXT,
+    task_id TEXT,
+    model_key TEXT,
+    result_url TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# ===== ВЕРСИОННЫЕ МИГРАЦИИ (PRAGMA user_version) =====
+# Применяются по порядку в Database.init_db(), только версии > текущей user_version.
+# Новую миграцию добавлять В КОНЕЦ списка со следующим номером, старые не менять!
+
+MIGRATIONS = [
+    (1, [
+        # Генерации: счётчики за период, неудачные за период, топ комнат/стилей
+        "CREATE INDEX IF NOT EXISTS idx_generations_created_at ON generations (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_generations_success_created_at ON generations (success, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_generations_room_type ON generations (room_type)",
+        "CREATE INDEX IF NOT EXISTS idx_generations_style_type ON generations (style_type)",
+        # Активность: COUNT(DISTINCT user_id) за период (покрывающий индекс)
+        "CREATE INDEX IF NOT EXISTS idx_user_activity_created_at_user ON user_activity (created_at, user_id)",
+        # Платежи: последний pending пользователя, выручка/кол-во по статусу и периоду
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_status_created_at ON payments (user_id, status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_created_at_amount ON payments (status, created_at, amount)",
+        # Пользователи: новые за период, конверсия, рефералы
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_users_total_generations ON users (total_generations)",
+        "CREATE INDEX IF NOT EXISTS idx_users_referred_by ON users (referred_by)",
+        # Реферальная система: история по пользователю, очередь выплат
+        "CREATE INDEX IF NOT EXISTS idx_referral_earnings_referrer_created_at ON referral_earnings (referrer_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_referral_exchanges_user_created_at ON referral_exchanges (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_referral_payouts_user_requested_at ON referral_payouts (user_id, requested_at)",
+        "CREATE INDEX IF NOT EXISTS idx_referral_payouts_status_requested_at ON referral_payouts (status, requested_at)",
+    ]),
+    (2, [
+        # Дневные rollup-таблицы статистики + триггеры + перенос истории
+        CREATE_STATS_DAILY_USERS_TABLE,
+        CREATE_STATS_DAILY_ACTIVE_USERS_TABLE,
+        CREATE_STATS_DAILY_GENERATIONS_TABLE,
+        CREATE_STATS_DAILY_REVENUE_TABLE,
+        *BACKFILL_STATS_DAILY,
+        CREATE_TRIGGER_STATS_USERS,
+        CREATE_TRIGGER_STATS_ACTIVITY,
+        CREATE_TRIGGER_STATS_GENERATIONS,
+        CREATE_TRIGGER_STATS_REVENUE_INSERT,
+        CREATE_TRIGGER_STATS_REVENUE_UPDATE,
+    ]),
+    (3, [
+        # Поиск пользователя: нормализованный username (Telegram username - только ASCII,
+        # поэтому lower() SQLite нормализует корректно). Используется для = и для префикса (диапазон)
+        "CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (lower(username))",
+    ]),
+    (4, [
+        # Задания генерации: выборка незавершённых при старте и чистка старых - по (status, created_at)
+        CREATE_GENERATION_JOBS_TABLE,
+        "CREATE INDEX IF NOT EXISTS idx_generation_jobs_status_created_at ON generation_jobs (status, created_at)",
+    ]),
+]
+
 # ===== ДЕФОЛТНЫЕ НАСТРОЙКИ =====
 
 DEFAULT_SETTINGS = {
@@ -218,6 +402,9 @@ DEFAULT_SETTINGS = {
     'referral_commission_percent': '10',
     'referral_min_payout': '500',
     'referral_exchange_rate': '29',
+    # Hedging KIE → Replicate (services/hedging.py): выключен, до 20 запусков Replicate в день
+    'hedging_enabled': '0',
+    'hedging_daily_cap': '20',
 }
 
 # ===== SQL QUERIES ДЛЯ CRUD ОПЕРАЦИЙ =====
@@ -225,8 +412,44 @@ DEFAULT_SETTINGS = {
 # --- Пользователи ---
 GET_USER = "SELECT * FROM users WHERE user_id = ?"
 CREATE_USER = "INSERT INTO users (user_id, username, balance, referral_code) VALUES (?, ?, ?, ?)"
+GET_USER_CREATED_AT = "SELECT created_at FROM users WHERE user_id = ?"
+
+# --- Поиск пользователя (админка) ---
+SEARCH_USER_BY_ID = "SELECT *, created_at AS reg_date FROM users WHERE user_id = ?"
+SEARCH_USER_BY_USERNAME = "SELECT *, created_at AS reg_date FROM users WHERE lower(username) = ? LIMIT 1"
+SEARCH_USER_BY_REFERRAL_CODE = "SELECT *, created_at AS reg_date FROM users WHERE referral_code = ?"
+# Префикс: lower(username) в диапазоне [prefix, prefix_next) - идёт по idx_users_username_lower
+SEARCH_USERS_BY_USERNAME_PREFIX = """
+SELECT *, created_at AS reg_date FROM users
+WHERE lower(username) >= ? AND lower(username) < ?
+ORDER BY lower(username)
+LIMIT ?
+"""
+
+# Keyset-пагинация (новые сверху): курсор = (created_at, user_id) последней/первой строки страницы.
+# Индекс idx_users_created_at (миграция v1): user_id = rowid, поэтому порядок (created_at, user_id) уже в индексе
+GET_USERS_PAGE_FIRST = """
+SELECT user_id, username, balance, created_at FROM users
+ORDER BY created_at DESC, user_id DESC
+LIMIT ?
+"""
+GET_USERS_PAGE_AFTER = """
+SELECT user_id, username, balance, created_at FROM users
+WHERE (created_at, user_id) < (?, ?)
+ORDER BY created_at DESC, user_id DESC
+LIMIT ?
+"""
+# Предыдущая страница: идём в обратную сторону от курсора, результат разворачивается в коде
+GET_USERS_PAGE_BEFORE = """
+SELECT user_id, username, balance, created_at FROM users
+WHERE (created_at, user_id) > (?, ?)
+ORDER BY created_at ASC, user_id ASC
+LIMIT ?
+"""
 UPDATE_BALANCE = "UPDATE users SET balance = balance + ? WHERE user_id = ?"
 DECREASE_BALANCE = "UPDATE users SET balance = balance - 1 WHERE user_id = ?"
+# Атомарное списание: проверка и минус в одном UPDATE (rowcount = 0 → денег не хватило)
+RESERVE_BALANCE = "UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ?"
 GET_BALANCE = "SELECT balance FROM users WHERE user_id = ?"
 UPDATE_LAST_ACTIVITY = "UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?"
 
@@ -252,6 +475,8 @@ SET status = ?, payment_date = CURRENT_TIMESTAMP
 WHERE yookassa_payment_id = ?
 """
 
+GET_PAYMENT_BY_YOOKASSA_ID = "SELECT * FROM payments WHERE yookassa_payment_id = ?"
+
 # --- Генерации ---
 CREATE_GENERATION = """
 INSERT INTO generations (user_id, room_type, style_type, operation_type, success)
@@ -259,12 +484,123 @@ VALUES (?, ?, ?, ?, ?)
 """
 INCREMENT_TOTAL_GENERATIONS = "UPDATE users SET total_generations = total_generations + 1 WHERE user_id = ?"
 
+# --- Задания генерации (services/generation_jobs.py) ---
+CREATE_GENERATION_JOB = """
+INSERT INTO generation_jobs (user_id, chat_id, mode, params, cost)
+VALUES (?, ?, ?, ?, ?)
+"""
+SET_GENERATION_JOB_TASK = """
+UPDATE generation_jobs SET provider = ?, task_id = ?, model_key = ?, updated_at = CURRENT_TIMESTAMP
+WHERE id = ?
+"""
+SET_GENERATION_JOB_RESULT = """
+UPDATE generation_jobs SET status = 'generated', result_url = ?, updated_at = CURRENT_TIMESTAMP
+WHERE id = ? AND status = 'running'
+"""
+# Финальный статус ставится один раз: повторный вызов (или refund после delivered) - rowcount = 0
+FINISH_GENERATION_JOB = """
+UPDATE generation_jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+WHERE id = ? AND status IN ('running', 'generated')
+"""
+GET_GENERATION_JOB_COST = "SELECT user_id, cost FROM generation_jobs WHERE id = ?"
+GET_GENERATION_JOB_STATUS = "SELECT status FROM generation_jobs WHERE id = ?"
+GET_UNFINISHED_GENERATION_JOBS = """
+SELECT * FROM generation_jobs
+WHERE status IN ('running', 'generated')
+ORDER BY created_at
+"""
+DELETE_OLD_GENERATION_JOBS = """
+DELETE FROM generation_jobs
+WHERE status IN ('delivered', 'refunded', 'failed') AND created_at < ?
+"""
+
 # --- Активность ---
 LOG_USER_ACTIVITY = """
 INSERT INTO user_activity (user_id, action_type)
 VALUES (?, ?)
 """
 
+# --- Хранение активности (database/retention.py) ---
+# Старые сырые строки по порядку created_at (идёт по idx_user_activity_created_at_user)
+GET_OLD_ACTIVITY_BATCH = """
+SELECT id, user_id, action_type, created_at FROM user_activity
+WHERE created_at < ?
+ORDER BY created_at
+LIMIT ?
+"""
+ROLLUP_ACTIVITY_DAY = """
+INSERT OR IGNORE INTO stats_daily_active_users (day, user_id)
+VALUES (COALESCE(date(?), date('now')), ?)
+"""
+DELETE_ACTIVITY_BY_ID = "DELETE FROM user_activity WHERE id = ?"
+
+# --- Статистика (админка) - читает дневные rollup-таблицы, параметр = первый день периода 'YYYY-MM-DD' ---
+GET_TOTAL_USERS_COUNT = "SELECT COALESCE(SUM(new_users), 0) FROM stats_daily_users"
+GET_NEW_USERS_COUNT_SINCE = "SELECT COALESCE(SUM(new_users), 0) FROM stats_daily_users WHERE day >= ?"
+GET_ACTIVE_USERS_COUNT_SINCE = "SELECT COUNT(DISTINCT user_id) FROM stats_daily_active_users WHERE day >= ?"
+GET_CONVERSION_RATE = "SELECT AVG(total_generations) FROM users WHERE total_generations > 0"
+
+GET_TOTAL_GENERATIONS = "SELECT COALESCE(SUM(count), 0) FROM stats_daily_generations"
+GET_GENERATIONS_COUNT_SINCE = "SELECT COALESCE(SUM(count), 0) FROM stats_daily_generations WHERE day >= ?"
+GET_FAILED_GENERATIONS_COUNT_SINCE = "SELECT COALESCE(SUM(count), 0) FROM stats_daily_generations WHERE day >= ? AND success = 0"
+GET_POPULAR_ROOMS = "SELECT room_type, SUM(count) as count FROM stats_daily_generations GROUP BY room_type ORDER BY count DESC LIMIT ?"
+GET_POPULAR_STYLES = "SELECT style_type, SUM(count) as count FROM stats_daily_generations GROUP BY style_type ORDER BY count DESC LIMIT ?"
+
+GET_TOTAL_REVENUE = "SELECT COALESCE(SUM(amount), 0) FROM stats_daily_revenue"
+GET_REVENUE_SINCE = "SELECT COALESCE(SUM(amount), 0) FROM stats_daily_revenue WHERE day >= ?"
+GET_SUCCESSFUL_PAYMENTS_COUNT = "SELECT COALESCE(SUM(payments_count), 0) FROM stats_daily_revenue"
+GET_AVERAGE_PAYMENT = "SELECT COALESCE(1.0 * SUM(amount) / NULLIF(SUM(payments_count), 0), 0) FROM stats_daily_revenue"
+
+# Вся статистика админ-панели одним запросом (:today, :week_start - 'YYYY-MM-DD', :top_limit)
+GET_DASHBOARD_SNAPSHOT = """
+WITH
+users_stats AS (
+    SELECT COALESCE(SUM(new_users), 0) AS total_users,
+           COALESCE(SUM(CASE WHEN day >= :today THEN new_users END), 0) AS new_today,
+           COALESCE(SUM(CASE WHEN day >= :week_start THEN new_users END), 0) AS new_week
+    FROM stats_daily_users
+),
+active_stats AS (
+    SELECT COUNT(DISTINCT CASE WHEN day >= :today THEN user_id END) AS active_today,
+           COUNT(DISTINCT user_id) AS active_week
+    FROM stats_daily_active_users
+    WHERE day >= :week_start
+),
+generation_stats AS (
+    SELECT COALESCE(SUM(count), 0) AS total_generations,
+           COALESCE(SUM(CASE WHEN day >= :today THEN count END), 0) AS generations_today,
+           COALESCE(SUM(CASE WHEN day >= :week_start THEN count END), 0) AS generations_week,
+           COALESCE(SUM(CASE WHEN day >= :today AND success = 0 THEN count END), 0) AS failed_today,
+           COALESCE(SUM(CASE WHEN day >= :week_start AND success = 0 THEN count END), 0) AS failed_week
+    FROM stats_daily_generations
+),
+conversion AS (
+    SELECT COALESCE(ROUND(AVG(total_generations), 2), 0.0) AS conversion_rate
+    FROM users
+    WHERE total_generations > 0
+),
+revenue_stats AS (
+    SELECT COALESCE(SUM(amount), 0) AS total_revenue,
+           COALESCE(SUM(CASE WHEN day >= :today THEN amount END), 0) AS revenue_today,
+           COALESCE(SUM(CASE WHEN day >= :week_start THEN amount END), 0) AS revenue_week,
+           COALESCE(SUM(payments_count), 0) AS successful_payments,
+           COALESCE(ROUND(1.0 * SUM(amount) / NULLIF(SUM(payments_count), 0), 2), 0.0) AS average_payment
+    FROM stats_daily_revenue
+),
+room_totals AS (
+    SELECT room_type, SUM(count) AS count FROM stats_daily_generations
+    GROUP BY room_type ORDER BY count DESC LIMIT :top_limit
+),
+style_totals AS (
+    SELECT style_type, SUM(count) AS count FROM stats_daily_generations
+    GROUP BY style_type ORDER BY count DESC LIMIT :top_limit
+)
+SELECT users_stats.*, active_stats.*, generation_stats.*, conversion.*, revenue_stats.*,
+       (SELECT json_group_array(json_object('room_type', room_type, 'count', count)) FROM room_totals) AS popular_rooms,
+       (SELECT json_group_array(json_object('style_type', style_type, 'count', count)) FROM style_totals) AS popular_styles
+FROM users_stats, active_stats, generation_stats, conversion, revenue_stats
+"""
+
 # ===== SQL QUERIES ДЛЯ ФОТО =====
 # Основное фото (SCREEN 2)
 SAVE_USER_PHOTO = """
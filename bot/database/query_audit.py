@@ -0,0 +1,111 @@
+# bot/database/query_audit.py
+# --- СОЗДАН: 2026-10-18 - Аудит планов запросов (EXPLAIN QUERY PLAN) для SQL из models.py ---
+
+"""
+Аудит планов запросов.
+
+Создаёт схему из models.py (таблицы + все MIGRATIONS) в in-memory SQLite и
+прогоняет EXPLAIN QUERY PLAN для каждой SQL-константы (SELECT/INSERT/UPDATE/DELETE).
+Запрос, который делает полный скан таблицы без индекса, считается нарушением.
+
+Запуск (из папки bot/), код возврата 1 при нарушениях:
+    python -m database.query_audit
+"""
+
+import re
+import sqlite3
+import sys
+from typing import Dict, List, Tuple
+
+from database import models
+
+# Запросы, которым полный скан разрешён осознанно (маленькие таблицы, читаются целиком)
+FULL_SCAN_ALLOWED = {
+    'GET_ALL_SETTINGS',
+    # Итоги «за всё время» по дневным rollup-таблицам (одна строка на день)
+    'GET_TOTAL_USERS_COUNT', 'GET_TOTAL_GENERATIONS', 'GET_POPULAR_ROOMS', 'GET_POPULAR_STYLES',
+    'GET_TOTAL_REVENUE', 'GET_SUCCESSFUL_PAYMENTS_COUNT', 'GET_AVERAGE_PAYMENT',
+    'GET_DASHBOARD_SNAPSHOT',
+}
+
+_QUERY_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+_NAMED_PARAM = re.compile(r"(?<![\w:]):([A-Za-z_]\w*)")
+
+
+def build_schema() -> sqlite3.Connection:
+    """Пустая in-memory БД со всеми таблицами и индексами из models.py"""
+    conn = sqlite3.connect(":memory:")
+    for name in dir(models):
+        if name.startswith('CREATE_') and name.endswith('_TABLE'):
+            conn.execute(getattr(models, name))
+    for _version, statements in models.MIGRATIONS:
+        for statement in statements:
+            conn.execute(statement)
+    conn.execute("ANALYZE")
+    return conn
+
+
+def collect_queries() -> Dict[str, str]:
+    """Все SQL-константы модуля models, кроме DDL"""
+    queries = {}
+    for name in dir(models):
+        value = getattr(models, name)
+        if not name.isupper() or not isinstance(value, str):
+            continue
+        if value.strip().upper().startswith(_QUERY_PREFIXES):
+            queries[name] = value
+    return queries
+
+
+def _is_full_scan(detail: str) -> bool:
+    # 'SCAN users' (SQLite >= 3.36) или 'SCAN TABLE users' (старые версии)
+    if not detail.startswith('SCAN '):
+        return False
+    if 'CONSTANT ROW' in detail:
+        return False
+    return 'USING' not in detail
+
+
+def audit_query_plans() -> Tuple[Dict[str, List[str]], List[Tuple[str, str]]]:
+    """
+    Возвращает (планы по имени константы, нарушения [(имя, строка плана)]).
+    """
+    conn = build_schema()
+    plans: Dict[str, List[str]] = {}
+    violations: List[Tuple[str, str]] = []
+    try:
+        for name, sql in sorted(collect_queries().items()):
+            named = _NAMED_PARAM.findall(sql)
+            params = {key: None for key in named} if named else (None,) * sql.count('?')
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            details = [row[-1] for row in rows]
+            plans[name] = details
+            if name in FULL_SCAN_ALLOWED:
+                continue
+            for detail in details:
+                if _is_full_scan(detail):
+                    violations.append((name, detail))
+    finally:
+        conn.close()
+    return plans, violations
+
+
+def main() -> int:
+    plans, violations = audit_query_plans()
+    for name, details in plans.items():
+        print(f"{name}:")
+        for detail in details or ['(нет шагов плана)']:
+            print(f"    {detail}")
+
+    if violations:
+        print(f"\n❌ Полный скан таблицы в {len(violations)} запросах:")
+        for name, detail in violations:
+            print(f"    {name}: {detail}")
+        return 1
+
+    print(f"\n✅ Проверено запросов: {len(plans)}, полных сканов нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# bot/database/retention.py
+# --- СОЗДАН: 2026-10-18 - Хранение user_activity: rollup → архив gzip по месяцам → удаление → incremental VACUUM ---
+# --- ОБНОВЛЕН: 2026-10-18 - Полный VACUUM только явно при старте (DB_ENABLE_INCREMENTAL_VACUUM), фоновая задача его не запускает ---
+
+"""
+Хранение таблицы user_activity.
+
+log_activity пишет строку на каждый клик, таблица растёт без ограничений.
+Фоновая задача (стартует из main.py) раз в interval_hours:
+1. берёт сырые строки старше retention_days пачками по batch_rows
+2. дописывает их в дневные агрегаты stats_daily_active_users (INSERT OR IGNORE -
+   обычно они там уже есть благодаря триггеру, это страховка)
+3. дописывает строки в архив archive_dir/user_activity_YYYY-MM.jsonl.gz (fsync)
+4. удаляет их из БД
+5. в конце - PRAGMA incremental_vacuum (если auto_vacuum=INCREMENTAL) и checkpoint WAL
+
+auto_vacuum=INCREMENTAL: новая БД создаётся сразу с ним (Database.init_pool).
+Существующую БД переводит только полный VACUUM - он держит writer всё время
+перезаписи файла, поэтому выполняется не фоновой задачей, а явно при старте
+до начала polling (DB_ENABLE_INCREMENTAL_VACUUM=true, enable_incremental_vacuum).
+Без перевода освобождённые страницы переиспользуются SQLite, но файл не уменьшается.
+
+Архив пишется ДО удаления: при сбое между шагами 3 и 4 строки попадут
+в архив повторно (дубли), но не потеряются.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List
+
+from config import config
+from database.db import db, Database
+from database.models import GET_OLD_ACTIVITY_BATCH, ROLLUP_ACTIVITY_DAY, DELETE_ACTIVITY_BY_ID
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityRetention:
+    """🗄️ Архивация и удаление старой активности + incremental VACUUM"""
+
+    def __init__(self, database: Database, retention_days: int = 90,
+                 archive_dir: str = 'archive/user_activity', interval_hours: int = 24,
+                 batch_rows: int = 5000, startup_delay: float = 60.0):
+        self.database = database
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval = max(1, interval_hours) * 3600
+        self.batch_rows = max(1, batch_rows)
+        self.startup_delay = startup_delay
+
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+        self.last_result: Dict[str, Any] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.retention_days > 0
+
+    def _cutoff(self) -> str:
+        """Граница по целым дням (UTC), в формате CURRENT_TIMESTAMP"""
+        day = datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)
+        return f"{day.isoformat()} 00:00:00"
+
+    # ===== ОДИН ПРОХОД =====
+
+    async def run_once(self) -> Dict[str, Any]:
+        """🗄️ Архивировать и удалить всё старше retention_days. Возвращает итоги прохода."""
+        result = {'archived': 0, 'batches': 0, 'freed_pages': 0, 'cutoff': self._cutoff()}
+        if not self.enabled:
+            return result
+
+        while not self._stop.is_set():
+            async with self.database._read() as conn:
+                async with conn.execute(GET_OLD_ACTIVITY_BATCH, (result['cutoff'], self.batch_rows)) as cursor:
+                    rows = [dict(row) for row in await cursor.fetchall()]
+            if not rows:
+                break
+
+            await asyncio.to_thread(self._append_to_archive, rows)
+
+            async with self.database._write() as conn:
+                await conn.executemany(ROLLUP_ACTIVITY_DAY, [(r['created_at'], r['user_id']) for r in rows])
+                await conn.executemany(DELETE_ACTIVITY_BY_ID, [(r['id'],) for r in rows])
+
+            result['archived'] += len(rows)
+            result['batches'] += 1
+            if len(rows) < self.batch_rows:
+                break
+
+        if result['archived']:
+            result['freed_pages'] = await self._incremental_vacuum()
+            logger.info(f"🗄️ [RETENTION] user_activity: архивировано и удалено {result['archived']} строк "
+                        f"(до {result['cutoff']}), освобождено страниц: {result['freed_pages']}")
+        else:
+            logger.debug(f"🗄️ [RETENTION] user_activity: нечего архивировать (до {result['cutoff']})")
+
+        self.last_result = result
+        return result
+
+    def _append_to_archive(self, rows: List[Dict[str, Any]]) -> None:
+        """Дописать строки в gzip-архивы по месяцам (вызывается в потоке)"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[(row['created_at'] or '')[:7] or 'unknown'].append(row)
+
+        for month, month_rows in by_month.items():
+            path = os.path.join(self.archive_dir, f"user_activity_{month}.jsonl.gz")
+            payload = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in month_rows)
+            # Каждая пачка - отдельный gzip member, gzip.open() читает файл целиком
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                    gz.write(payload.encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    # ===== VACUUM =====
+
+    @staticmethod
+    async def _auto_vacuum_mode(conn) -> int:
+        async with conn.execute("PRAGMA auto_vacuum") as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else 0
+
+    async def enable_incremental_vacuum(self) -> None:
+        """
+        Однократно перевести существующую БД на auto_vacuum=INCREMENTAL полным VACUUM.
+
+        Вызывается из main.py при старте до начала polling (DB_ENABLE_INCREMENTAL_VACUUM):
+        VACUUM перезаписывает весь файл и всё это время держит writer.
+        """
+        async with self.database._write() as conn:
+            if await self._auto_vacuum_mode(conn) == 2:
+                return
+        logger.warning("⚠️ [RETENTION] Перевод БД на auto_vacuum=INCREMENTAL (полный VACUUM)...")
+        started = time.monotonic()
+        async with self.database._write() as conn:
+            await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # VACUUM нельзя выполнять внутри транзакции - закрываем открытую неявно
+            await conn.commit()
+            await conn.execute("VACUUM")
+        logger.info(f"✅ [RETENTION] auto_vacuum=INCREMENTAL включен за {time.monotonic() - started:.1f}s")
+
+    async def _incremental_vacuum(self) -> int:
+        """Вернуть свободные страницы ОС и укоротить WAL. Возвращает число страниц."""
+        async with self.database._write() as conn:
+            async with conn.execute("PRAGMA freelist_count") as cursor:
+                row = await cursor.fetchone()
+                free_pages = row[0] if row else 0
+            if await self._auto_vacuum_mode(conn) == 2:
+                # incremental_vacuum освобождает по странице на шаг - дочитываем до конца
+                async with conn.execute("PRAGMA incremental_vacuum") as cursor:
+                    await cursor.fetchall()
+            else:
+                # Без INCREMENTAL файл не уменьшается: страницы остаются в freelist для новых строк
+                free_pages = 0
+            async with conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+                await cursor.fetchall()
+        return free_pages
+
+    # ===== ФОНОВАЯ ЗАДАЧА =====
+
+    def start(self) -> None:
+        """▶️ Запустить фоновую задачу (из main.py)"""
+        if not self.enabled:
+            logger.info("🗄️ [RETENTION] Отключено (ACTIVITY_RETENTION_DAYS=0)")
+            return
+        if self._task is None or self._task.done():
+            self._stop.clear()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🗄️ [RETENTION] Запущено: хранение {self.retention_days} дн., "
+                        f"архив {self.archive_dir}, раз в {self.interval // 3600} ч.")
+
+    async def stop(self) -> None:
+        """⏹️ Остановить: текущая пачка дописывается, отмены посреди транзакции нет"""
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        delay = self.startup_delay
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=delay)
+                break
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ [RETENTION] Ошибка прохода: {e}")
+            delay = self.interval
+
+
+# Объект
+activity_retention = ActivityRetention(
+    db,
+    retention_days=config.ACTIVITY_RETENTION_DAYS,
+    archive_dir=config.ACTIVITY_ARCHIVE_DIR,
+    interval_hours=config.ACTIVITY_RETENTION_INTERVAL_HOURS,
+    batch_rows=config.ACTIVITY_RETENTION_BATCH_ROWS,
+)
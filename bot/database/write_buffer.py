@@ -0,0 +1,268 @@
+# bot/database/write_buffer.py
+# --- СОЗДАН: 2026-10-18 - Write-behind буфер для log_activity / log_generation / save_chat_menu ---
+# --- ОБНОВЛЕН: 2026-10-18 - Ошибка пакета: повтор построчно, сбойные строки отбрасываются (одна плохая строка не блокирует буфер) ---
+
+"""
+Write-behind буфер для «fire-and-forget» записей.
+
+Каждый переход по экрану вызывает save_chat_menu, часто ещё log_activity и
+log_generation - раньше каждая запись делала свой commit() (2-3 fsync на клик).
+Буфер копит такие записи в памяти и сбрасывает их ОДНОЙ транзакцией:
+- каждые flush_interval_ms после первой записи
+- или сразу, когда накопилось max_rows записей
+
+Что НЕ попадает в буфер: всё, что меняет баланс, платежи, настройки -
+эти записи остаются синхронными и коммитятся сразу.
+
+Меню (chat_menus) схлопываются по chat_id: в БД уйдёт только последнее
+состояние. Непрошедшие в БД меню видны через pending_chat_menu(), чтобы
+get_chat_menu() читал собственные записи.
+
+Если транзакция пакета упала, строки пишутся по одной: сбойные строки
+(например, нарушение ограничения) логируются и отбрасываются, остальные
+сохраняются. Если не записалась ни одна строка (БД недоступна), пакет
+возвращается в буфер - но не больше max_retries раз подряд.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from database.models import (
+    LOG_USER_ACTIVITY, CREATE_GENERATION, INCREMENT_TOTAL_GENERATIONS,
+    UPDATE_LAST_ACTIVITY, SAVE_CHAT_MENU, DELETE_CHAT_MENU,
+)
+
+logger = logging.getLogger(__name__)
+
+# Запись меню: (chat_id, user_id, menu_message_id, screen_code, updated_at) или None = удалить
+ChatMenuRow = Optional[Tuple[int, int, int, str, str]]
+
+
+class WriteBehindBuffer:
+    """
+    📦 Буфер отложенной записи: копит строки и сбрасывает одной транзакцией.
+
+    write - фабрика транзакции writer-соединения (Database._write).
+    """
+
+    def __init__(self, write: Callable, flush_interval_ms: int = 250, max_rows: int = 200):
+        self._write = write
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        self.max_rows = max(1, max_rows)
+        # Потолок буфера при недоступной БД - дальше старые строки отбрасываются
+        self.max_backlog = self.max_rows * 50
+        # Сколько раз подряд пакет возвращается в буфер, если БД недоступна
+        self.max_retries = 5
+        self._failed_flushes = 0
+
+        self._activity: List[Tuple[int, str]] = []
+        self._generations: List[Tuple[int, str, str, str, bool]] = []
+        self._touched_users: set = set()
+        self._chat_menus: Dict[int, ChatMenuRow] = {}
+        # Меню, которые сейчас пишутся в БД (ещё не закоммичены)
+        self._inflight_chat_menus: Dict[int, ChatMenuRow] = {}
+
+        self._has_data = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.stats = {'flushes': 0, 'rows_flushed': 0, 'flush_errors': 0, 'rows_dropped': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.flush_interval > 0 and not self._closed
+
+    def pending_count(self) -> int:
+        return len(self._activity) + len(self._generations) + len(self._chat_menus)
+
+    # ===== ПОСТАНОВКА В ОЧЕРЕДЬ =====
+
+    async def add_activity(self, user_id: int, action_type: str) -> None:
+        self._activity.append((user_id, action_type))
+        self._touched_users.add(user_id)
+        await self._after_add()
+
+    async def add_generation(self, user_id: int, room_type: str, style_type: str,
+                             operation_type: str, success: bool) -> None:
+        self._generations.append((user_id, room_type, style_type, operation_type, success))
+        self._touched_users.add(user_id)
+        await self._after_add()
+
+    async def put_chat_menu(self, chat_id: int, user_id: int, menu_message_id: int, screen_code: str) -> None:
+        updated_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._chat_menus[chat_id] = (chat_id, user_id, menu_message_id, screen_code, updated_at)
+        await self._after_add()
+
+    async def drop_chat_menu(self, chat_id: int) -> None:
+        self._chat_menus[chat_id] = None
+        await self._after_add()
+
+    def pending_chat_menu(self, chat_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Меню из буфера, ещё не записанное в БД.
+
+        Возвращает (найдено, данные): (True, None) означает «меню удалено».
+        """
+        for source in (self._chat_menus, self._inflight_chat_menus):
+            if chat_id in source:
+                row = source[chat_id]
+                if row is None:
+                    return True, None
+                return True, {
+                    'chat_id': row[0],
+                    'user_id': row[1],
+                    'menu_message_id': row[2],
+                    'screen_code': row[3],
+                    'updated_at': row[4],
+                }
+        return False, None
+
+    async def _after_add(self) -> None:
+        if not self.enabled:
+            await self.flush()
+            return
+
+        self._trim_backlog()
+        self._has_data.set()
+        if self.pending_count() >= self.max_rows:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _trim_backlog(self) -> None:
+        overflow = len(self._activity) + len(self._generations) - self.max_backlog
+        if overflow <= 0:
+            return
+        dropped_activity = min(overflow, len(self._activity))
+        del self._activity[:dropped_activity]
+        del self._generations[:overflow - dropped_activity]
+        self.stats['rows_dropped'] += overflow
+        logger.error(f"❌ [WRITE BUFFER] Переполнение, отброшено {overflow} старых строк")
+
+    # ===== СБРОС В БД =====
+
+    async def _run(self) -> None:
+        """Фоновый цикл: ждём данные → ждём интервал (или заполнение) → сбрасываем"""
+        while not self._closed:
+            await self._has_data.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> int:
+        """💾 Записать всё накопленное одной транзакцией. Возвращает число строк."""
+        async with self._flush_lock:
+            activity, self._activity = self._activity, []
+            generations, self._generations = self._generations, []
+            touched, self._touched_users = self._touched_users, set()
+            self._inflight_chat_menus, self._chat_menus = self._chat_menus, {}
+            self._has_data.clear()
+            self._full.clear()
+
+            chat_menus = self._inflight_chat_menus
+            rows = len(activity) + len(generations) + len(chat_menus)
+            if rows == 0:
+                return 0
+
+            saved_menus = [row[:4] for row in chat_menus.values() if row is not None]
+            deleted_menus = [(chat_id,) for chat_id, row in chat_menus.items() if row is None]
+
+            try:
+                async with self._write() as db:
+                    if activity:
+                        await db.executemany(LOG_USER_ACTIVITY, activity)
+                    if generations:
+                        await db.executemany(CREATE_GENERATION, generations)
+                        await db.executemany(INCREMENT_TOTAL_GENERATIONS, [(g[0],) for g in generations])
+                    if touched:
+                        await db.executemany(UPDATE_LAST_ACTIVITY, [(user_id,) for user_id in touched])
+                    if deleted_menus:
+                        await db.executemany(DELETE_CHAT_MENU, deleted_menus)
+                    if saved_menus:
+                        await db.executemany(SAVE_CHAT_MENU, saved_menus)
+            except Exception as e:
+                self.stats['flush_errors'] += 1
+                logger.error(f"❌ [WRITE BUFFER] Ошибка сброса {rows} строк: {e} - пишу по одной")
+                written = await self._flush_rows(activity, generations, touched, deleted_menus, saved_menus)
+                if written == 0 and self._failed_flushes < self.max_retries:
+                    # Ни одна строка не прошла - похоже, недоступна БД: вернуть пакет в буфер
+                    self._failed_flushes += 1
+                    self._requeue(activity, generations, touched, chat_menus)
+                    return 0
+                dropped = rows - written
+                if dropped:
+                    self.stats['rows_dropped'] += dropped
+                    logger.error(f"❌ [WRITE BUFFER] Отброшено {dropped} строк, которые не удалось записать")
+                self._failed_flushes = 0
+                self.stats['rows_flushed'] += written
+                return written
+            finally:
+                self._inflight_chat_menus = {}
+
+            self._failed_flushes = 0
+            self.stats['flushes'] += 1
+            self.stats['rows_flushed'] += rows
+            logger.debug(f"💾 [WRITE BUFFER] Сброшено {rows} строк одной транзакцией")
+            return rows
+
+    async def _flush_rows(self, activity, generations, touched, deleted_menus, saved_menus) -> int:
+        """Записать пакет построчно (каждая строка - своя транзакция). Возвращает число записанных строк."""
+        statements = (
+            [[(LOG_USER_ACTIVITY, row)] for row in activity]
+            + [[(CREATE_GENERATION, row), (INCREMENT_TOTAL_GENERATIONS, (row[0],))] for row in generations]
+            + [[(DELETE_CHAT_MENU, row)] for row in deleted_menus]
+            + [[(SAVE_CHAT_MENU, row)] for row in saved_menus]
+        )
+        written = 0
+        for row_statements in statements:
+            try:
+                async with self._write() as db:
+                    for sql, params in row_statements:
+                        await db.execute(sql, params)
+                written += 1
+            except Exception as e:
+                logger.error(f"❌ [WRITE BUFFER] Строка не записана: {row_statements[0][1]}: {e}")
+        if touched and written:
+            # last_activity - не отдельные строки буфера, ошибка здесь ничего не теряет
+            try:
+                async with self._write() as db:
+                    await db.executemany(UPDATE_LAST_ACTIVITY, [(user_id,) for user_id in touched])
+            except Exception as e:
+                logger.error(f"❌ [WRITE BUFFER] Не обновлено last_activity: {e}")
+        return written
+
+    def _requeue(self, activity, generations, touched, chat_menus) -> None:
+        """Вернуть пакет в буфер (более новые записи меню важнее старых)"""
+        self._activity[:0] = activity
+        self._generations[:0] = generations
+        self._touched_users |= touched
+        for chat_id, row in chat_menus.items():
+            self._chat_menus.setdefault(chat_id, row)
+        self._trim_backlog()
+        self._has_data.set()
+
+    async def close(self) -> None:
+        """🔧 Остановить фоновый цикл и дописать остаток (вызывается при выключении бота)"""
+        if self._closed and self._task is None and not self.pending_count():
+            return
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            # Будим цикл, а не отменяем: отмена посреди транзакции потеряла бы строки
+            self._has_data.set()
+            self._full.set()
+            await self._task
+        self._task = None
+
+        rows = await self.flush()
+        # Последняя попытка при ошибке первой
+        if self.pending_count():
+            rows += await self.flush()
+        if self.pending_count():
+            logger.error(f"❌ [WRITE BUFFER] При остановке не записано {self.pending_count()} строк")
+        logger.info(f"✅ [WRITE BUFFER] Остановлен, дописано строк: {rows}, статистика: {self.stats}")
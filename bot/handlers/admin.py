@@ -1,5 +1,8 @@
 # bot/handlers/admin.py
 # --- ОБНОВЛЕН: 2025-12-09 18:45 - Исправлен блок управления балансом по единому меню ---
+# [2026-10-18 21:00] НОВОЕ: Команда /hedging - включение hedging KIE → Replicate и дневной лимит
+# [2026-10-18 16:00] PERF: Список пользователей - keyset-пагинация db.get_users_page(), курсор в callback_data
+# [2026-10-18 15:00] PERF: Админ-панель и статистика читают db.get_dashboard_snapshot() (1 запрос + кэш)
 # [2025-12-09 18:45] Удалены дублирующиеся функции управления балансом
 # [2025-12-09 18:45] Добавлено удаление текстовых сообщений админа (await message.delete())
 # [2025-12-09 18:45] Все операции редактируют единое меню через menu_message_id
@@ -20,6 +23,7 @@ from aiogram.fsm.context import FSMContext
 from datetime import datetime
 
 from database.db import db
+from services.hedging import hedged_generator
 from states.fsm import AdminStates
 
 from keyboards.admin_kb import (
@@ -68,12 +72,13 @@ async def show_admin_panel(callback: CallbackQuery, state: FSMContext, admins: l
     if menu_message_id:
         await state.update_data(menu_message_id=menu_message_id)
 
-    # Получаем статистику
-    total_users = await db.get_total_users_count()
-    total_revenue = await db.get_total_revenue()
-    new_today = await db.get_new_users_count(days=1)
-    successful_payments = await db.get_successful_payments_count()
-    failed_today = await db.get_failed_generations_count(days=1)
+    # Получаем статистику (один запрос, общий кэш)
+    snapshot = await db.get_dashboard_snapshot()
+    total_users = snapshot['total_users']
+    total_revenue = snapshot['total_revenue']
+    new_today = snapshot['new_today']
+    successful_payments = snapshot['successful_payments']
+    failed_today = snapshot['failed_today']
 
     admin_text = (
         "👑 **АДМИН-ПАНЕЛЬ**\n\n"
@@ -119,31 +124,34 @@ async def show_admin_stats(callback: CallbackQuery, state: FSMContext, admins: l
         await callback.answer("❌ У вас нет прав администратора.", show_alert=True)
         return
 
+    # Вся статистика одним запросом (общий кэш на несколько секунд)
+    snapshot = await db.get_dashboard_snapshot(top_limit=5)
+
     # ПОЛЬЗОВАТЕЛИ
-    total_users = await db.get_total_users_count()
-    new_today = await db.get_new_users_count(days=1)
-    new_week = await db.get_new_users_count(days=7)
-    active_today = await db.get_active_users_count(days=1)
-    active_week = await db.get_active_users_count(days=7)
+    total_users = snapshot['total_users']
+    new_today = snapshot['new_today']
+    new_week = snapshot['new_week']
+    active_today = snapshot['active_today']
+    active_week = snapshot['active_week']
 
     # ГЕНЕРАЦИИ
-    total_generations = await db.get_total_generations()
-    generations_today = await db.get_generations_count(days=1)
-    generations_week = await db.get_generations_count(days=7)
-    failed_today = await db.get_failed_generations_count(days=1)
-    failed_week = await db.get_failed_generations_count(days=7)
-    conversion_rate = await db.get_conversion_rate()
+    total_generations = snapshot['total_generations']
+    generations_today = snapshot['generations_today']
+    generations_week = snapshot['generations_week']
+    failed_today = snapshot['failed_today']
+    failed_week = snapshot['failed_week']
+    conversion_rate = snapshot['conversion_rate']
 
     # ФИНАНСЫ
-    total_revenue = await db.get_total_revenue()
-    revenue_today = await db.get_revenue_by_period(days=1)
-    revenue_week = await db.get_revenue_by_period(days=7)
-    successful_payments = await db.get_successful_payments_count()
-    average_payment = await db.get_average_payment()
+    total_revenue = snapshot['total_revenue']
+    revenue_today = snapshot['revenue_today']
+    revenue_week = snapshot['revenue_week']
+    successful_payments = snapshot['successful_payments']
+    average_payment = snapshot['average_payment']
 
     # ПОПУЛЯРНЫЕ КОМНАТЫ И СТИЛИ
-    popular_rooms = await db.get_popular_rooms(limit=5)
-    popular_styles = await db.get_popular_styles(limit=5)
+    popular_rooms = snapshot['popular_rooms']
+    popular_styles = snapshot['popular_styles']
 
     if popular_rooms:
         rooms_list = []
@@ -224,12 +232,22 @@ async def show_users_page_handler(callback: CallbackQuery, admins: list[int]):
         await callback.answer("❌ У вас нет прав администратора.", show_alert=True)
         return
 
-    page = int(callback.data.split("_")[-1])
-    await show_users_page(callback, page=page, admins=admins)
+    # admin_users_page_{стр}_{n|p}_{user_id}; старый формат без курсора → первая страница
+    parts = callback.data.split("_")
+    try:
+        page = int(parts[3])
+        direction = parts[4]
+        cursor_user_id = int(parts[5])
+    except (IndexError, ValueError):
+        page, direction, cursor_user_id = 1, None, None
 
+    await show_users_page(callback, page=page, admins=admins,
+                          cursor_user_id=cursor_user_id, reverse=(direction == 'p'))
 
-async def show_users_page(callback: CallbackQuery, page: int, admins: list[int]):
-    """Показать конкретную страницу пользователей"""
+
+async def show_users_page(callback: CallbackQuery, page: int, admins: list[int],
+                          cursor_user_id: int = None, reverse: bool = False):
+    """Показать конкретную страницу пользователей (курсор - user_id соседней строки)"""
     user_id = callback.from_user.id
     chat_id = callback.message.chat.id
 
@@ -237,21 +255,25 @@ async def show_users_page(callback: CallbackQuery, page: int, admins: list[int])
         await callback.answer("❌ У вас нет прав администратора.", show_alert=True)
         return
 
-    all_users = await db.get_recent_users(limit=1000)
+    per_page = 10
+    users = await db.get_users_page(after_user_id=cursor_user_id, page_size=per_page, reverse=reverse)
+
+    if not users and cursor_user_id is not None:
+        # Курсор устарел (пользователь удалён/сдвинулся) - начинаем сначала
+        page = 1
+        users = await db.get_users_page(page_size=per_page)
 
-    if not all_users:
+    if not users:
         await callback.answer("📭 Пользователей нет.", show_alert=True)
         return
 
-    per_page = 10
-    total_pages = (len(all_users) + per_page - 1) // per_page
-
-    if page < 1 or page > total_pages:
+    if cursor_user_id is None or (reverse and len(users) < per_page):
+        # Без курсора или «назад» упёрлись в начало списка
         page = 1
 
+    total_users = await db.get_total_users_count()
+    total_pages = max(page, (total_users + per_page - 1) // per_page)
     start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    users = all_users[start_idx:end_idx]
 
     users_text = f"👥 **СПИСОК ПОЛЬЗОВАТЕЛЕЙ** (стр. {page}/{total_pages})\n\n"
     for idx, user in enumerate(users, start=start_idx + 1):
@@ -266,7 +288,11 @@ async def show_users_page(callback: CallbackQuery, page: int, admins: list[int])
     try:
         await callback.message.edit_text(
             text=users_text,
-            reply_markup=get_users_list_keyboard(page, total_pages),
+            reply_markup=get_users_list_keyboard(
+                page, total_pages,
+                first_user_id=users[0]['user_id'],
+                last_user_id=users[-1]['user_id'],
+            ),
             parse_mode="Markdown"
         )
         await db.save_chat_menu(chat_id, user_id, callback.message.message_id, f'admin_users_page_{page}')
@@ -640,6 +666,52 @@ async def cmd_check_balance(message: Message, admins: list[int]):
         await message.answer(f"❌ Произошла ошибка: {e}")
 
 
+@router.message(Command("hedging"))
+async def cmd_hedging(message: Message, admins: list[int]):
+    """Hedging KIE → Replicate: статус, вкл/выкл, дневной лимит запусков Replicate"""
+    user_id = message.from_user.id
+
+    if not is_admin(user_id, admins):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+
+    args = message.text.split()[1:]
+    try:
+        if args == ['on'] or args == ['off']:
+            await db.set_setting('hedging_enabled', '1' if args[0] == 'on' else '0')
+            logger.info(f"Admin {user_id} set hedging {args[0]}")
+        elif len(args) == 2 and args[0] == 'cap':
+            daily_cap = int(args[1])
+            if daily_cap < 0:
+                raise ValueError
+            await db.set_setting('hedging_daily_cap', str(daily_cap))
+            logger.info(f"Admin {user_id} set hedging daily cap {daily_cap}")
+        elif args:
+            raise ValueError
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат команды!\n\n"
+            "Использование:\n"
+            "`/hedging` - статус\n"
+            "`/hedging on` / `/hedging off` - включить / выключить\n"
+            "`/hedging cap 20` - не больше 20 запусков Replicate в день",
+            parse_mode="Markdown"
+        )
+        return
+
+    settings = await db.get_settings('hedging_enabled', 'hedging_daily_cap')
+    stats = hedged_generator.get_stats()
+    delays = ", ".join(f"{key}: {delay}s" for key, delay in stats['delays'].items()) or "нет истории"
+    await message.answer(
+        f"🪁 **Hedging KIE → Replicate**\n\n"
+        f"Статус: {'✅ включен' if settings.get('hedging_enabled') == '1' else '❌ выключен'}\n"
+        f"Лимит в день: **{settings.get('hedging_daily_cap')}** (сегодня: {stats['hedges_today']})\n"
+        f"Задержка (p90 KIE): {delays}\n"
+        f"Запусков: {stats['hedged']}, выиграл KIE: {stats['primary_won']}, Replicate: {stats['hedge_won']}",
+        parse_mode="Markdown"
+    )
+
+
 @router.message(Command("users"))
 async def cmd_list_users(message: Message, admins: list[int]):
     """Показать список последних 10 пользователей"""
@@ -650,7 +722,7 @@ async def cmd_list_users(message: Message, admins: list[int]):
         return
 
     try:
-        users = await db.get_recent_users(limit=10)
+        users = await db.get_users_page(page_size=10)
 
         if not users:
             await message.answer("📭 Пользователей пока нет.")
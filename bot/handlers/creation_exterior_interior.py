@@ -99,9 +99,6 @@ from utils.texts import (
 from utils.helpers import add_balance_and_mode_to_text
 from utils.navigation import edit_menu, show_main_menu
 
-import aiohttp
-from aiogram.types import BufferedInputFile
-
 logger = logging.getLogger(__name__)
 router = Router()
 
@@ -23,6 +23,7 @@ from utils.texts import (
     SCREEN_16_PHOTO_FACADE,
 )
 from services.kie_api import apply_facade_style_to_house
+from services.result_images import result_images
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -299,7 +300,7 @@ async def generate_facade_handler(callback: CallbackQuery, state: FSMContext):
         
         # STEP 1: Send PHOTO
         photo_caption = "✨ *Дизайн фасада готов!*\n\nФасад оформлен с учетом вашего выбора."
-        photo_msg = await callback.message.answer_photo(photo=result_url, caption=photo_caption, parse_mode="Markdown")
+        photo_msg = await result_images.send(callback.message.answer_photo, result_url, caption=photo_caption, parse_mode="Markdown")
         logger.info(f"📸 [SCREEN 18] ФОТО отправлено (msg_id={photo_msg.message_id})")
         log_photo_send(user_id, "answer_photo", photo_msg.message_id, request_id, "apply_facade_style_to_house_success")
         
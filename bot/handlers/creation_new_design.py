@@ -3,6 +3,7 @@ import logging
 import html
 import uuid
 from datetime import datetime
+from typing import Optional
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
@@ -23,6 +24,9 @@ from keyboards.inline import (
 )
 
 from services.api_fallback import smart_generate_interior
+from services.generation_cache import is_shared_result
+from services.generation_jobs import generation_jobs
+from services.result_images import result_images
 
 from states.fsm import CreationStates, WorkMode
 
@@ -35,12 +39,9 @@ from utils.texts import (
     UPLOADING_PHOTO_TEMPLATES,
 )
 
-from utils.helpers import add_balance_and_mode_to_text
+from utils.helpers import add_balance_and_mode_to_text, queue_position_notifier
 from utils.navigation import edit_menu, show_main_menu
 
-import aiohttp
-from aiogram.types import BufferedInputFile
-
 logger = logging.getLogger(__name__)
 router = Router()
 
@@ -339,15 +340,16 @@ async def style_choice_handler(callback: CallbackQuery, state: FSMContext, admin
     
     🔥 ПРОЦЕСС:
     1️⃣ Проверка баланса
-    2️⃣ Минусование баланса
+    2️⃣ Минусование баланса (1+2 = db.try_reserve_generation, атомарно)
     3️⃣ Отправка прогресса
-    4️⃣ 🤖 Генерация дизайна (smart_generate_interior)
+    4️⃣ 🤖 Генерация дизайна (smart_generate_interior) - в фоновом задании generation_jobs
     5️⃣ Отправка фото дизайна
     6️⃣ Отправка меню с кнопками
     7️⃣ Удаление сообщения прогресса
     8️⃣ Переход на SCREEN 6
+    (4-8 выполняются после выхода из обработчика; задание переживает перезапуск бота)
     
-    ⚠️ FALLBACK: Если URL не работает → загружаем файл локально через BufferedInputFile
+    ⚠️ FALLBACK: Если URL не работает → result_images скачивает файл в дисковый кэш и отправляет FSInputFile
     """
    # style = callback.data.split("_")[-1
     style = callback.data.replace("style_", "", 1)
@@ -379,13 +381,14 @@ async def style_choice_handler(callback: CallbackQuery, state: FSMContext, admin
         return
 
     # ═════════════════════════════════════════════════════════════════════════
-    # ПРОВЕРКА БАЛАНСА
+    # ПРОВЕРКА + СПИСАНИЕ БАЛАНСА (один атомарный UPDATE)
     # ═════════════════════════════════════════════════════════════════════════
     
     is_admin = user_id in admins
+    reservation = None
     if not is_admin:
-        balance = await db.get_balance(user_id)
-        if balance <= 0:
+        reservation = await db.try_reserve_generation(user_id, cost=1)
+        if reservation is None:
             await state.clear()
             await edit_menu(
                 callback=callback,
@@ -397,13 +400,6 @@ async def style_choice_handler(callback: CallbackQuery, state: FSMContext, admin
             )
             return
 
-    # ═════════════════════════════════════════════════════════════════════════
-    # МИНУСОВАНИЕ БАЛАНСА
-    # ═════════════════════════════════════════════════════════════════════════
-    
-    if not is_admin:
-        await db.decrease_balance(user_id)
-
     # ═════════════════════════════════════════════════════════════════════════
     # Отправка прогресса
     # ═════════════════════════════════════════════════════════════════════════
@@ -448,139 +444,133 @@ async def style_choice_handler(callback: CallbackQuery, state: FSMContext, admin
     use_pro = pro_settings.get('pro_mode', False)
     logger.info(f"🔧 PRO MODE для user_id={user_id}: {use_pro}")
 
-    try:
-        result_image_url = await smart_generate_interior(
-            photo_id, room, style, bot_token, use_pro=use_pro
+    async def generate() -> Optional[str]:
+        return await smart_generate_interior(
+            photo_id, room, style, bot_token, use_pro=use_pro,
+            user_id=user_id, on_queue_position=queue_position_notifier(progress_msg, balance_text, "HTML"),
         )
-        success = result_image_url is not None
-    except Exception as e:
-        logger.error(f"[ERROR] Критическая ошибка генерации: {e}")
-        result_image_url = None
-        success = False
-
-    await db.log_generation(
-        user_id=user_id,
-        room_type=room,
-        style_type=style,
-        operation_type='design',
-        success=success
-    )
-
-    # ═════════════════════════════════════════════════════════════════════════
-    # ✅ [SCREEN 6] МЕНЮ ПОСЛЕ ГЕНЕРАЦИИ
-    # ═════════════════════════════════════════════════════════════════════════
-
-    if result_image_url:
-        balance = await db.get_balance(user_id)
-        
-        room_display = ROOM_TYPES.get(room, room.replace('_', ' ').title())
-        style_display = STYLE_TYPES.get(style, style.replace('_', ' ').title())
-        
-        design_caption = f"""✨ <b>Идея для дизайна {room_display} в стиле {style_display} готова!</b>
-        """
-        
-        menu_caption = f"""🎨 <b>Что дальше?
-Есть 20 готовых стилей!</b>
 
-Выберите действие:
-🔄 Создать другой стиль.
-🏠 Выбрать режим работы.
+    async def deliver(result_image_url: Optional[str]) -> bool:
+        """Отправка результата (в фоне, после завершения генерации). True - фото доставлено"""
+        success = result_image_url is not None
+        await db.log_generation(
+            user_id=user_id,
+            room_type=room,
+            style_type=style,
+            operation_type='design',
+            success=success
+        )
 
-📊 Баланс: <b>{balance}</b> генераций | 🔧 Режим: <b>{work_mode}</b>"""
-        
-        photo_sent = False
+        # ═════════════════════════════════════════════════════════════════════════
+        # ✅ [SCREEN 6] МЕНЮ ПОСЛЕ ГЕНЕРАЦИИ
+        # ═════════════════════════════════════════════════════════════════════════
 
-        # ПОПЫТКА 1: Прямая отправка
-        try:
-            logger.warning(f"📊 [SCREEN 6] ATTEMPT 1: answer_photo")
+        if result_image_url:
+            if reservation and is_shared_result(result_image_url):
+                # [2026-10-18] Тот же запрос уже оплачен (двойное нажатие, повтор) - возвращаем списание
+                await reservation.refund()
+                logger.info(f"♻️ [SCREEN 6] Результат повторного запроса, списание возвращено user_id={user_id}")
+            balance = await db.get_balance(user_id)
             
-            photo_msg = await callback.message.answer_photo(
-                photo=result_image_url,
-                caption=design_caption,
-                parse_mode="HTML",
-            )
+            room_display = ROOM_TYPES.get(room, room.replace('_', ' ').title())
+            style_display = STYLE_TYPES.get(style, style.replace('_', ' ').title())
             
-            photo_sent = True
-            logger.warning(f"📊 [SCREEN 6] SUCCESS: answer_photo")
-            log_photo_send(user_id, "answer_photo", photo_msg.message_id, request_id, "style_choice")
+            # Явные "\n": многострочный f-string внутри deliver() получил бы отступ в тексте
+            design_caption = (
+                f"✨ <b>Идея для дизайна {room_display} в стиле {style_display} готова!</b>\n"
+                "        "
+            )
             
-            await db.save_chat_menu(chat_id, user_id, photo_msg.message_id, 'post_generation')
+            menu_caption = (
+                "🎨 <b>Что дальше?\n"
+                "Есть 20 готовых стилей!</b>\n"
+                "\n"
+                "Выберите действие:\n"
+                "🔄 Создать другой стиль.\n"
+                "🏠 Выбрать режим работы.\n"
+                "\n"
+                f"📊 Баланс: <b>{balance}</b> генераций | 🔧 Режим: <b>{work_mode}</b>"
+            )
             
-            # Отправляем меню
+            photo_sent = False
+
+            # Отправка: file_id (если URL уже отправлялся) → URL → файл из дискового кэша
             try:
-                menu_msg = await callback.message.answer(
-                    text=menu_caption,
+                logger.warning(f"📊 [SCREEN 6] SEND: result_images")
+                
+                photo_msg = await result_images.send(
+                    callback.message.answer_photo,
+                    result_image_url,
+                    caption=design_caption,
                     parse_mode="HTML",
-                    reply_markup=get_post_generation_keyboard()
                 )
-                logger.warning(f"📊 [SCREEN 6] MENU SENT")
                 
-                await state.update_data(photo_message_id=photo_msg.message_id, menu_message_id=menu_msg.message_id)
-                await db.save_chat_menu(chat_id, user_id, menu_msg.message_id, 'post_generation_menu')
+                photo_sent = True
+                logger.warning(f"📊 [SCREEN 6] SUCCESS: answer_photo")
+                log_photo_send(user_id, "answer_photo", photo_msg.message_id, request_id, "style_choice")
                 
-            except Exception as menu_error:
-                logger.warning(f"⚠️ [SCREEN 6] Failed to send menu: {menu_error}")
-            
-            # Удаляем прогресс
-            if progress_msg:
+                await db.save_chat_menu(chat_id, user_id, photo_msg.message_id, 'post_generation')
+                
+                # Отправляем меню
                 try:
-                    await progress_msg.delete()
-                except Exception:
-                    pass
+                    menu_msg = await callback.message.answer(
+                        text=menu_caption,
+                        parse_mode="HTML",
+                        reply_markup=get_post_generation_keyboard()
+                    )
+                    logger.warning(f"📊 [SCREEN 6] MENU SENT")
+                    
+                    await state.update_data(photo_message_id=photo_msg.message_id, menu_message_id=menu_msg.message_id)
+                    await db.save_chat_menu(chat_id, user_id, menu_msg.message_id, 'post_generation_menu')
+                    
+                except Exception as menu_error:
+                    logger.warning(f"⚠️ [SCREEN 6] Failed to send menu: {menu_error}")
+                
+                # Удаляем прогресс
+                if progress_msg:
+                    try:
+                        await progress_msg.delete()
+                    except Exception:
+                        pass
+
+            except Exception as send_error:
+                logger.error(f"📊 [SCREEN 6] FAILED SEND: {send_error}")
+
+            # FALLBACK: Все попытки не сработали
+            if not photo_sent:
+                if reservation:
+                    await reservation.refund()
+                
+                logger.error(f"📊 [SCREEN 6] ALL ATTEMPTS FAILED")
+                
+                if progress_msg:
+                    try:
+                        await progress_msg.delete()
+                    except Exception:
+                        pass
+                
+                await callback.message.answer(
+                    text="❌ Ошибка при отправке изображения. Баланс возвращен. Попробуйте ещё раз.",
+                    parse_mode="Markdown"
+                )
+                return False
 
-        except Exception as url_error:
-            logger.warning(f"📊 [SCREEN 6] FAILED ATTEMPT 1: {url_error}")
+            if reservation:
+                reservation.commit()
 
-            # ПОПЫТКА 2: Загрузка локально
-            try:
-                logger.warning(f"📊 [SCREEN 6] ATTEMPT 2: BufferedInputFile")
-
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(result_image_url, timeout=aiohttp.ClientTimeout(total=20)) as resp:
-                        if resp.status == 200:
-                            photo_data = await resp.read()
-
-                            photo_msg = await callback.message.answer_photo(
-                                photo=BufferedInputFile(photo_data, filename="design.jpg"),
-                                caption=design_caption,
-                                parse_mode="HTML",
-                            )
-                            
-                            photo_sent = True
-                            logger.warning(f"📊 [SCREEN 6] SUCCESS: BufferedInputFile")
-                            log_photo_send(user_id, "answer_photo_buffered", photo_msg.message_id, request_id, "style_choice")
-                            
-                            await db.save_chat_menu(chat_id, user_id, photo_msg.message_id, 'post_generation')
-                            
-                            # Отправляем меню
-                            try:
-                                menu_msg = await callback.message.answer(
-                                    text=menu_caption,
-                                    parse_mode="HTML",
-                                    reply_markup=get_post_generation_keyboard()
-                                )
-                                await state.update_data(photo_message_id=photo_msg.message_id, menu_message_id=menu_msg.message_id)
-                                await db.save_chat_menu(chat_id, user_id, menu_msg.message_id, 'post_generation_menu')
-                                
-                            except Exception as menu_error:
-                                logger.warning(f"⚠️ [SCREEN 6] Failed to send menu: {menu_error}")
-                            
-                            # Удаляем прогресс
-                            if progress_msg:
-                                try:
-                                    await progress_msg.delete()
-                                except Exception:
-                                    pass
-
-            except Exception as buffer_error:
-                logger.error(f"📊 [SCREEN 6] FAILED ATTEMPT 2: {buffer_error}")
-
-        # FALLBACK: Все попытки не сработали
-        if not photo_sent:
-            if not is_admin:
-                await db.increase_balance(user_id, 1)
+            # Переход на SCREEN 6
+            await state.set_state(CreationStates.post_generation)
+
+            logger.warning(f"📊 [SCREEN 6] GENERATION SUCCESS")
+            logger.info(f"[SCREEN 6] Generated for {room}/{style}, user_id={user_id}")
+            return True
+
+        else:
+            # ОШИБКА ГЕНЕРАЦИИ
+            if reservation:
+                await reservation.refund()
             
-            logger.error(f"📊 [SCREEN 6] ALL ATTEMPTS FAILED")
+            logger.error(f"📊 [SCREEN 6] GENERATION_FAILED")
             
             if progress_msg:
                 try:
@@ -589,35 +579,23 @@ async def style_choice_handler(callback: CallbackQuery, state: FSMContext, admin
                     pass
             
             await callback.message.answer(
-                text="❌ Ошибка при отправке изображения. Баланс возвращен. Попробуйте ещё раз.",
+                text="❌ Ошибка генерации. Баланс возвращен. Попробуйте ещё раз.",
                 parse_mode="Markdown"
             )
-            return
-
-        # Переход на SCREEN 6
-        await state.set_state(CreationStates.post_generation)
+            return False
 
-        logger.warning(f"📊 [SCREEN 6] GENERATION SUCCESS")
-        logger.info(f"[SCREEN 6] Generated for {room}/{style}, user_id={user_id}")
-
-    else:
-        # ОШИБКА ГЕНЕРАЦИИ
-        if not is_admin:
-            await db.increase_balance(user_id, 1)
-        
-        logger.error(f"📊 [SCREEN 6] GENERATION_FAILED")
-        
-        if progress_msg:
-            try:
-                await progress_msg.delete()
-            except Exception:
-                pass
-        
-        await callback.message.answer(
-            text="❌ Ошибка генерации. Баланс возвращен. Попробуйте ещё раз.",
-            parse_mode="Markdown"
-        )
 
+    # Генерация и доставка - в фоновом задании (generation_jobs): обработчик завершается сразу,
+    # а после перезапуска бота задание продолжится или вернёт баланс
+    await generation_jobs.submit(
+        user_id=user_id,
+        chat_id=chat_id,
+        mode='design',
+        generate=generate,
+        deliver=deliver,
+        reservation=reservation,
+        params={'room': room, 'style': style, 'use_pro': use_pro},
+    )
 
 # ═════════════════════════════════════════════════════════════════════════════
 # 🔄 [SCREEN 6→4] СМЕНА СТИЛЯ ПОСЛЕ ГЕНЕРАЦИИ
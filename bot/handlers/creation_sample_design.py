@@ -2,6 +2,7 @@ import logging
 import asyncio
 import uuid
 from datetime import datetime
+from typing import Optional
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
@@ -16,6 +17,8 @@ from utils.helpers import add_balance_and_mode_to_text
 from utils.texts import GENERATION_TRY_ON_TEXT, DOWNLOAD_SAMPLE_TEXT
 from utils.texts import SCREEN_10_PHOTO_SAMPLE
 from services.kie_api import apply_style_to_room
+from services.generation_jobs import generation_jobs
+from services.result_images import result_images
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -334,80 +337,110 @@ async def generate_try_on_handler(callback: CallbackQuery, state: FSMContext):
             except TelegramBadRequest as e:
                 logger.debug(f"⚠️ Не удалось отредактировать: {e}")
         
-        logger.info(f"🚀 Запускаем apply_style_to_room()...")
-        result_url = await apply_style_to_room(
-            main_photo_file_id=main_photo_id,
-            sample_photo_file_id=sample_photo_id,
-            bot_token=config.BOT_TOKEN
-        )
-        
-        if not result_url:
-            logger.error("❌ Генерация провалилась")
-            error_text = "❌ Ошибка генерации. Пожалуйста, попробуйте еще раз."
-            try:
-                await callback.message.edit_text(
-                    text=error_text,
-                    reply_markup=get_generation_try_on_keyboard()
-                )
-            except TelegramBadRequest:
-                await callback.message.answer(text=error_text)
-            return
-        
-        logger.info(f"✅ Результат примерки готов: {result_url[:50]}...")
-        log_photo_send(user_id, "answer_photo", 0, request_id, "apply_style_to_room")
-        
-        if progress_message_id:
+        async def generate() -> Optional[str]:
+            logger.info(f"🚀 Запускаем apply_style_to_room()...")
+            return await apply_style_to_room(
+                main_photo_file_id=main_photo_id,
+                sample_photo_file_id=sample_photo_id,
+                bot_token=config.BOT_TOKEN
+            )
+
+        async def deliver(result_url: Optional[str]) -> bool:
+            """Отправка примерки (в фоне, после завершения генерации). True - фото доставлено"""
+            if not result_url:
+                logger.error("❌ Генерация провалилась")
+                error_text = "❌ Ошибка генерации. Пожалуйста, попробуйте еще раз."
+                try:
+                    await callback.message.edit_text(
+                        text=error_text,
+                        reply_markup=get_generation_try_on_keyboard()
+                    )
+                except TelegramBadRequest:
+                    await callback.message.answer(text=error_text)
+                return False
+            
+            logger.info(f"✅ Результат примерки готов: {result_url[:50]}...")
+            log_photo_send(user_id, "answer_photo", 0, request_id, "apply_style_to_room")
+            
+            if progress_message_id:
+                try:
+                    await callback.bot.delete_message(chat_id=chat_id, message_id=progress_message_id)
+                    logger.info(f"🗑️ [PROGRESS] Удалено прогресс-сообщение (msg_id={progress_message_id})")
+                except TelegramBadRequest as e:
+                    logger.warning(f"⚠️ [PROGRESS] Не удалось удалить прогресс: {e}")
+                    try:
+                        await callback.bot.edit_message_text(
+                            chat_id=chat_id,
+                            message_id=progress_message_id,
+                            text="✅ *Примерка готова!*"
+                        )
+                        logger.info(f"📝 [PROGRESS] Отредактировано вместо удаления")
+                    except Exception as e2:
+                        logger.debug(f"⚠️ [PROGRESS] Fallback не сработал: {e2}")
+            
+            photo_caption = ("✨ *Примерка готова!*\n\nДизайн применен к вашей комнате с сохранением мебели и макета.")
+            photo_sent = False
+
+            # Фоновое задание только логирует исключения deliver - ошибки отправки обрабатываем здесь
             try:
-                await callback.bot.delete_message(chat_id=chat_id, message_id=progress_message_id)
-                logger.info(f"🗑️ [PROGRESS] Удалено прогресс-сообщение (msg_id={progress_message_id})")
-            except TelegramBadRequest as e:
-                logger.warning(f"⚠️ [PROGRESS] Не удалось удалить прогресс: {e}")
+                photo_msg = await result_images.send(callback.message.answer_photo, result_url, caption=photo_caption, parse_mode="Markdown")
+                photo_sent = True
+                logger.info(f"📸 [SCREEN 12] ФОТО примерки отправлено (msg_id={photo_msg.message_id})")
+                log_photo_send(user_id, "answer_photo", photo_msg.message_id, request_id, "apply_style_to_room_success")
+                
+                await db.save_chat_menu(chat_id, user_id, photo_msg.message_id, 'post_generation_sample_photo')
+                logger.info(f"💾 [ДБ] Сохранено ФОТО: msg_id={photo_msg.message_id}")
+                
+                # Отправляем меню
                 try:
-                    await callback.bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=progress_message_id,
-                        text="✅ *Примерка готова!*"
+                    menu_text = f"🎨 *Примерка дизайна готова!*\n\nВыберите действие:\n📝 Редактировать текстом\n📸 Загрузить новый образец\n🏠 Вернуться в меню"
+                    menu_text = await add_balance_and_mode_to_text(menu_text, user_id, work_mode='sample_design')
+                    
+                    menu_msg = await callback.message.answer(text=menu_text, reply_markup=get_post_generation_sample_keyboard(), parse_mode="Markdown")
+                    logger.info(f"📝 [SCREEN 12] МЕНЮ отправлено (msg_id={menu_msg.message_id})")
+                    
+                    await state.update_data(
+                        photo_message_id=photo_msg.message_id,
+                        menu_message_id=menu_msg.message_id,
+                        last_generated_image_url=result_url
                     )
-                    logger.info(f"📝 [PROGRESS] Отредактировано вместо удаления")
-                except Exception as e2:
-                    logger.debug(f"⚠️ [PROGRESS] Fallback не сработал: {e2}")
-        
-        photo_caption = ("✨ *Примерка готова!*\n\nДизайн применен к вашей комнате с сохранением мебели и макета.")
-        photo_msg = await callback.message.answer_photo(photo=result_url, caption=photo_caption, parse_mode="Markdown")
-        logger.info(f"📸 [SCREEN 12] ФОТО примерки отправлено (msg_id={photo_msg.message_id})")
-        log_photo_send(user_id, "answer_photo", photo_msg.message_id, request_id, "apply_style_to_room_success")
-        
-        data = await state.get_data()
-        work_mode = data.get('work_mode', 'sample_design')
-        balance = await db.get_balance(user_id)
-        
-        menu_text = f"🎨 *Примерка дизайна готова!*\n\nВыберите действие:\n📝 Редактировать текстом\n📸 Загрузить новый образец\n🏠 Вернуться в меню"
-        menu_text = await add_balance_and_mode_to_text(menu_text, user_id, work_mode='sample_design')
-        
-        menu_msg = await callback.message.answer(text=menu_text, reply_markup=get_post_generation_sample_keyboard(), parse_mode="Markdown")
-        logger.info(f"📝 [SCREEN 12] МЕНЮ отправлено (msg_id={menu_msg.message_id})")
-        
-        await state.update_data(
-            photo_message_id=photo_msg.message_id,
-            menu_message_id=menu_msg.message_id,
-            last_generated_image_url=result_url
+                    
+                    await db.save_chat_menu(chat_id, user_id, menu_msg.message_id, 'post_generation_sample')
+                    logger.info(f"💾 [ДБ] Сохранено МЕНЮ: msg_id={menu_msg.message_id}")
+                    
+                    await state.set_state(CreationStates.post_generation_sample)
+                    
+                    logger.info(f"✅ [SCREEN 11→12] COMPLETED!")
+                    logger.info(f"   ✅ ПРОГРЕСС: удалено (msg_id={progress_message_id})")
+                    logger.info(f"   ✅ ФОТО: msg_id={photo_msg.message_id}")
+                    logger.info(f"   ✅ МЕНЮ: msg_id={menu_msg.message_id}")
+                    logger.info(f"   ✅ FOOTER: Баланс + Режим работы добавлены")
+                    logger.info(f"   ✅ ОБЕ ID сохранены в FSM & ДБ")
+                    
+                except Exception as menu_error:
+                    logger.warning(f"⚠️ [SCREEN 12] Не удалось отправить меню: {menu_error}")
+                
+            except Exception as send_error:
+                logger.error(f"❌ [SCREEN 12] Не удалось отправить примерку: {send_error}")
+            
+            if not photo_sent:
+                await callback.message.answer(
+                    text="❌ Ошибка при отправке изображения. Пожалуйста, попробуйте еще раз.",
+                    reply_markup=get_generation_try_on_keyboard()
+                )
+                return False
+            
+            return True
+
+        # Генерация и доставка - в фоновом задании (generation_jobs), обработчик завершается сразу
+        await generation_jobs.submit(
+            user_id=user_id,
+            chat_id=chat_id,
+            mode='try_on',
+            generate=generate,
+            deliver=deliver,
         )
-        
-        await db.save_chat_menu(chat_id, user_id, photo_msg.message_id, 'post_generation_sample_photo')
-        logger.info(f"💾 [ДБ] Сохранено ФОТО: msg_id={photo_msg.message_id}")
-        
-        await db.save_chat_menu(chat_id, user_id, menu_msg.message_id, 'post_generation_sample')
-        logger.info(f"💾 [ДБ] Сохранено МЕНЮ: msg_id={menu_msg.message_id}")
-        
-        await state.set_state(CreationStates.post_generation_sample)
-        
-        logger.info(f"✅ [SCREEN 11→12] COMPLETED!")
-        logger.info(f"   ✅ ПРОГРЕСС: удалено (msg_id={progress_message_id})")
-        logger.info(f"   ✅ ФОТО: msg_id={photo_msg.message_id}")
-        logger.info(f"   ✅ МЕНЮ: msg_id={menu_msg.message_id}")
-        logger.info(f"   ✅ FOOTER: Баланс + Режим работы добавлены")
-        logger.info(f"   ✅ ОБЕ ID сохранены в FSM & ДБ")
-        
+
     except Exception as e:
         logger.error(f"[ERROR] SCREEN 11 кнопка failed: {e}", exc_info=True)
         await callback.answer(f"❌ Ошибка. Попробуйте еще раз: {str(e)[:50]}", show_alert=True)
@@ -3,6 +3,8 @@
 # EDIT_DESIGN MODE HANDLERS
 # Дата создания: 2026-01-02
 # [2026-01-05 00:00] FIXED: bot_token теперь берется из config, не из параметра
+# [2026-10-18] Генерации идут через планировщик (user_id), позиция в очереди - в сообщении прогресса
+# [2026-10-18] Результат отправляется через result_images (повторно - по file_id, при ошибке URL - файлом из кэша)
 # ========================================
 """
 Обработчики для режима EDIT_DESIGN (экраны 7, 8, 9):
@@ -46,6 +48,8 @@ from services.api_fallback import (
     smart_clear_space,
 )
 from services.design_styles import get_room_name
+from utils.helpers import queue_position_notifier
+from services.result_images import result_images
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -208,7 +212,9 @@ async def receive_text_prompt(message: Message, state: FSMContext):
             user_prompt=user_text,  # ✅ ТОЛЬКО ЭТО! БЕЗ base_prompt!
             bot_token=config.BOT_TOKEN,  # ✅ [2026-01-05] ИСПРАВЛЕНО: из config
             scene_type=room_type,  # Передаем room_type как scene_type
-            use_pro=use_pro
+            use_pro=use_pro,
+            user_id=user_id,
+            on_queue_position=queue_position_notifier(progress_msg, f"⏳ **Применяю ваше описание...**\n\n_{user_text}_"),
         )
         
         # ШАГ 5: Отправляем новое фото
@@ -224,8 +230,9 @@ async def receive_text_prompt(message: Message, state: FSMContext):
                 logger.debug(f"Could not delete progress message: {e}")
             
             # Отправить новое фото с обновленным caption
-            sent_photo = await message.answer_photo(
-                photo=result_image_url,
+            sent_photo = await result_images.send(
+                message.answer_photo,
+                result_image_url,
                 caption=f"✨ **Дизайн обновлен с учетом ваших пожеланий!**\n\nВаше задание - {user_text}"
             )
             
@@ -378,7 +385,9 @@ async def execute_clear_space(callback: CallbackQuery, state: FSMContext):
         result_image_url = await smart_clear_space(
             photo_file_id=photo_id,
             bot_token=config.BOT_TOKEN,  # ✅ [2026-01-05] ИСПРАВЛЕНО: из config
-            use_pro=use_pro
+            use_pro=use_pro,
+            user_id=user_id,
+            on_queue_position=queue_position_notifier(progress_msg, "⏳ **Очищаю помещение...**"),
         )
         
         # ШАГ 4: Отправляем очищенное фото
@@ -391,8 +400,9 @@ async def execute_clear_space(callback: CallbackQuery, state: FSMContext):
                     logger.debug(f"Could not delete progress message: {e}")
             
             # Отправить очищенное фото
-            sent_photo = await callback.message.answer_photo(
-                photo=result_image_url,
+            sent_photo = await result_images.send(
+                callback.message.answer_photo,
+                result_image_url,
                 caption="✨ **Помещение очищено!**\n\nТеперь вы можете редактировать дизайн"
             )
             
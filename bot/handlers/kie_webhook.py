@@ -0,0 +1,83 @@
+# bot/handlers/kie_webhook.py
+# --- СОЗДАН: 2026-10-18 - Endpoint callback завершения задач Kie.ai ---
+# --- ОБНОВЛЕН: 2026-10-18 - Без KIE_CALLBACK_SECRET callback не принимается (403) ---
+# --- ОБНОВЛЕН: 2026-10-18 - GET {KIE_INPUT_PATH}/<имя>.jpg: раздача подготовленных фото для Kie.ai ---
+
+"""
+Приём callback от Kie.ai о завершении задачи генерации.
+
+Kie.ai присылает на callBackUrl тело вида
+{"code": 200, "msg": "...", "data": {"taskId": "...", "state": "success", "resultJson": "...", ...}}
+- те же поля, что и recordInfo. Данные передаются в services/kie_callbacks.py,
+где их ждёт kie_task_tracker.
+
+URL: POST {KIE_CALLBACK_PATH}?token={KIE_CALLBACK_SECRET}
+
+Тот же сервер отдаёт фото, подготовленные services/image_preprocess.py:
+GET {KIE_INPUT_PATH}/<имя>.jpg
+"""
+
+import hmac
+import logging
+import os
+import re
+from aiohttp import web
+
+from config_kie import config_kie
+from services.image_preprocess import image_preprocessor
+from services.kie_callbacks import kie_callbacks
+
+logger = logging.getLogger(__name__)
+
+# Имена файлов - uuid4().hex + .jpg, всё остальное (в т.ч. ../) не отдаём
+INPUT_NAME_RE = re.compile(r'^[0-9a-f]{32}\.jpg$')
+
+
+async def kie_callback_handler(request: web.Request) -> web.Response:
+    """Обработчик callback от Kie.ai"""
+    # Без секрета любой мог бы подставить resultUrls чужой задачи - не принимаем ничего
+    token = request.query.get('token', '')
+    if not config_kie.KIE_CALLBACK_SECRET or not hmac.compare_digest(token, config_kie.KIE_CALLBACK_SECRET):
+        logger.warning(f"[KIE CALLBACK] ⚠️ Неверный token от {request.remote}")
+        return web.json_response({"error": "Forbidden"}, status=403)
+
+    try:
+        body = await request.json()
+    except Exception:
+        logger.warning("[KIE CALLBACK] ⚠️ Тело запроса не JSON")
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+
+    data = body.get('data') if isinstance(body, dict) else None
+    if not isinstance(data, dict):
+        data = body if isinstance(body, dict) else {}
+
+    task_id = data.get('taskId')
+    if not task_id:
+        logger.warning(f"[KIE CALLBACK] ⚠️ Нет taskId: {body}")
+        return web.json_response({"error": "taskId required"}, status=400)
+
+    # Kie.ai может прислать code != 200 без state - считаем это ошибкой задачи
+    if 'state' not in data and body.get('code') not in (None, 200):
+        data = {**data, 'state': 'fail', 'failMsg': body.get('msg')}
+
+    matched = kie_callbacks.resolve(task_id, data)
+    logger.info(f"[KIE CALLBACK] Task {task_id}: state={data.get('state')}, ожидали={matched}")
+    return web.json_response({"status": "ok"})
+
+
+async def kie_input_handler(request: web.Request) -> web.StreamResponse:
+    """Отдать подготовленное фото Kie.ai"""
+    name = request.match_info['name']
+    if not INPUT_NAME_RE.match(name):
+        raise web.HTTPNotFound()
+    path = image_preprocessor.path_for(name)
+    if not os.path.isfile(path):
+        raise web.HTTPNotFound()
+    return web.FileResponse(path, headers={'Content-Type': 'image/jpeg'})
+
+
+def setup_kie_callback_routes(app: web.Application):
+    """Регистрация маршрута callback Kie.ai"""
+    app.router.add_post(config_kie.KIE_CALLBACK_PATH, kie_callback_handler)
+    logger.info(f"✅ Маршрут callback Kie.ai зарегистрирован: POST {config_kie.KIE_CALLBACK_PATH}")
+    app.router.add_get(f"{config_kie.KIE_INPUT_PATH}/{{name}}", kie_input_handler)
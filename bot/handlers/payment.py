@@ -1,4 +1,7 @@
 # bot/handlers/payment.py
+# --- ОБНОВЛЕН: 2026-10-18 - id нажатия кнопки передаётся в create_payment_yookassa (Idempotence-Key) ---
+# --- ОБНОВЛЕН: 2026-10-18 - Платежи YooKassa создаются и проверяются async (не блокируют бота); оплата засчитывается только в статусе succeeded ---
+# --- ОБНОВЛЕН: 2026-10-18 - Настройки реферальной комиссии читаются одним db.get_settings() из кэша ---
 # --- ОБНОВЛЕН: 2025-12-04 12:15 - Исправлены отступы уведомлений о платежах ---
 
 import logging
@@ -8,7 +11,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from database.db import db
 from keyboards.inline import get_payment_check_keyboard, get_payment_keyboard, get_main_menu_keyboard
 from utils.texts import PAYMENT_CREATED, PAYMENT_SUCCESS_TEXT, PAYMENT_ERROR_TEXT, MAIN_MENU_TEXT
-from services.payment_api import create_payment_yookassa, find_payment
+from services.payment_api import create_payment_yookassa, is_payment_successful
 from utils.helpers import add_balance_to_text
 
 logger = logging.getLogger(__name__)
@@ -46,7 +49,7 @@ async def create_payment(callback: CallbackQuery):
     user_id = callback.from_user.id
     amount = int(price)
     tokens_amount = int(tokens)
-    payment_data = create_payment_yookassa(amount, user_id, tokens_amount)
+    payment_data = await create_payment_yookassa(amount, user_id, tokens_amount, request_id=callback.id)
     if not payment_data:
         await callback.answer("Ошибка создания платежа", show_alert=True)
         return
@@ -74,8 +77,10 @@ async def _process_referral_commission(user_id: int, payment_id: str, amount: in
     """
     try:
         # 1. Проверяем включена ли реферальная программа
-        enabled = await db.get_setting('referral_enabled')
-        if str(enabled) != '1':
+        settings = await db.get_settings(
+            'referral_enabled', 'referral_commission_percent', 'referral_exchange_rate'
+        )
+        if str(settings['referral_enabled']) != '1':
             return
 
         # 2. Находим реферера
@@ -89,7 +94,7 @@ async def _process_referral_commission(user_id: int, payment_id: str, amount: in
             return
 
         # 3. Рассчитываем комиссию
-        commission_percent = int(await db.get_setting('referral_commission_percent') or '10')
+        commission_percent = int(settings['referral_commission_percent'] or '10')
         earnings = int(amount * commission_percent / 100)
 
         logger.info(f"[REFERRAL] Расчет: {amount} руб * {commission_percent}% = {earnings} руб")
@@ -99,7 +104,7 @@ async def _process_referral_commission(user_id: int, payment_id: str, amount: in
         logger.info(f"[REFERRAL] Начислено {earnings} руб на реф. баланс реферера {referrer_id}")
 
         # 5. Конвертируем в генерации и начисляем на основной баланс
-        exchange_rate = int(await db.get_setting('referral_exchange_rate') or '29')
+        exchange_rate = int(settings['referral_exchange_rate'] or '29')
         tokens_to_give = earnings // exchange_rate
 
         logger.info(f"[REFERRAL] Конвертация: {earnings} руб = {tokens_to_give} генераций")
@@ -133,7 +138,7 @@ async def check_payment(callback: CallbackQuery, admins: list[int]):
         await callback.answer("Нет активных платежей для проверки.", show_alert=True)
         return
 
-    is_paid = find_payment(last_payment['yookassa_payment_id'])
+    is_paid = await is_payment_successful(last_payment['yookassa_payment_id'])
     if is_paid:
         # 1. Обновляем статус платежа
         await db.set_payment_success(last_payment['yookassa_payment_id'])
@@ -1,4 +1,5 @@
 # bot/handlers/webhook.py
+# --- ОБНОВЛЕН: 2026-10-18 - Настройки реферальной комиссии читаются одним db.get_settings() из кэша ---
 # --- ОБНОВЛЕН: 2025-12-10 - Полная интеграция с YooKassa вебхуками ---
 
 """
@@ -30,8 +31,10 @@ async def _process_referral_commission(user_id: int, payment_id: str, amount: in
     """
     try:
         # 1. Проверяем включена ли реферальная программа
-        enabled = await db.get_setting('referral_enabled')
-        if str(enabled) != '1':
+        settings = await db.get_settings(
+            'referral_enabled', 'referral_commission_percent', 'referral_exchange_rate'
+        )
+        if str(settings['referral_enabled']) != '1':
             logger.debug(f"[WEBHOOK][REFERRAL] Реферальная программа отключена")
             return
 
@@ -47,7 +50,7 @@ async def _process_referral_commission(user_id: int, payment_id: str, amount: in
             return
 
         # 3. Рассчитываем комиссию
-        commission_percent = int(await db.get_setting('referral_commission_percent') or '10')
+        commission_percent = int(settings['referral_commission_percent'] or '10')
         earnings = int(amount * commission_percent / 100)
 
         logger.info(
@@ -61,7 +64,7 @@ async def _process_referral_commission(user_id: int, payment_id: str, amount: in
         )
 
         # 5. Конвертируем в генерации и начисляем на основной баланс
-        exchange_rate = int(await db.get_setting('referral_exchange_rate') or '29')
+        exchange_rate = int(settings['referral_exchange_rate'] or '29')
         tokens_to_give = earnings // exchange_rate
 
         logger.info(
@@ -1,5 +1,6 @@
 # bot/keyboards/admin_kb.py
 # --- ОБНОВЛЕН: 2025-12-09 16:24 - Удалены дублирующиеся функции клавиатур для баланса ---
+# [2026-10-18 16:00] Пагинация пользователей: callback_data несёт курсор (admin_users_page_{стр}_{n|p}_{user_id})
 # [2025-12-09 16:24] Были дублированы: get_balance_main_keyboard, get_balance_confirm_keyboard, get_balance_cancel_keyboard
 # [2025-12-09 16:24] Удалена ненужная функция: get_balance_search_type_keyboard (неправильный подход)
 # [2025-12-09 16:24] Оставлены только первые определения каждой функции
@@ -58,24 +59,28 @@ def get_back_to_settings():
     return builder.as_markup()
 
 
-def get_users_list_keyboard(current_page: int, total_pages: int) -> InlineKeyboardMarkup:
-    """Клавиатура списка пользователей с пагинацией"""
+def get_users_list_keyboard(current_page: int, total_pages: int,
+                            first_user_id: int = None, last_user_id: int = None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура списка пользователей с пагинацией.
+    Курсор в callback_data: «назад» - первый user_id страницы, «вперёд» - последний.
+    """
     buttons = []
 
     # Кнопки пагинации
     nav_buttons = []
-    if current_page > 1:
+    if current_page > 1 and first_user_id is not None:
         nav_buttons.append(
-            InlineKeyboardButton(text="⬅️", callback_data=f"admin_users_page_{current_page - 1}")
+            InlineKeyboardButton(text="⬅️", callback_data=f"admin_users_page_{current_page - 1}_p_{first_user_id}")
         )
 
     nav_buttons.append(
         InlineKeyboardButton(text=f"{current_page}/{total_pages}", callback_data="noop")
     )
 
-    if current_page < total_pages:
+    if current_page < total_pages and last_user_id is not None:
         nav_buttons.append(
-            InlineKeyboardButton(text="➡️", callback_data=f"admin_users_page_{current_page + 1}")
+            InlineKeyboardButton(text="➡️", callback_data=f"admin_users_page_{current_page + 1}_n_{last_user_id}")
         )
 
     buttons.append(nav_buttons)
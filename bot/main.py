@@ -1,3 +1,13 @@
+# --- ОБНОВЛЕНО: 2026-10-18 - Callback Kie.ai не запускается без KIE_CALLBACK_SECRET (ошибка в лог, только polling) ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Однократный перевод БД на auto_vacuum=INCREMENTAL при старте (DB_ENABLE_INCREMENTAL_VACUUM) ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Предобработка входных фото Kie.ai: включение вместе с веб-сервером callback, остановка пула процессов ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Задания генерации: продолжение незавершённых при старте, отмена фоновых при остановке ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Остановка общего трекера задач Kie.ai при выключении ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Веб-сервер для callback Kie.ai (завершение задач без частого polling) ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Общий HTTP клиент (Kie.ai, Telegram getFile): создание при старте, закрытие при остановке ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Фоновая задача хранения user_activity (архив + incremental VACUUM) ---
+# --- ОБНОВЛЕНО: 2026-10-18 - При остановке дописываем write-behind буфер БД до закрытия пула ---
+# --- ОБНОВЛЕНО: 2026-10-18 - Общий объект db из database.db (пул writer/readers), закрытие пула при остановке ---
 # --- ОБНОВЛЕНО: 2025-12-29 - Рефакторинг creation.py на 4 модуля ---
 # --- ОБНОВЛЕНО: 2025-12-24 14:15 - Добавлена регистрация pro_mode router ---
 # --- ОБНОВЛЕНО: 2025-12-10 12:03 - Добавлен веб-сервер для вебхуков YooKassa ---
@@ -19,10 +29,18 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.types import BotCommand
-#from aiohttp import web
+from aiohttp import web
 from config import ADMIN_IDS
 from config import config
-from database.db import Database
+from config_kie import config_kie
+from database.db import db
+from database.retention import activity_retention
+from services.http_client import init_http_client, close_http_client
+from services.kie_callbacks import kie_callbacks
+from services.kie_task_tracker import kie_task_tracker
+from services.generation_jobs import generation_jobs
+from services.image_preprocess import image_preprocessor
+from handlers.kie_webhook import setup_kie_callback_routes
 from handlers import user_start, payment, referral, admin
 from handlers import (
     router_main,
@@ -43,9 +61,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализируем базу данных
-db = Database(db_path=config.DB_PATH)
-
 # Initialize bot
 bot = Bot(
     token=config.BOT_TOKEN,
@@ -59,6 +74,16 @@ async def main():
     await db.init_db()
     logger.info("База данных инициализирована")
 
+    # Полный VACUUM держит writer - только явно и до начала polling
+    if config.DB_ENABLE_INCREMENTAL_VACUUM:
+        await activity_retention.enable_incremental_vacuum()
+
+    # Фоновая архивация старой активности (user_activity)
+    activity_retention.start()
+
+    # Общий HTTP клиент с keep-alive для Kie.ai и Telegram getFile
+    await init_http_client()
+
     # [2026-01-01 22:24] Устанавливаем команду /start в меню бота
     await bot.set_my_commands([
         BotCommand(command="start", description="🔄 Перезагрузка")
@@ -108,6 +133,33 @@ async def main():
     #await site.start()
     #logger.info("Веб-сервер для вебхуков запускен на порту 8080")
 
+    # Веб-сервер для callback Kie.ai (только если задан KIE_CALLBACK_BASE_URL)
+    runner = None
+    if kie_callbacks.callback_url:
+        try:
+            app = web.Application()
+            setup_kie_callback_routes(app)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+            await site.start()
+            kie_callbacks.enabled = True
+            # Тот же сервер раздаёт Kie.ai уменьшенные фото пользователей
+            image_preprocessor.start()
+            logger.info(f"Веб-сервер для callback Kie.ai запущен на порту {config.WEBHOOK_PORT}")
+        except Exception as e:
+            # Без сервера callback не придёт - работаем только через polling
+            logger.error(f"❌ Не удалось запустить веб-сервер callback Kie.ai: {e}")
+            if runner is not None:
+                await runner.cleanup()
+            runner = None
+    elif config_kie.KIE_CALLBACK_BASE_URL:
+        logger.error("❌ KIE_CALLBACK_BASE_URL задан без KIE_CALLBACK_SECRET - callback Kie.ai выключен, только polling")
+
+    # Генерации, прерванные прошлой остановкой бота: дождаться/доставить или вернуть баланс
+    # (после запуска callback-сервера - чтобы задачи Kie.ai могли завершиться через callback)
+    await generation_jobs.resume(bot)
+
     logger.info("Бот запускен")
 
     try:
@@ -118,7 +170,20 @@ async def main():
         # Start polling
         await dp.start_polling(bot)
     finally:
+        # Фоновые генерации отменяем первыми: задания остаются в БД и продолжатся при старте
+        await generation_jobs.stop()
         await bot.session.close()
+        kie_callbacks.enabled = False
+        image_preprocessor.stop()
+        if runner is not None:
+            await runner.cleanup()
+        # Таймер опроса Kie.ai останавливаем до закрытия HTTP клиента
+        await kie_task_tracker.stop()
+        await close_http_client()
+        await activity_retention.stop()
+        # Дописываем отложенные записи (активность, генерации, меню) и закрываем пул
+        await db.write_buffer.close()
+        await db.close_pool()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,11 @@
 # ========================================
 # ФАЙЛ: bot/services/api_fallback.py
 # НАЗНАЧЕНИЕ: Smart Fallback система для генерации дизайна
+# ВЕРСИЯ: 2.6.1 (2026-10-18) - FIX: Проверка Replicate без расхода пробного вызова breaker, проигравший hedge - медленный вызов
+# ВЕРСИЯ: 2.6 (2026-10-18) - PERF: Кэш результатов по хэшу запроса, одинаковые одновременные запросы - один вызов провайдера
+# ВЕРСИЯ: 2.5 (2026-10-18) - PERF: Circuit breaker по провайдерам (KIE лежит → сразу Replicate, пробный вызов возвращает KIE)
+# ВЕРСИЯ: 2.4 (2026-10-18) - PERF: Hedging в smart_generate_interior (Replicate параллельно KIE после p90)
+# ВЕРСИЯ: 2.3 (2026-10-18) - PERF: Планировщик генераций (общий лимит, лимит на пользователя, честная очередь)
 # ВЕРСИЯ: 2.2 (2025-12-24 20:30) - ИСПРАВЛЕНА ПЕРЕДАЧА PRO MODE
 # АВТОР: Project Owner
 # ========================================
@@ -13,16 +18,26 @@
 # [2025-12-23 23:02] ДОБАВЛЕНО: Новая функция generate_interior_with_text для KIE, поддерживает текстовые промпты
 # [2025-12-23 23:02] УЛУЧШЕНО: Логирование для отслеживания какой API на самом деле запускается
 # [2025-12-24 20:30] ИСПРАВЛЕНО: Все функции теперь передают use_pro параметр в KIE.AI
+# [2026-10-18] Все smart_* выполняются через generation_scheduler (@scheduled): дополнительные
+#              параметры user_id и on_queue_position (позиция в очереди для сообщения прогресса)
+# [2026-10-18] Вызовы провайдеров идут через circuit breaker (services/circuit_breaker.py): при открытом
+#              breaker KIE попытка 1 пропускается без ожидания тайм-аута; Replicate пропускается, только
+#              если KIE уже пробовали. Состояние breaker - в get_fallback_status()["circuit_breakers"]
+# [2026-10-18] Все smart_* обёрнуты @cached_generation (services/generation_cache.py): повтор того же
+#              запроса (file_unique_id фото + промпт + параметры модели) за GENERATION_CACHE_TTL сек
+#              получает готовый URL сразу, одновременные одинаковые запросы ждут один вызов провайдера
 #
 # ИСПОЛЬЗОВАНИЕ:
 # from services.api_fallback import smart_generate_interior, smart_generate_with_text, smart_clear_space
 # url = await smart_generate_interior(photo_id, room, style, bot_token, use_pro=pro_mode)
 # url = await smart_generate_with_text(photo_id, user_prompt, bot_token, scene_type, use_pro=pro_mode)
+# url = await smart_generate_interior(..., user_id=user_id, on_queue_position=callback)
 # ========================================
 
 import os
+import asyncio
 import logging
-from typing import Optional
+from typing import Optional, Callable, Awaitable
 from config import config
 
 # Import обе системы генерации
@@ -36,6 +51,10 @@ from services.replicate_api import (
     generate_with_text_prompt,
     clear_space_image,
 )
+from services.generation_scheduler import scheduled, generation_scheduler
+from services.hedging import hedged_generator, HEDGE_LOSER
+from services.circuit_breaker import CircuitBreaker, kie_breaker, replicate_breaker
+from services.generation_cache import cached_generation, generation_cache
 
 logger = logging.getLogger(__name__)
 
@@ -57,10 +76,73 @@ logger.info(f"   KIE_API_KEY configured: {bool(KIE_API_KEY)}")
 logger.info("=" * 70)
 
 
+# ========================================
+# CIRCUIT BREAKER
+# ========================================
+
+async def _call_provider(
+    breaker: CircuitBreaker,
+    factory: Callable[[], Awaitable[Optional[str]]],
+    check: bool = False,
+    force: bool = False,
+) -> Optional[str]:
+    """
+    Вызвать провайдера и записать результат в его breaker.
+
+    None и исключение - неудача; отменённый проигравший hedge - медленный вызов;
+    другая отмена (остановка бота) не записывается.
+    check=True - сначала спросить breaker (allow_request - здесь, где запрос точно уходит).
+    force=True - вызвать, даже если breaker не пускает (последний шанс); такой вызов
+    не пробный и в breaker не записывается.
+    """
+    admitted = breaker.allow_request() if check else True
+    if not admitted and not force:
+        logger.info(f"⏭️  [{breaker.name}] SKIPPED - circuit {breaker.state}")
+        return None
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    try:
+        result_url = await factory()
+    except asyncio.CancelledError as e:
+        if admitted:
+            if e.args and e.args[0] == HEDGE_LOSER:
+                breaker.record_slow(loop.time() - started_at)
+            else:
+                breaker.release_probe()
+        raise
+    except Exception:
+        if admitted:
+            breaker.record(False, loop.time() - started_at)
+        raise
+    if admitted:
+        breaker.record(bool(result_url), loop.time() - started_at)
+    return result_url
+
+
+def _replicate_allowed(kie_tried: bool) -> bool:
+    """
+    Replicate пропускаем по breaker, только если KIE уже пробовали - иначе это последний шанс.
+
+    Только проверка (would_allow): пробный вызов расходует _call_provider(check=True).
+    """
+    if not kie_tried or replicate_breaker.would_allow():
+        return True
+    logger.warning(f"⏭️  [ATTEMPT 2] SKIPPED - Replicate circuit {replicate_breaker.state}")
+    return False
+
+
+def _kie_skip_reason() -> str:
+    if not (USE_KIE_API and KIE_API_KEY):
+        return "KIE.AI not configured"
+    return f"KIE.AI circuit {kie_breaker.state} (score {kie_breaker.score()})"
+
+
 # ========================================
 # ОСНОВНАЯ ЛОГИКА: ГЕНЕРАЦИЯ ДИЗАЙНА
 # ========================================
 
+@cached_generation
+@scheduled
 async def smart_generate_interior(
     photo_file_id: str,
     room: str,
@@ -98,30 +180,47 @@ async def smart_generate_interior(
     logger.info("=" * 70)
 
     result_url = None
+    kie_tried = False
 
     # ========================================
     # ПОПЫТКА 1: KIE.AI NANO BANANA (ОСНОВНОЙ)
     # ========================================
-    if USE_KIE_API and KIE_API_KEY:
+    if USE_KIE_API and KIE_API_KEY and kie_breaker.allow_request():
+        kie_tried = True
         logger.info("")
         logger.info("🔄 [ATTEMPT 1/2] KIE.AI NANO BANANA (Gemini 2.5 Flash) - PRIMARY")
         logger.info("-" * 70)
 
         try:
             logger.info("⏳ Запуск KIE.AI NANO BANANA...")
-            result_url = await generate_interior_with_nano_banana(
-                photo_file_id=photo_file_id,
-                room=room,
-                style=style,
-                bot_token=bot_token,
-                use_pro=use_pro,  # ✅ [2025-12-24] ПЕРЕДАЕМ PRO MODE
+            # [2026-10-18] Через hedged_generator: при включенном hedging, если KIE дольше своего p90,
+            # параллельно запускается Replicate и берётся первый результат
+            result_url, hedged = await hedged_generator.run(
+                f"interior:{'pro' if use_pro else 'base'}",
+                primary=lambda: _call_provider(kie_breaker, lambda: generate_interior_with_nano_banana(
+                    photo_file_id=photo_file_id,
+                    room=room,
+                    style=style,
+                    bot_token=bot_token,
+                    use_pro=use_pro,  # ✅ [2025-12-24] ПЕРЕДАЕМ PRO MODE
+                )),
+                hedge=lambda: _call_provider(replicate_breaker, lambda: generate_image_auto(
+                    photo_file_id=photo_file_id,
+                    room=room,
+                    style=style,
+                    bot_token=bot_token,
+                ), check=True),
             )
 
             if result_url:
-                logger.info("✅ [ATTEMPT 1] SUCCESS - KIE.AI NANO BANANA")
+                logger.info("✅ [ATTEMPT 1] SUCCESS - KIE.AI NANO BANANA" + (" / Replicate (hedge)" if hedged else ""))
                 logger.info(f"   Result: {result_url[:80]}...")
                 logger.info("=" * 70)
                 return result_url
+            elif hedged:
+                # Replicate уже пробовали параллельно - повторять не нужно
+                logger.error("❌ [ATTEMPT 1] FAILED - Нет результата ни от KIE.AI, ни от Replicate (hedge)")
+                return None
             else:
                 logger.warning("⚠️ [ATTEMPT 1] FAILED - No result from KIE.AI NANO BANANA")
 
@@ -130,35 +229,36 @@ async def smart_generate_interior(
             logger.error(f"   Exception: {str(e)[:200]}")
 
     else:
-        logger.warning("⏭️  [ATTEMPT 1] SKIPPED - KIE.AI not configured (USE_KIE_API=False or KIE_API_KEY missing)")
+        logger.warning(f"⏭️  [ATTEMPT 1] SKIPPED - {_kie_skip_reason()}")
 
     # ========================================
     # ПОПЫТКА 2: Replicate nano-banana (РЕЗЕРВНЫЙ)
     # ========================================
-    logger.info("")
-    logger.info("🔄 [ATTEMPT 2/2] Replicate nano-banana (FALLBACK)")
-    logger.info("-" * 70)
+    if _replicate_allowed(kie_tried):
+        logger.info("")
+        logger.info("🔄 [ATTEMPT 2/2] Replicate nano-banana (FALLBACK)")
+        logger.info("-" * 70)
 
-    try:
-        logger.info("⏳ Запуск Replicate nano-banana...")
-        result_url = await generate_image_auto(
-            photo_file_id=photo_file_id,
-            room=room,
-            style=style,
-            bot_token=bot_token,
-        )
-
-        if result_url:
-            logger.info("✅ [ATTEMPT 2] SUCCESS - Replicate nano-banana")
-            logger.info(f"   Result: {result_url[:80]}...")
-            logger.info("=" * 70)
-            return result_url
-        else:
-            logger.error("❌ [ATTEMPT 2] FAILED - No result from Replicate")
-
-    except Exception as e:
-        logger.error("❌ [ATTEMPT 2] ERROR - Replicate nano-banana")
-        logger.error(f"   Exception: {str(e)[:200]}")
+        try:
+            logger.info("⏳ Запуск Replicate nano-banana...")
+            result_url = await _call_provider(replicate_breaker, lambda: generate_image_auto(
+                photo_file_id=photo_file_id,
+                room=room,
+                style=style,
+                bot_token=bot_token,
+            ), check=True, force=not kie_tried)
+
+            if result_url:
+                logger.info("✅ [ATTEMPT 2] SUCCESS - Replicate nano-banana")
+                logger.info(f"   Result: {result_url[:80]}...")
+                logger.info("=" * 70)
+                return result_url
+            else:
+                logger.error("❌ [ATTEMPT 2] FAILED - No result from Replicate")
+
+        except Exception as e:
+            logger.error("❌ [ATTEMPT 2] ERROR - Replicate nano-banana")
+            logger.error(f"   Exception: {str(e)[:200]}")
 
     # ========================================
     # ПОЛНАЯ ОШИБКА
@@ -176,6 +276,8 @@ async def smart_generate_interior(
 # ЛОГИКА: ГЕНЕРАЦИЯ С ТЕКСТОВЫМ ПРОМПТОМ
 # ========================================
 
+@cached_generation
+@scheduled
 async def smart_generate_with_text(
     photo_file_id: str,
     user_prompt: str,
@@ -215,11 +317,13 @@ async def smart_generate_with_text(
     logger.info("=" * 70)
 
     result_url = None
+    kie_tried = False
 
     # ========================================
     # ПОПЫТКА 1: KIE.AI NANO BANANA (ОСНОВНОЙ) - ИСПРАВЛЕНО!
     # ========================================
-    if USE_KIE_API and KIE_API_KEY:
+    if USE_KIE_API and KIE_API_KEY and kie_breaker.allow_request():
+        kie_tried = True
         logger.info("")
         logger.info("🔄 [ATTEMPT 1/2] KIE.AI NANO BANANA (Gemini 2.5 Flash) - PRIMARY")
         logger.info("-" * 70)
@@ -228,13 +332,13 @@ async def smart_generate_with_text(
             logger.info("⏳ Запуск KIE.AI NANO BANANA с текстовым промптом...")
             # ✅ FIX 2025-12-23: Используем generate_interior_with_text_nano_banana для текстовых промптов
             # Эта функция правильно передает user_prompt в KIE.AI
-            result_url = await generate_interior_with_text_nano_banana(
+            result_url = await _call_provider(kie_breaker, lambda: generate_interior_with_text_nano_banana(
                 photo_file_id=photo_file_id,
                 user_prompt=user_prompt,  # ✅ ТЕПЕРЬ ПРАВИЛЬНО ПЕРЕДАЕТСЯ!
                 bot_token=bot_token,
                 scene_type=scene_type,
                 use_pro=use_pro,  # ✅ [2025-12-24] ПЕРЕДАЕМ PRO MODE
-            )
+            ))
 
             if result_url:
                 logger.info("✅ [ATTEMPT 1] SUCCESS - KIE.AI NANO BANANA")
@@ -249,35 +353,36 @@ async def smart_generate_with_text(
             logger.error(f"   Exception: {str(e)[:200]}")
 
     else:
-        logger.warning("⏭️  [ATTEMPT 1] SKIPPED - KIE.AI not configured")
+        logger.warning(f"⏭️  [ATTEMPT 1] SKIPPED - {_kie_skip_reason()}")
 
     # ========================================
     # ПОПЫТКА 2: Replicate nano-banana (РЕЗЕРВНЫЙ)
     # ========================================
-    logger.info("")
-    logger.info("🔄 [ATTEMPT 2/2] Replicate nano-banana (FALLBACK)")
-    logger.info("-" * 70)
+    if _replicate_allowed(kie_tried):
+        logger.info("")
+        logger.info("🔄 [ATTEMPT 2/2] Replicate nano-banana (FALLBACK)")
+        logger.info("-" * 70)
 
-    try:
-        logger.info("⏳ Запуск Replicate generate_with_text_prompt...")
-        result_url = await generate_with_text_prompt(
-            photo_file_id=photo_file_id,
-            user_prompt=user_prompt,
-            bot_token=bot_token,
-            scene_type=scene_type,
-        )
-
-        if result_url:
-            logger.info("✅ [ATTEMPT 2] SUCCESS - Replicate nano-banana")
-            logger.info(f"   Result: {result_url[:80]}...")
-            logger.info("=" * 70)
-            return result_url
-        else:
-            logger.error("❌ [ATTEMPT 2] FAILED - No result from Replicate")
-
-    except Exception as e:
-        logger.error("❌ [ATTEMPT 2] ERROR - Replicate nano-banana")
-        logger.error(f"   Exception: {str(e)[:200]}")
+        try:
+            logger.info("⏳ Запуск Replicate generate_with_text_prompt...")
+            result_url = await _call_provider(replicate_breaker, lambda: generate_with_text_prompt(
+                photo_file_id=photo_file_id,
+                user_prompt=user_prompt,
+                bot_token=bot_token,
+                scene_type=scene_type,
+            ), check=True, force=not kie_tried)
+
+            if result_url:
+                logger.info("✅ [ATTEMPT 2] SUCCESS - Replicate nano-banana")
+                logger.info(f"   Result: {result_url[:80]}...")
+                logger.info("=" * 70)
+                return result_url
+            else:
+                logger.error("❌ [ATTEMPT 2] FAILED - No result from Replicate")
+
+        except Exception as e:
+            logger.error("❌ [ATTEMPT 2] ERROR - Replicate nano-banana")
+            logger.error(f"   Exception: {str(e)[:200]}")
 
     # ========================================
     # ПОЛНАЯ ОШИБКА
@@ -295,6 +400,8 @@ async def smart_generate_with_text(
 # ЛОГИКА: ОЧИСТКА ПРОСТРАНСТВА
 # ========================================
 
+@cached_generation
+@scheduled
 async def smart_clear_space(
     photo_file_id: str,
     bot_token: str,
@@ -321,22 +428,24 @@ async def smart_clear_space(
     logger.info("=" * 70)
 
     result_url = None
+    kie_tried = False
 
     # ========================================
     # ПОПЫТКА 1: KIE.AI NANO BANANA (ОСНОВНОЙ)
     # ========================================
-    if USE_KIE_API and KIE_API_KEY:
+    if USE_KIE_API and KIE_API_KEY and kie_breaker.allow_request():
+        kie_tried = True
         logger.info("")
         logger.info("🔄 [ATTEMPT 1/2] KIE.AI NANO BANANA (Gemini 2.5 Flash) - PRIMARY")
         logger.info("-" * 70)
 
         try:
             logger.info("⏳ Запуск KIE.AI NANO BANANA для очистки...")
-            result_url = await clear_space_with_kie(
+            result_url = await _call_provider(kie_breaker, lambda: clear_space_with_kie(
                 photo_file_id=photo_file_id,
                 bot_token=bot_token,
                 use_pro=use_pro,  # ✅ [2025-12-24] ПЕРЕДАЕМ PRO MODE
-            )
+            ))
 
             if result_url:
                 logger.info("✅ [ATTEMPT 1] SUCCESS - KIE.AI NANO BANANA")
@@ -351,33 +460,34 @@ async def smart_clear_space(
             logger.error(f"   Exception: {str(e)[:200]}")
 
     else:
-        logger.warning("⏭️  [ATTEMPT 1] SKIPPED - KIE.AI not configured")
+        logger.warning(f"⏭️  [ATTEMPT 1] SKIPPED - {_kie_skip_reason()}")
 
     # ========================================
     # ПОПЫТКА 2: Replicate nano-banana (РЕЗЕРВНЫЙ)
     # ========================================
-    logger.info("")
-    logger.info("🔄 [ATTEMPT 2/2] Replicate nano-banana (FALLBACK)")
-    logger.info("-" * 70)
+    if _replicate_allowed(kie_tried):
+        logger.info("")
+        logger.info("🔄 [ATTEMPT 2/2] Replicate nano-banana (FALLBACK)")
+        logger.info("-" * 70)
 
-    try:
-        logger.info("⏳ Запуск Replicate clear_space_image...")
-        result_url = await clear_space_image(
-            photo_file_id=photo_file_id,
-            bot_token=bot_token,
-        )
-
-        if result_url:
-            logger.info("✅ [ATTEMPT 2] SUCCESS - Replicate nano-banana")
-            logger.info(f"   Result: {result_url[:80]}...")
-            logger.info("=" * 70)
-            return result_url
-        else:
-            logger.error("❌ [ATTEMPT 2] FAILED - No result from Replicate")
-
-    except Exception as e:
-        logger.error("❌ [ATTEMPT 2] ERROR - Replicate nano-banana")
-        logger.error(f"   Exception: {str(e)[:200]}")
+        try:
+            logger.info("⏳ Запуск Replicate clear_space_image...")
+            result_url = await _call_provider(replicate_breaker, lambda: clear_space_image(
+                photo_file_id=photo_file_id,
+                bot_token=bot_token,
+            ), check=True, force=not kie_tried)
+
+            if result_url:
+                logger.info("✅ [ATTEMPT 2] SUCCESS - Replicate nano-banana")
+                logger.info(f"   Result: {result_url[:80]}...")
+                logger.info("=" * 70)
+                return result_url
+            else:
+                logger.error("❌ [ATTEMPT 2] FAILED - No result from Replicate")
+
+        except Exception as e:
+            logger.error("❌ [ATTEMPT 2] ERROR - Replicate nano-banana")
+            logger.error(f"   Exception: {str(e)[:200]}")
 
     # ========================================
     # ПОЛНАЯ ОШИБКА
@@ -408,14 +518,19 @@ async def get_fallback_status() -> dict:
         "kie_api_key_configured": bool(KIE_API_KEY),
         "replicate_available": bool(os.getenv('REPLICATE_API_TOKEN')),
         "fallback_chain": "KIE.AI NANO BANANA → Replicate nano-banana",
-        "status": "READY" if (USE_KIE_API and KIE_API_KEY) else "REPLICATE ONLY"
+        "status": "READY" if (USE_KIE_API and KIE_API_KEY and kie_breaker.state != 'open') else "REPLICATE ONLY",
+        "scheduler": generation_scheduler.get_stats(),
+        "hedging": {"enabled": await hedged_generator.is_enabled(), **hedged_generator.get_stats()},
+        "circuit_breakers": {
+            "kie": kie_breaker.get_state(),
+            "replicate": replicate_breaker.get_state(),
+        },
+        "generation_cache": generation_cache.get_stats(),
     }
 
 
 if __name__ == "__main__":
     # Для тестирования статуса
-    import asyncio
-
     async def test():
         status = await get_fallback_status()
         logger.info(f"Fallback Status: {status}")
@@ -0,0 +1,170 @@
+# bot/services/circuit_breaker.py
+# --- СОЗДАН: 2026-10-18 - Circuit breaker и оценка здоровья провайдеров генерации (KIE, Replicate) ---
+# --- ОБНОВЛЕН: 2026-10-18 - would_allow() без расхода пробного вызова, record_slow() для отменённого проигравшего hedge ---
+
+"""
+Circuit breaker для провайдеров в api_fallback.
+
+Когда KIE лежит, каждый smart_generate_* всё равно сначала шёл в KIE и ждал
+его тайм-аут (300-600 сек), и только потом - в Replicate. Теперь у каждого
+провайдера есть breaker со скользящим окном последних window вызовов:
+- closed    - вызовы идут; если доля ошибок >= failure_rate или доля медленных
+              (дольше slow_call_seconds) >= slow_call_rate - breaker открывается
+- open      - провайдер пропускается сразу, без ожидания тайм-аута
+- half_open - через open_seconds пропускается один пробный вызов:
+              успех → closed (окно очищается), ошибка → снова open
+
+score (0..1) - доля успешных вызовов с поправкой на медленные, для статуса.
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Optional, Dict, Any, Deque, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """🔌 Breaker одного провайдера: окно (успех, длительность) → closed / open / half_open"""
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 120.0, slow_call_rate: float = 0.8, open_seconds: float = 60.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._calls: Deque[Tuple[bool, float]] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    # ===== ДОПУСК ВЫЗОВА =====
+
+    def allow_request(self) -> bool:
+        """Можно ли сейчас вызвать провайдера (в half_open - только один пробный вызов)"""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+            logger.info(f"🔌 [BREAKER {self.name}] half_open - пробный вызов")
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.stats['rejected'] += 1
+        return False
+
+    def would_allow(self) -> bool:
+        """То же, что allow_request, но без изменения состояния (пробный вызов не расходуется)"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.open_seconds
+        return not self._probe_in_flight
+
+    def release_probe(self) -> None:
+        """Пробный вызов отменён без результата - разрешить следующий"""
+        self._probe_in_flight = False
+
+    # ===== РЕЗУЛЬТАТ ВЫЗОВА =====
+
+    def record(self, success: bool, duration: float) -> None:
+        self.stats['calls'] += 1
+        if not success:
+            self.stats['failures'] += 1
+
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            if success:
+                self.state = CLOSED
+                self._calls.clear()
+                logger.info(f"✅ [BREAKER {self.name}] closed - провайдер снова доступен")
+            else:
+                self._open('пробный вызов неудачен')
+            return
+
+        self._calls.append((success, duration))
+        if self.state == CLOSED and len(self._calls) >= self.min_calls:
+            error_rate, slow_rate = self._rates()
+            if error_rate >= self.failure_rate:
+                self._open(f"ошибок {error_rate:.0%}")
+            elif slow_rate >= self.slow_call_rate:
+                self._open(f"медленных {slow_rate:.0%}")
+
+    def record_slow(self, duration: float) -> None:
+        """Вызов отменён, потому что другой провайдер ответил раньше (проигравший hedge) - считаем медленным"""
+        if self.state == HALF_OPEN:
+            # Пробный вызов не дал ответа - ни закрывать, ни открывать breaker
+            self.release_probe()
+            return
+        self.record(True, max(duration, self.slow_call_seconds))
+
+    def _open(self, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.stats['opened'] += 1
+        logger.warning(f"🔌 [BREAKER {self.name}] open на {self.open_seconds:.0f}s: {reason}")
+
+    def _rates(self) -> Tuple[float, float]:
+        if not self._calls:
+            return 0.0, 0.0
+        total = len(self._calls)
+        failures = sum(1 for success, _ in self._calls if not success)
+        slow = sum(1 for _, duration in self._calls if duration >= self.slow_call_seconds)
+        return failures / total, slow / total
+
+    # ===== СТАТУС =====
+
+    def score(self) -> float:
+        """Здоровье 0..1: успешные вызовы, медленные считаются за половину"""
+        if not self._calls:
+            return 1.0
+        points = sum(
+            (0.5 if duration >= self.slow_call_seconds else 1.0)
+            for success, duration in self._calls if success
+        )
+        return round(points / len(self._calls), 2)
+
+    def get_state(self) -> Dict[str, Any]:
+        error_rate, slow_rate = self._rates()
+        durations = sorted(duration for _, duration in self._calls)
+        retry_in: Optional[float] = None
+        if self.state == OPEN:
+            retry_in = round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+        return {
+            'state': self.state,
+            'score': self.score(),
+            'window_calls': len(self._calls),
+            'error_rate': round(error_rate, 2),
+            'slow_rate': round(slow_rate, 2),
+            'p50_seconds': round(durations[len(durations) // 2], 1) if durations else None,
+            'retry_in_seconds': retry_in,
+            **self.stats,
+        }
+
+
+def _build_breaker(name: str, slow_call_seconds: float) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        window=config.CIRCUIT_WINDOW,
+        min_calls=config.CIRCUIT_MIN_CALLS,
+        failure_rate=config.CIRCUIT_FAILURE_RATE,
+        slow_call_seconds=slow_call_seconds,
+        slow_call_rate=config.CIRCUIT_SLOW_CALL_RATE,
+        open_seconds=config.CIRCUIT_OPEN_SECONDS,
+    )
+
+
+kie_breaker = _build_breaker('kie', config.CIRCUIT_KIE_SLOW_CALL_SECONDS)
+replicate_breaker = _build_breaker('replicate', config.CIRCUIT_REPLICATE_SLOW_CALL_SECONDS)
@@ -0,0 +1,123 @@
+# bot/services/download_benchmark.py
+# --- СОЗДАН: 2026-10-18 - Замер пикового RSS при одновременной доставке результатов: resp.read() против download_to_file ---
+
+"""
+Бенчмарк памяти при одновременной доставке больших картинок.
+
+Поднимает локальный HTTP-сервер с картинкой size_mb МБ и в отдельном процессе
+для каждого режима скачивает её concurrency раз одновременно:
+- read   - как было: весь ответ в память (resp.read()), байты держатся до конца "отправки"
+- stream - download_to_file во временный файл, "отправка" читает файл кусками (как FSInputFile)
+
+Печатает пиковый RSS процесса (ru_maxrss) и прирост относительно старта.
+
+Запуск (из папки bot/):
+    python -m services.download_benchmark
+    python -m services.download_benchmark --size-mb 8 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+UPLOAD_CHUNK = 64 * 1024
+
+
+def _peak_rss_mb() -> float:
+    # Linux: ru_maxrss в КБ
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _serve(payload: bytes) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def _deliver_read(url: str, hold: float) -> int:
+    from services.http_client import get_http_client
+
+    response = await get_http_client().get(url)
+    data = response.content
+    await asyncio.sleep(hold)  # байты живут, пока идёт загрузка в Telegram
+    return len(data)
+
+
+async def _deliver_stream(url: str, hold: float, directory: str, max_bytes: int) -> int:
+    from config import config
+    from services.downloads import download_to_file
+
+    path = os.path.join(directory, f"{uuid.uuid4().hex}.img")
+    # Тот же тайм-аут, что у result_images
+    size = await download_to_file(url, path, max_bytes, timeout=config.RESULT_DOWNLOAD_TIMEOUT)
+    with open(path, 'rb') as f:
+        while f.read(UPLOAD_CHUNK):
+            await asyncio.sleep(hold / max(1, size // UPLOAD_CHUNK))
+    os.remove(path)
+    return size
+
+
+async def _worker(mode: str, url: str, concurrency: int, hold: float, max_bytes: int) -> None:
+    from services.http_client import close_http_client, get_http_client
+
+    get_http_client()
+    start_rss = _peak_rss_mb()
+    with tempfile.TemporaryDirectory() as directory:
+        if mode == 'read':
+            jobs = [_deliver_read(url, hold) for _ in range(concurrency)]
+        else:
+            jobs = [_deliver_stream(url, hold, directory, max_bytes) for _ in range(concurrency)]
+        sizes = await asyncio.gather(*jobs)
+    await close_http_client()
+    peak = _peak_rss_mb()
+    print(f"{mode:6} | доставок {len(sizes):3} | пиковый RSS {peak:7.1f} МБ | прирост {peak - start_rss:7.1f} МБ")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--hold', type=float, default=1.0, help='сколько секунд длится "отправка"')
+    parser.add_argument('--worker', choices=('read', 'stream'))
+    parser.add_argument('--url')
+    args = parser.parse_args()
+    max_bytes = int(args.size_mb * 1024 * 1024) + 1
+
+    if args.worker:
+        asyncio.run(_worker(args.worker, args.url, args.concurrency, args.hold, max_bytes))
+        return
+
+    server = _serve(os.urandom(int(args.size_mb * 1024 * 1024)))
+    url = f"http://127.0.0.1:{server.server_address[1]}/result.png"
+    print(f"Картинка {args.size_mb} МБ, одновременных доставок: {args.concurrency}")
+    try:
+        for mode in ('read', 'stream'):
+            subprocess.run(
+                [sys.executable, '-m', 'services.download_benchmark', '--worker', mode, '--url', url,
+                 '--size-mb', str(args.size_mb), '--concurrency', str(args.concurrency), '--hold', str(args.hold)],
+                check=True,
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# bot/services/downloads.py
+# --- СОЗДАН: 2026-10-18 - Потоковое скачивание картинок во временный файл с ограничением размера ---
+# --- ОБНОВЛЕН: 2026-10-18 - timeout по умолчанию - тайм-ауты общего клиента (None в httpx отключает их все) ---
+
+"""
+Скачивание файлов (результатов генерации) без загрузки целиком в память.
+
+Раньше запасная отправка результата делала `await resp.read()` - PNG 2K/4K от
+PRO-моделей (несколько МБ) целиком лежал в памяти на каждого одновременного
+пользователя, а потом ещё раз копировался в BufferedInputFile. Теперь:
+- ответ читается потоком (общий httpx клиент) и пишется во временный файл
+  рядом с целевым, после успешной загрузки файл атомарно переименовывается
+- размер ограничен max_bytes: по Content-Length сразу, по факту - во время
+  чтения (DownloadTooLarge, временный файл удаляется)
+- отправка в Telegram - через FSInputFile (aiogram читает файл кусками)
+
+Замер пикового RSS: python -m services.download_benchmark
+"""
+
+import logging
+import os
+import tempfile
+from typing import Any
+
+import httpx
+
+from services.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadTooLarge(ValueError):
+    """Файл больше допустимого размера"""
+
+
+async def download_to_file(url: str, path: str, max_bytes: int, timeout: Any = httpx.USE_CLIENT_DEFAULT) -> int:
+    """
+    Потоково скачать url в path (не больше max_bytes). Возвращает размер в байтах.
+
+    timeout - общий тайм-аут запроса, сек; по умолчанию - тайм-ауты общего клиента
+    (явный None в httpx отключает все тайм-ауты, включая connect и read).
+
+    Исключение: DownloadTooLarge, RuntimeError (HTTP-статус не 200) или ошибка httpx.
+    В path файл появляется только целиком.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, part_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            async with get_http_client().stream('GET', url, timeout=timeout) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code} при загрузке {url[:80]}")
+
+                declared = response.headers.get('content-length')
+                if declared and declared.isdigit() and int(declared) > max_bytes:
+                    raise DownloadTooLarge(f"Content-Length {int(declared)} > {max_bytes} байт")
+
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DownloadTooLarge(f"Больше {max_bytes} байт")
+                    f.write(chunk)
+        os.replace(part_path, path)
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+    return size
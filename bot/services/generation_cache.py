@@ -0,0 +1,231 @@
+# bot/services/generation_cache.py
+# --- СОЗДАН: 2026-10-18 - Кэш результатов генераций по хэшу (фото + промпт + параметры модели) и объединение одинаковых запросов ---
+# --- ОБНОВЛЕН: 2026-10-18 - SharedResult (обработчик возвращает списание), короткий TTL, позиция в очереди всем ожидающим, отмена без ожидающих ---
+
+"""
+Дедупликация одинаковых генераций.
+
+Пользователи часто повторяют ту же комбинацию (фото, комната, стиль, режим,
+разрешение): двойным нажатием кнопки или сразу после неудачной отправки
+результата. Каждый повтор шёл к провайдеру заново. Теперь smart_* в
+api_fallback обёрнуты @cached_generation:
+- ключ - sha256 от file_unique_id фото (одинаков для одного файла при разных
+  file_id; берётся из getFile, services/telegram_files.py), параметров промпта
+  (room, style, user_prompt, scene_type, use_pro) и параметров модели из config_kie
+- одновременные одинаковые запросы ждут один общий вызов провайдера; позиция
+  в очереди планировщика приходит в on_queue_position каждого ожидающего
+- готовый URL ещё ttl секунд (по умолчанию 20 - двойное нажатие, повтор после
+  ошибки отправки) отдаётся сразу, без очереди и провайдера. TTL короткий
+  намеренно: осознанный повтор того же стиля за новым вариантом идёт к провайдеру
+- неудачи (None, исключение) не кэшируются
+- если все ожидающие отменены (остановка бота), общий вызов тоже отменяется
+
+Результат из кэша или чужого вызова - SharedResult (подкласс str): провайдер
+за него уже заплачен, обработчик возвращает списание (is_shared_result).
+
+Декоратор ставится над @scheduled: попадание в кэш не занимает слот генерации.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, List, Callable, Awaitable
+
+from config import config
+from config_kie import config_kie
+from services.telegram_files import telegram_file_resolver
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class SharedResult(str):
+    """URL результата, полученный не своим вызовом провайдера (кэш или общий вызов)"""
+
+
+def is_shared_result(url: Optional[str]) -> bool:
+    """True - за этот результат уже заплатил другой запрос, списание нужно вернуть"""
+    return isinstance(url, SharedResult)
+
+
+def _model_params() -> Dict[str, Any]:
+    """Параметры модели, от которых зависит результат (кроме аргументов smart_*)"""
+    return {
+        'use_kie': config_kie.USE_KIE_API,
+        'format': config_kie.KIE_NANO_BANANA_FORMAT,
+        'size': config_kie.KIE_NANO_BANANA_SIZE,
+        'pro_aspect': config_kie.KIE_NANO_BANANA_PRO_ASPECT,
+        'pro_resolution': config_kie.KIE_NANO_BANANA_PRO_RESOLUTION,
+    }
+
+
+class _SharedCall:
+    """Один идущий вызов провайдера и все, кто его ждёт"""
+
+    def __init__(self):
+        self.future: Optional[asyncio.Future] = None
+        self.waiters = 0
+        self.callbacks: List[PositionCallback] = []
+        self.position: Optional[int] = None
+
+    async def notify(self, position: int) -> None:
+        """on_queue_position общего вызова: разослать позицию всем ожидающим"""
+        self.position = position
+        for callback in list(self.callbacks):
+            try:
+                await callback(position)
+            except Exception as e:
+                logger.debug(f"Не удалось сообщить позицию в очереди: {e}")
+
+
+class GenerationCache:
+    """🗂 Хэш запроса генерации → URL результата (TTL LRU + один вызов на ключ)"""
+
+    def __init__(self, ttl: float = 20.0, max_size: int = 500):
+        self.ttl = ttl
+        self.max_size = max_size
+        # ключ → (url, истекает в monotonic)
+        self._results: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._in_flight: Dict[str, _SharedCall] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'joined': 0, 'cancelled': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    @staticmethod
+    def make_key(operation: str, photo_unique_id: str, params: Dict[str, Any]) -> str:
+        payload = {'op': operation, 'photo': photo_unique_id, 'params': params, 'model': _model_params()}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        cached = self._results.get(key)
+        if cached is None:
+            return None
+        url, expires_at = cached
+        if time.monotonic() >= expires_at:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return url
+
+    def _store(self, key: str, url: str) -> None:
+        self._results[key] = (url, time.monotonic() + self.ttl)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    async def run(self, key: str, factory: Callable[[PositionCallback], Awaitable[Optional[str]]],
+                  on_queue_position: Optional[PositionCallback] = None) -> Optional[str]:
+        """
+        Результат по ключу: из кэша, из уже идущего вызова или новый вызов factory(notify).
+
+        Первые два случая возвращают SharedResult.
+        """
+        url = self.get(key)
+        if url is not None:
+            self.stats['hits'] += 1
+            logger.info(f"♻️ [GEN CACHE] Повторный запрос {key[:12]} - результат из кэша")
+            return SharedResult(url)
+
+        call = self._in_flight.get(key)
+        if call is not None and call.future.done():
+            # Отменённый вызов ещё не успел уйти из _in_flight
+            call = None
+        owner = call is None
+        if owner:
+            self.stats['misses'] += 1
+            call = _SharedCall()
+            call.future = asyncio.ensure_future(self._call(key, factory, call.notify))
+            self._in_flight[key] = call
+            call.future.add_done_callback(functools.partial(self._forget, key, call))
+        else:
+            self.stats['joined'] += 1
+            logger.info(f"🔗 [GEN CACHE] Запрос {key[:12]} уже выполняется - ждём его результат")
+
+        if on_queue_position is not None:
+            call.callbacks.append(on_queue_position)
+        call.waiters += 1
+        try:
+            if not owner and on_queue_position is not None and call.position is not None:
+                # Присоединившийся сразу видит текущую позицию общего вызова
+                try:
+                    await on_queue_position(call.position)
+                except Exception as e:
+                    logger.debug(f"Не удалось сообщить позицию в очереди: {e}")
+            # shield: отмена одного ожидающего не отменяет генерацию для остальных
+            url = await asyncio.shield(call.future)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.future.done():
+                # Последний ожидающий ушёл - генерация больше никому не нужна
+                self.stats['cancelled'] += 1
+                call.future.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+            if on_queue_position is not None:
+                call.callbacks.remove(on_queue_position)
+
+        if url and not owner:
+            return SharedResult(url)
+        return url
+
+    def _forget(self, key: str, call: _SharedCall, _future: asyncio.Future) -> None:
+        # Под ключом мог появиться новый вызов (старый отменён) - его не трогаем
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
+
+    async def _call(self, key: str, factory, notify: PositionCallback) -> Optional[str]:
+        url = await factory(notify)
+        if url:
+            self._store(key, url)
+        return url
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'enabled': self.enabled, 'cached': len(self._results),
+                'in_flight': len(self._in_flight), **self.stats}
+
+
+generation_cache = GenerationCache(
+    ttl=config.GENERATION_CACHE_TTL,
+    max_size=config.GENERATION_CACHE_SIZE,
+)
+
+
+def cached_generation(func):
+    """
+    Декоратор для smart_* (над @scheduled): одинаковые запросы - один вызов провайдера.
+
+    Ключ строится из аргументов функции: photo_file_id заменяется на file_unique_id,
+    bot_token в ключ не входит. В @scheduled передаётся user_id первого запроса
+    и общий on_queue_position (позиция приходит всем ожидающим).
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, user_id: Optional[int] = None,
+                      on_queue_position: Optional[PositionCallback] = None, **kwargs):
+        if not generation_cache.enabled:
+            return await func(*args, user_id=user_id, on_queue_position=on_queue_position, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        bot_token = params.pop('bot_token')
+        photo_file_id = params.pop('photo_file_id')
+
+        photo_unique_id = await telegram_file_resolver.get_file_unique_id(photo_file_id, bot_token)
+        key = generation_cache.make_key(func.__name__, photo_unique_id, params)
+        return await generation_cache.run(
+            key,
+            lambda notify: func(*args, user_id=user_id, on_queue_position=notify, **kwargs),
+            on_queue_position,
+        )
+
+    return wrapper
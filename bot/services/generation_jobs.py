@@ -0,0 +1,245 @@
+# bot/services/generation_jobs.py
+# --- СОЗДАН: 2026-10-18 - Задания генерации в БД: генерация переживает перезапуск бота ---
+# --- ОБНОВЛЕН: 2026-10-18 - Без списания - сообщение без «Баланс возвращен»; возврат при остановке, если задание не записалось ---
+
+"""
+Задания генерации (таблица generation_jobs).
+
+Раньше генерация жила только внутри обработчика (style_choice_handler,
+generate_try_on_handler): перезапуск бота посреди генерации терял результат,
+а генерация уже была списана. Теперь:
+- обработчик списывает баланс, создаёт задание (submit) и сразу завершается
+- генерация и доставка идут в фоновой задаче; task_id Kie.ai сохраняется
+  в задание (attach_task из kie_api) как только задача создана
+- при старте бота (resume) незавершённые задания дожидаются своей задачи
+  Kie.ai через kie_task_tracker и доставляются, а если продолжить нельзя -
+  возвращают cost (refund_generation_job: баланс + статус одной транзакцией)
+
+При остановке бота (stop) фоновые задачи отменяются, задания остаются
+running/generated и продолжаются при следующем старте. Доставка «как минимум
+один раз»: если бот остановился между отправкой фото и записью delivered,
+фото придёт повторно.
+"""
+
+import asyncio
+import functools
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable, Awaitable, Set
+
+from config import config
+from database.db import db, GenerationReservation
+from services.kie_task_tracker import kie_task_tracker
+from services.result_images import result_images
+
+logger = logging.getLogger(__name__)
+
+# id задания, в рамках которого сейчас идёт генерация (наследуется фоновой задачей)
+_current_job_id: ContextVar[Optional[int]] = ContextVar('generation_job_id', default=None)
+
+RESUMED_CAPTION = "✨ <b>Ваш дизайн готов!</b>\n\nГенерация завершилась, пока бот перезапускался."
+RESUMED_MENU_TEXT = "Чтобы продолжить, нажмите /start"
+RESUMED_REFUND_TEXT = "❌ Генерация прервана перезапуском бота. Баланс возвращен. Попробуйте ещё раз."
+# Ничего не списывалось (try_on, администраторы) - о возврате не пишем
+RESUMED_FAILED_TEXT = "❌ Генерация прервана перезапуском бота. Попробуйте ещё раз."
+
+
+class GenerationJobManager:
+    """🧾 Фоновые генерации с записью в generation_jobs и продолжением после перезапуска"""
+
+    def __init__(self, max_age_minutes: int = 60, keep_days: int = 7):
+        self.max_age_minutes = max_age_minutes
+        self.keep_days = keep_days
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {'submitted': 0, 'delivered': 0, 'refunded': 0, 'failed': 0, 'resumed': 0}
+
+    # ===== НОВОЕ ЗАДАНИЕ =====
+
+    async def submit(
+        self,
+        user_id: int,
+        chat_id: int,
+        mode: str,
+        generate: Callable[[], Awaitable[Optional[str]]],
+        deliver: Callable[[Optional[str]], Awaitable[bool]],
+        reservation: Optional[GenerationReservation] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        """
+        ▶️ Создать задание и запустить генерацию в фоне.
+
+        generate() → URL результата или None.
+        deliver(url) → True, если результат доставлен пользователю (url=None - сообщить об ошибке).
+        После deliver резерв подтверждается (commit) или возвращается (refund).
+
+        Возвращает id задания (None - задание не записалось в БД, генерация
+        всё равно идёт, но перезапуск её не переживёт).
+        """
+        cost = reservation.cost if reservation else 0
+        job_id = await db.create_generation_job(user_id, chat_id, mode, params, cost)
+        if job_id is not None and reservation is not None:
+            reservation.job_id = job_id
+        self.stats['submitted'] += 1
+        logger.info(f"🧾 Задание #{job_id}: user_id={user_id}, mode={mode}, cost={cost}")
+
+        self._spawn(self._run(job_id, generate, deliver, reservation))
+        return job_id
+
+    async def attach_task(self, provider: str, task_id: str, model_key: Optional[str] = None) -> None:
+        """Сохранить задачу провайдера в текущее задание (вызывается из kie_api после createTask)"""
+        job_id = _current_job_id.get()
+        if job_id is not None:
+            await db.set_generation_job_task(job_id, provider, task_id, model_key)
+
+    async def _run(self, job_id: Optional[int], generate, deliver, reservation) -> None:
+        _current_job_id.set(job_id)
+        try:
+            await self._generate_and_deliver(job_id, generate, deliver, reservation)
+        except asyncio.CancelledError:
+            if job_id is None and reservation is not None:
+                # Задание не записалось в БД - после перезапуска вернуть баланс будет некому
+                await asyncio.shield(reservation.refund())
+            raise
+
+    async def _generate_and_deliver(self, job_id: Optional[int], generate, deliver, reservation) -> None:
+        try:
+            result_url = await generate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Задание #{job_id}: ошибка генерации: {e}", exc_info=True)
+            result_url = None
+
+        if result_url and job_id is not None:
+            await db.set_generation_job_result(job_id, result_url)
+
+        try:
+            delivered = await deliver(result_url)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Задание #{job_id}: ошибка доставки: {e}", exc_info=True)
+            delivered = False
+
+        await self._finish(job_id, delivered, reservation)
+
+    async def _finish(self, job_id: Optional[int], delivered: bool,
+                      reservation: Optional[GenerationReservation]) -> None:
+        if delivered:
+            if reservation:
+                reservation.commit()
+            if job_id is not None:
+                await db.finish_generation_job(job_id, 'delivered')
+            self.stats['delivered'] += 1
+        elif reservation:
+            # Повторный refund безопасен: обработчик мог уже вернуть баланс сам
+            await reservation.refund()
+            self.stats['refunded'] += 1
+        else:
+            if job_id is not None:
+                await db.finish_generation_job(job_id, 'failed')
+            self.stats['failed'] += 1
+
+    # ===== ПРОДОЛЖЕНИЕ ПОСЛЕ ПЕРЕЗАПУСКА =====
+
+    async def resume(self, bot) -> int:
+        """🔁 При старте бота: продолжить незавершённые задания. Возвращает их количество."""
+        deleted = await db.delete_old_generation_jobs(self.keep_days)
+        if deleted:
+            logger.info(f"🧹 Удалено старых заданий генерации: {deleted}")
+
+        jobs = await db.get_unfinished_generation_jobs()
+        for job in jobs:
+            self.stats['resumed'] += 1
+            self._spawn(self._resume_job(bot, job))
+        if jobs:
+            logger.info(f"🔁 Продолжаю незавершённые задания генерации: {len(jobs)}")
+        return len(jobs)
+
+    async def _resume_job(self, bot, job: Dict[str, Any]) -> None:
+        job_id = job['id']
+        remaining = self.max_age_minutes * 60 - self._age_seconds(job['created_at'])
+
+        result_url = job['result_url']
+        if not result_url and job['provider'] == 'kie' and job['task_id'] and remaining > 0:
+            logger.info(f"🔁 Задание #{job_id}: жду задачу Kie.ai {job['task_id']}")
+            result_url = await kie_task_tracker.wait(
+                job['task_id'], model_key=job['model_key'], timeout=remaining
+            )
+            if result_url:
+                await db.set_generation_job_result(job_id, result_url)
+
+        delivered = False
+        if result_url:
+            try:
+                await result_images.send(functools.partial(bot.send_photo, job['chat_id']), result_url,
+                                         caption=RESUMED_CAPTION, parse_mode="HTML")
+                await bot.send_message(chat_id=job['chat_id'], text=RESUMED_MENU_TEXT)
+                delivered = True
+            except Exception as e:
+                logger.error(f"❌ Задание #{job_id}: не удалось доставить результат: {e}")
+
+        params = job['params']
+        if 'room' in params:
+            # Как обработчик: в generations пишутся генерации с комнатой/стилем (design)
+            await db.log_generation(
+                user_id=job['user_id'],
+                room_type=params['room'],
+                style_type=params.get('style', ''),
+                operation_type=job['mode'],
+                success=bool(result_url)
+            )
+
+        if delivered:
+            await db.finish_generation_job(job_id, 'delivered')
+            self.stats['delivered'] += 1
+            logger.info(f"✅ Задание #{job_id} доставлено после перезапуска")
+            return
+
+        if job['cost']:
+            await db.refund_generation_job(job_id, 'interrupted by restart')
+            self.stats['refunded'] += 1
+            text = RESUMED_REFUND_TEXT
+        else:
+            await db.finish_generation_job(job_id, 'failed', 'interrupted by restart')
+            self.stats['failed'] += 1
+            text = RESUMED_FAILED_TEXT
+        try:
+            await bot.send_message(chat_id=job['chat_id'], text=text)
+        except Exception as e:
+            logger.warning(f"⚠️ Задание #{job_id}: не удалось уведомить пользователя: {e}")
+
+    @staticmethod
+    def _age_seconds(created_at: Optional[str]) -> float:
+        # created_at - CURRENT_TIMESTAMP SQLite (UTC, 'YYYY-MM-DD HH:MM:SS')
+        try:
+            created = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        except (TypeError, ValueError):
+            return 0
+        return (datetime.now(timezone.utc) - created).total_seconds()
+
+    # ===== ЖИЗНЕННЫЙ ЦИКЛ =====
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def active_count(self) -> int:
+        return len(self._tasks)
+
+    async def stop(self) -> None:
+        """⏹️ Отменить фоновые генерации; задания остаются в БД до следующего старта"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"⏹️ Остановлено фоновых генераций: {len(tasks)} (продолжатся после перезапуска)")
+
+
+generation_jobs = GenerationJobManager(
+    max_age_minutes=config.GENERATION_JOB_MAX_AGE_MINUTES,
+    keep_days=config.GENERATION_JOB_KEEP_DAYS,
+)
@@ -0,0 +1,217 @@
+# bot/services/generation_scheduler.py
+# --- СОЗДАН: 2026-10-18 - Ограничение одновременных генераций: общий лимит, лимит на пользователя, честная очередь ---
+
+"""
+Планировщик генераций перед services/api_fallback.py.
+
+Раньше число одновременных smart_generate_* ничем не ограничивалось, а один
+пользователь, быстро перебирающий стили, мог занять всю квоту провайдеров.
+Теперь каждая генерация сначала получает слот:
+- не больше max_concurrent генераций на весь бот
+- не больше max_per_user одновременно у одного пользователя
+- очередь честная: пользователи обслуживаются по кругу (round-robin),
+  по одной генерации за проход - десять запросов одного не задержат
+  единственный запрос другого
+- ожидающему сообщается позиция в очереди (on_position(n), n=0 - начали)
+
+Функции api_fallback оборачиваются декоратором @scheduled и принимают
+дополнительные параметры user_id и on_queue_position.
+Метрики: get_stats() - в работе, глубина очереди, время ожидания.
+"""
+
+import asyncio
+import functools
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Callable, Awaitable, Deque, List
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'future', 'enqueued_at', 'on_position', 'last_position')
+
+    def __init__(self, user_id: Optional[int], future: asyncio.Future, enqueued_at: float,
+                 on_position: Optional[PositionCallback]):
+        self.user_id = user_id
+        self.future = future
+        self.enqueued_at = enqueued_at
+        self.on_position = on_position
+        self.last_position = 0
+
+
+class GenerationScheduler:
+    """🚦 Слоты генерации: общий лимит + лимит на пользователя + очередь по кругу"""
+
+    def __init__(self, max_concurrent: int = 10, max_per_user: int = 1, history_size: int = 500):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_user = max(1, max_per_user)
+        self._in_flight_total = 0
+        self._in_flight: Dict[Optional[int], int] = {}
+        # user_id → очередь его ожиданий; порядок ключей = порядок обхода по кругу
+        self._queues: 'OrderedDict[Optional[int], Deque[_Waiter]]' = OrderedDict()
+        self._waits: Deque[float] = deque(maxlen=history_size)
+        self.counters = {'started': 0, 'queued': 0, 'cancelled_in_queue': 0}
+
+    # ===== СЛОТ =====
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int] = None, on_position: Optional[PositionCallback] = None):
+        """Держать слот генерации на время блока async with"""
+        await self.acquire(user_id, on_position)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    async def acquire(self, user_id: Optional[int] = None, on_position: Optional[PositionCallback] = None) -> None:
+        loop = asyncio.get_running_loop()
+        # Без очереди, только если этот пользователь никого не обгоняет
+        if user_id not in self._queues and self._can_start(user_id):
+            self._start(user_id)
+            self._waits.append(0.0)
+            return
+
+        waiter = _Waiter(user_id, loop.create_future(), loop.time(), on_position)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self.counters['queued'] += 1
+        self._notify_positions()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._remove_waiter(waiter)
+                self.counters['cancelled_in_queue'] += 1
+                self._notify_positions()
+            else:
+                # Слот уже выдан, но обработчик отменён - возвращаем слот
+                self.release(user_id)
+            raise
+        self._waits.append(loop.time() - waiter.enqueued_at)
+        if waiter.last_position:
+            self._call_on_position(waiter, 0)
+
+    def release(self, user_id: Optional[int] = None) -> None:
+        self._in_flight_total -= 1
+        left = self._in_flight.get(user_id, 1) - 1
+        if left > 0:
+            self._in_flight[user_id] = left
+        else:
+            self._in_flight.pop(user_id, None)
+        self._dispatch()
+
+    def _can_start(self, user_id: Optional[int]) -> bool:
+        if self._in_flight_total >= self.max_concurrent:
+            return False
+        # Вызовы без user_id (служебные) ограничены только общим лимитом
+        return user_id is None or self._in_flight.get(user_id, 0) < self.max_per_user
+
+    def _start(self, user_id: Optional[int]) -> None:
+        self._in_flight_total += 1
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        self.counters['started'] += 1
+
+    def _dispatch(self) -> None:
+        """Раздать свободные слоты по кругу: первый пользователь в обходе, которому можно"""
+        while self._in_flight_total < self.max_concurrent:
+            picked = next((uid for uid in self._queues if self._can_start(uid)), None)
+            if picked is None:
+                break
+            queue = self._queues[picked]
+            waiter = queue.popleft()
+            if queue:
+                # Следующая генерация этого пользователя - после остальных
+                self._queues.move_to_end(picked)
+            else:
+                del self._queues[picked]
+            self._start(picked)
+            waiter.future.set_result(None)
+        self._notify_positions()
+
+    def _remove_waiter(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[waiter.user_id]
+
+    # ===== ПОЗИЦИЯ В ОЧЕРЕДИ =====
+
+    def _queue_order(self) -> List[_Waiter]:
+        """Порядок, в котором будут обслужены ожидающие (обход по кругу)"""
+        queues = [list(queue) for queue in self._queues.values()]
+        order = []
+        depth = max((len(queue) for queue in queues), default=0)
+        for index in range(depth):
+            order.extend(queue[index] for queue in queues if index < len(queue))
+        return order
+
+    def _notify_positions(self) -> None:
+        for position, waiter in enumerate(self._queue_order(), start=1):
+            if waiter.on_position is not None and waiter.last_position != position:
+                self._call_on_position(waiter, position)
+
+    def _call_on_position(self, waiter: _Waiter, position: int) -> None:
+        waiter.last_position = position
+        if waiter.on_position is None:
+            return
+        task = asyncio.create_task(waiter.on_position(position))
+        task.add_done_callback(_log_callback_error)
+
+    # ===== МЕТРИКИ =====
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 В работе, глубина очереди, время ожидания слота (сек)"""
+        waits = sorted(self._waits)
+
+        def percentile(q: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(round(q * (len(waits) - 1))))], 2)
+
+        return {
+            'in_flight': self._in_flight_total,
+            'queue_depth': sum(len(queue) for queue in self._queues.values()),
+            'queued_users': len(self._queues),
+            'max_concurrent': self.max_concurrent,
+            'max_per_user': self.max_per_user,
+            'wait_p50': percentile(0.5),
+            'wait_p90': percentile(0.9),
+            'wait_max': round(waits[-1], 2) if waits else None,
+            **self.counters,
+        }
+
+
+def _log_callback_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"⚠️ on_position: {task.exception()}")
+
+
+generation_scheduler = GenerationScheduler(
+    max_concurrent=config.GENERATION_MAX_CONCURRENT,
+    max_per_user=config.GENERATION_MAX_PER_USER,
+)
+
+
+def scheduled(func):
+    """
+    Декоратор для smart_generate_*: генерация выполняется только получив слот.
+
+    Добавляет параметры user_id (для лимита на пользователя) и
+    on_queue_position (async-функция, получает позицию в очереди; 0 - генерация началась).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, user_id: Optional[int] = None,
+                      on_queue_position: Optional[PositionCallback] = None, **kwargs):
+        async with generation_scheduler.slot(user_id, on_queue_position):
+            return await func(*args, **kwargs)
+    return wrapper
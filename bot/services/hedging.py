@@ -0,0 +1,150 @@
+# bot/services/hedging.py
+# --- СОЗДАН: 2026-10-18 - Hedged-запросы: Replicate параллельно KIE, если KIE дольше своего p90 ---
+# --- ОБНОВЛЕН: 2026-10-18 - Проигравший отменяется с сообщением HEDGE_LOSER (breaker считает его медленным) ---
+
+"""
+Hedging генерации между KIE и Replicate.
+
+smart_generate_interior сначала ждёт KIE целиком (тайм-аут 300-600 сек) и
+только потом идёт в Replicate - худший случай огромный. В режиме hedging:
+- KIE запускается как обычно
+- если KIE не ответил за p90 своей недавней истории (по режиму BASE/PRO),
+  параллельно запускается Replicate
+- берётся первый непустой результат, проигравший отменяется
+
+Hedge - это лишняя платная генерация, поэтому режим выключен по умолчанию и
+ограничен дневным лимитом запусков Replicate. Оба параметра - в таблице
+settings (hedging_enabled, hedging_daily_cap), админ меняет их командой /hedging.
+Счётчик запусков за день хранится в памяти процесса.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable, Awaitable, Deque, Tuple
+
+from config import config
+from database.db import db
+
+logger = logging.getLogger(__name__)
+
+GenerationFactory = Callable[[], Awaitable[Optional[str]]]
+
+# Сообщение отмены проигравшего: отличает его от отмены всей генерации (остановка бота)
+HEDGE_LOSER = 'hedge loser'
+
+
+class HedgedGenerator:
+    """🪁 KIE с запасным Replicate после p90 задержки KIE"""
+
+    def __init__(self, min_samples: int = 10, default_delay: float = 120.0, history_size: int = 200):
+        self.min_samples = min_samples
+        # Пока истории мало - hedge через default_delay секунд
+        self.default_delay = default_delay
+        self.history_size = history_size
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._day: Optional[str] = None
+        self._hedges_today = 0
+        self.stats = {'runs': 0, 'hedged': 0, 'primary_won': 0, 'hedge_won': 0, 'cap_reached': 0}
+
+    # ===== ИСТОРИЯ KIE =====
+
+    def record(self, key: str, seconds: float) -> None:
+        self._latencies.setdefault(key, deque(maxlen=self.history_size)).append(seconds)
+
+    def hedge_delay(self, key: str) -> float:
+        """p90 успешных KIE-генераций этого режима (или default_delay)"""
+        history = self._latencies.get(key)
+        if not history or len(history) < self.min_samples:
+            return self.default_delay
+        values = sorted(history)
+        return values[min(len(values) - 1, int(round(0.9 * (len(values) - 1))))]
+
+    # ===== ЛИМИТ СТОИМОСТИ =====
+
+    async def _settings(self) -> Tuple[bool, int]:
+        settings = await db.get_settings('hedging_enabled', 'hedging_daily_cap')
+        enabled = settings.get('hedging_enabled') == '1'
+        try:
+            daily_cap = int(settings.get('hedging_daily_cap') or 0)
+        except ValueError:
+            daily_cap = 0
+        return enabled, daily_cap
+
+    async def is_enabled(self) -> bool:
+        enabled, _ = await self._settings()
+        return enabled
+
+    async def _take_budget(self) -> bool:
+        """Можно ли ещё один hedge сегодня (и учесть его)"""
+        enabled, daily_cap = await self._settings()
+        if not enabled:
+            return False
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        if self._day != today:
+            self._day, self._hedges_today = today, 0
+        if self._hedges_today >= daily_cap:
+            self.stats['cap_reached'] += 1
+            return False
+        self._hedges_today += 1
+        return True
+
+    # ===== ЗАПУСК =====
+
+    async def run(self, key: str, primary: GenerationFactory, hedge: GenerationFactory) -> Tuple[Optional[str], bool]:
+        """
+        Запустить primary (KIE); после hedge_delay(key) без ответа - ещё и hedge (Replicate).
+
+        Возвращает (URL или None, был ли запущен hedge). Если hedge запускался и
+        оба вернули None - повторно пробовать Replicate не нужно.
+        """
+        self.stats['runs'] += 1
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        primary_task = asyncio.create_task(primary())
+        tasks = {primary_task}
+        hedged = False
+        won = False
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(key))
+            if not done and await self._take_budget():
+                hedged = True
+                self.stats['hedged'] += 1
+                logger.info(f"🪁 [HEDGE] KIE дольше {self.hedge_delay(key):.0f}s ({key}) - запускаю Replicate параллельно")
+                tasks.add(asyncio.create_task(hedge()))
+
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = 'KIE' if task is primary_task else 'Replicate'
+                    if not task.cancelled() and task.exception() is not None:
+                        logger.error(f"❌ [HEDGE] {provider}: {task.exception()}")
+                    result_url = None if task.cancelled() or task.exception() else task.result()
+                    if task is primary_task and result_url:
+                        self.record(key, loop.time() - started_at)
+                    if result_url:
+                        self.stats['primary_won' if task is primary_task else 'hedge_won'] += 1
+                        if hedged:
+                            logger.info(f"🏁 [HEDGE] Первым ответил {provider} за {loop.time() - started_at:.0f}s")
+                        won = True
+                        return result_url, hedged
+            return None, hedged
+        finally:
+            # Проигравший (или всё, если нас отменили) - отменяем
+            for task in tasks:
+                task.cancel(HEDGE_LOSER if won else None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'hedges_today': self._hedges_today if self._day == datetime.now(timezone.utc).strftime('%Y-%m-%d') else 0,
+            'delays': {key: round(self.hedge_delay(key), 1) for key in self._latencies},
+        }
+
+
+hedged_generator = HedgedGenerator(
+    min_samples=config.HEDGE_MIN_SAMPLES,
+    default_delay=config.HEDGE_DEFAULT_DELAY,
+)
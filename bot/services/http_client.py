@@ -0,0 +1,74 @@
+# bot/services/http_client.py
+# --- СОЗДАН: 2026-10-18 - Общий httpx.AsyncClient (HTTP/2, keep-alive) для Kie.ai и Telegram getFile ---
+
+"""
+Общий HTTP-клиент процесса.
+
+Раньше каждый запрос к api.kie.ai (в т.ч. каждый опрос статуса в poll_task_result)
+и каждый getFile к Telegram создавал новый httpx.AsyncClient - то есть новый
+TCP + TLS handshake. Теперь один клиент с пулом соединений и keep-alive на весь
+процесс: создаётся при старте бота (init_http_client) и закрывается при остановке
+(close_http_client) в main.py.
+
+HTTP/2 включается, если установлен пакет h2 (pip install "httpx[http2]").
+"""
+
+import logging
+from typing import Optional
+
+import httpx
+
+from config import config
+
+try:
+    import h2  # noqa: F401  (нужен httpx для HTTP/2)
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+    logging.warning(
+        "⚠️ Пакет h2 не установлен, HTTP/2 выключен! "
+        "Установите: pip install \"httpx[http2]\""
+    )
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+    # Таймаут по умолчанию; запросы к Kie.ai передают свой (BASE/PRO)
+    timeout = httpx.Timeout(config.HTTP_DEFAULT_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=limits, timeout=timeout)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """🌐 Общий клиент (создаётся при первом обращении, если init_http_client не вызывали)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    """🔧 Создать общий клиент при старте бота"""
+    client = get_http_client()
+    logger.info(
+        f"✅ HTTP клиент создан (http2={HTTP2_AVAILABLE}, "
+        f"max_connections={config.HTTP_MAX_CONNECTIONS}, keepalive={config.HTTP_MAX_KEEPALIVE_CONNECTIONS})"
+    )
+    return client
+
+
+async def close_http_client() -> None:
+    """🔧 Закрыть общий клиент при остановке бота"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("✅ HTTP клиент закрыт")
+    _client = None
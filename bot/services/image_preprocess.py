@@ -0,0 +1,216 @@
+# bot/services/image_preprocess.py
+# --- СОЗДАН: 2026-10-18 - Подготовка фото пользователя перед Kie.ai: уменьшение, ориентация, без EXIF, JPEG ---
+# --- ОБНОВЛЕН: 2026-10-18 - Тайм-аут подготовки (KIE_INPUT_TIMEOUT): зависшее скачивание не держит слот генерации ---
+
+"""
+Предобработка входных фото для Kie.ai (Nano Banana).
+
+Раньше в Kie.ai уходила ссылка Telegram на файл как есть - в том размере,
+в котором его загрузил клиент (часто больше, чем нужно модели), с EXIF и
+поворотом через тег Orientation. Теперь перед generate_interior_with_nano_banana,
+apply_style_to_room и apply_facade_style_to_house:
+- файл скачивается из Telegram (download_to_file)
+- в отдельном процессе (ProcessPoolExecutor, Pillow): поворот по EXIF,
+  уменьшение длинной стороны до разрешения модели (BASE - KIE_INPUT_BASE_MAX_SIDE,
+  PRO - KIE_NANO_BANANA_PRO_RESOLUTION: 1K/2K/4K), JPEG без EXIF
+- результат раздаётся тем же веб-сервером, что и callback Kie.ai:
+  GET {KIE_CALLBACK_BASE_URL}{KIE_INPUT_PATH}/<случайное имя>.jpg, живёт KIE_INPUT_TTL секунд
+
+Пропорции не меняются: обрезка под KIE_NANO_BANANA_PRO_ASPECT отрезала бы
+часть комнаты, кадрирование остаётся модели.
+
+Без Pillow, без публичного адреса (callback выключен), при любой ошибке или
+если подготовка дольше timeout секунд, возвращается исходная ссылка Telegram -
+как раньше. Подготовка идёт внутри слота планировщика генераций, поэтому
+тайм-аут обязателен.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+
+from config_kie import config_kie
+from services.downloads import download_to_file
+
+try:
+    from PIL import Image, ImageOps
+
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logging.warning(
+        "⚠️ Библиотека Pillow не установлена, фото уходят в Kie.ai без предобработки! "
+        "Установите: pip install Pillow"
+    )
+
+logger = logging.getLogger(__name__)
+
+PRO_RESOLUTION_SIDES = {'1K': 1024, '2K': 2048, '4K': 4096}
+# Лимит Bot API на скачивание файла
+TELEGRAM_DOWNLOAD_MAX_BYTES = 20 * 1024 * 1024
+
+
+def _preprocess_file(src: str, dst: str, max_side: int, quality: int) -> Tuple[int, int, int, int]:
+    """Выполняется в дочернем процессе: повернуть по EXIF, уменьшить, сохранить JPEG без метаданных"""
+    with Image.open(src) as image:
+        original_size = image.size
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        # exif не передаём - метаданные (в т.ч. GPS) не сохраняются
+        image.save(dst, 'JPEG', quality=quality, optimize=True)
+        return original_size[0], original_size[1], image.size[0], image.size[1]
+
+
+class ImagePreprocessor:
+    """🖼 Telegram URL → уменьшенный JPEG на своём веб-сервере"""
+
+    def __init__(self, cache_dir: str = 'cache/inputs', workers: int = 2, quality: int = 90,
+                 ttl: float = 1800.0, base_max_side: int = 1024, timeout: float = 30.0):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.quality = quality
+        self.ttl = ttl
+        self.base_max_side = base_max_side
+        self.timeout = timeout
+        # Включается в main.py, когда веб-сервер callback Kie.ai запущен
+        self.enabled = False
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # (file_id, max_side) → (имя файла, истекает в monotonic)
+        self._prepared: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self._in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.stats = {'prepared': 0, 'reused': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and PIL_AVAILABLE and config_kie.KIE_INPUT_PREPROCESS and bool(config_kie.KIE_CALLBACK_BASE_URL)
+
+    def max_side(self, use_pro: bool) -> int:
+        if use_pro:
+            return PRO_RESOLUTION_SIDES.get(config_kie.KIE_NANO_BANANA_PRO_RESOLUTION.upper(), 2048)
+        return self.base_max_side
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def public_url(self, name: str) -> str:
+        return f"{config_kie.KIE_CALLBACK_BASE_URL}{config_kie.KIE_INPUT_PATH}/{name}"
+
+    # ===== ПОДГОТОВКА =====
+
+    async def prepare_many(self, items: List[Tuple[str, str]], use_pro: bool) -> List[str]:
+        """[(file_id, telegram_url), ...] → URL для Kie.ai в том же порядке"""
+        return list(await asyncio.gather(*(self.prepare(file_id, url, use_pro) for file_id, url in items)))
+
+    async def prepare(self, file_id: str, telegram_url: str, use_pro: bool) -> str:
+        """URL подготовленного фото (или исходный telegram_url, если подготовка недоступна)"""
+        if not self.active:
+            return telegram_url
+        self._purge_expired()
+
+        key = (file_id, self.max_side(use_pro))
+        prepared = self._prepared.get(key)
+        if prepared is not None:
+            # Новая задача Kie.ai может скачать файл позже - продлеваем срок
+            self._prepared[key] = (prepared[0], time.monotonic() + self.ttl)
+            self.stats['reused'] += 1
+            return self.public_url(prepared[0])
+
+        future = self._in_flight.get(key)
+        if future is None:
+            # wait_for внутри общей задачи: по тайм-ауту она завершается и уходит из _in_flight
+            future = asyncio.ensure_future(asyncio.wait_for(self._prepare(key, telegram_url), self.timeout))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        try:
+            name = await asyncio.shield(future)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ [PREPROCESS] Подготовка дольше {self.timeout:g}s - фото отправлено без обработки")
+            return telegram_url
+        except Exception as e:
+            logger.warning(f"⚠️ [PREPROCESS] Фото отправлено без обработки: {e}")
+            return telegram_url
+        return self.public_url(name)
+
+    async def _prepare(self, key: Tuple[str, int], telegram_url: str) -> str:
+        max_side = key[1]
+        name = f"{uuid.uuid4().hex}.jpg"
+        src = self.path_for(name + '.src')
+        dst = self.path_for(name)
+        try:
+            size_in = await download_to_file(telegram_url, src, TELEGRAM_DOWNLOAD_MAX_BYTES, timeout=self.timeout)
+            loop = asyncio.get_running_loop()
+            width, height, new_width, new_height = await loop.run_in_executor(
+                self._get_pool(), _preprocess_file, src, dst, max_side, self.quality
+            )
+        except BaseException:
+            # В т.ч. отмена по тайм-ауту
+            self.stats['failed'] += 1
+            self._remove(dst)
+            raise
+        finally:
+            self._remove(src)
+
+        size_out = os.path.getsize(dst)
+        self._prepared[key] = (name, time.monotonic() + self.ttl)
+        self.stats['prepared'] += 1
+        self.stats['bytes_in'] += size_in
+        self.stats['bytes_out'] += size_out
+        logger.info(
+            f"🖼 [PREPROCESS] {width}x{height} {size_in // 1024} KB → "
+            f"{new_width}x{new_height} {size_out // 1024} KB"
+        )
+        return name
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    # ===== ХРАНЕНИЕ =====
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        for key, (name, expires_at) in list(self._prepared.items()):
+            if expires_at <= now:
+                del self._prepared[key]
+                self._remove(self.path_for(name))
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def start(self) -> None:
+        """Включить (веб-сервер запущен) и удалить файлы, оставшиеся с прошлого запуска"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                self._remove(entry.path)
+        self.enabled = True
+
+    def stop(self) -> None:
+        self.enabled = False
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'active': self.active, 'files': len(self._prepared), **self.stats}
+
+
+image_preprocessor = ImagePreprocessor(
+    cache_dir=config_kie.KIE_INPUT_DIR,
+    workers=config_kie.KIE_INPUT_WORKERS,
+    quality=config_kie.KIE_INPUT_JPEG_QUALITY,
+    ttl=config_kie.KIE_INPUT_TTL,
+    base_max_side=config_kie.KIE_INPUT_BASE_MAX_SIDE,
+    timeout=config_kie.KIE_INPUT_TIMEOUT,
+)
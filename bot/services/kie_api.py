@@ -1,6 +1,13 @@
 # ========================================
 # ФАЙЛ: bot/services/kie_api.py
 # НАЗНАЧЕНИЕ: Интеграция с Kie.ai API (Nano Banana)
+# ВЕРСИЯ: 3.16 (2026-10-18) - PERF: Входные фото уменьшаются до разрешения модели и очищаются от EXIF (services/image_preprocess.py)
+# ВЕРСИЯ: 3.15 (2026-10-18) - PERF: getFile через общий кэш services/telegram_files.py (TTL LRU, один запрос на file_id)
+# ВЕРСИЯ: 3.14 (2026-10-18) - ADD: task_id Kie.ai сохраняется в текущее задание генерации (generation_jobs)
+# ВЕРСИЯ: 3.13 (2026-10-18) - PERF: Ожидание задач через общий kie_task_tracker (один таймер на все задачи)
+# ВЕРСИЯ: 3.12 (2026-10-18) - PERF: Адаптивный интервал опроса по истории времени генерации каждой модели
+# ВЕРСИЯ: 3.11 (2026-10-18) - PERF: Callback завершения задач (callBackUrl), polling остаётся редкой страховкой
+# ВЕРСИЯ: 3.10 (2026-10-18) - PERF: Общий httpx клиент (HTTP/2, keep-alive) вместо клиента на каждый запрос
 # ВЕРСИЯ: 3.9 (2026-01-05 12:10) - ADD: apply_facade_style_to_house() для Facade Design (Screen 17)
 # АВТОР: Project Owner
 # https://docs.kie.ai/market/google/nano-banana
@@ -14,9 +21,15 @@ import httpx
 import json
 import asyncio
 import time
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from config import config
 from config_kie import config_kie
+from services.http_client import get_http_client
+from services.telegram_files import get_telegram_file_url
+from services.image_preprocess import image_preprocessor
+from services.kie_callbacks import kie_callbacks
+from services.kie_task_tracker import kie_task_tracker
+from services.generation_jobs import generation_jobs
 
 from services.design_styles import get_room_name, get_style_description, is_valid_room, is_valid_style
 
@@ -90,24 +103,25 @@ class KieApiClient:
         headers = self._get_headers()
 
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                logger.debug(f"📄 {method} {url}")
-
-                if method.upper() == "GET":
-                    response = await client.get(url, headers=headers, params=params)
-                elif method.upper() == "POST":
-                    response = await client.post(url, headers=headers, json=data)
-                else:
-                    logger.error(f"❌ Неподдерживаемый метод: {method}")
-                    return None
+            # Общий клиент: соединение с api.kie.ai переиспользуется между запросами
+            client = get_http_client()
+            logger.debug(f"📄 {method} {url}")
+
+            if method.upper() == "GET":
+                response = await client.get(url, headers=headers, params=params, timeout=self.timeout)
+            elif method.upper() == "POST":
+                response = await client.post(url, headers=headers, json=data, timeout=self.timeout)
+            else:
+                logger.error(f"❌ Неподдерживаемый метод: {method}")
+                return None
 
-                logger.debug(f"📃 Status: {response.status_code}")
+            logger.debug(f"📃 Status: {response.status_code}")
 
-                if response.status_code not in [200, 201, 202]:
-                    logger.error(f"❌ API ошибка: {response.status_code} - {response.text}")
-                    return None
+            if response.status_code not in [200, 201, 202]:
+                logger.error(f"❌ API ошибка: {response.status_code} - {response.text}")
+                return None
 
-                return response.json()
+            return response.json()
 
         except httpx.TimeoutException:
             logger.error(f"❌ Тайм-аут (>{self.timeout}s)")
@@ -200,72 +214,72 @@ class KieApiClient:
         logger.error(f"❌ Не удалось получить статус: {response}")
         return None
 
+    def _parse_task_result(self, status_data: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+        """
+        Разобрать данные задачи (recordInfo или callback).
+
+        Returns:
+            (задача завершена, URL результата или None)
+        """
+        state = status_data.get("state")
+
+        # ✅ Успешная генерация
+        if state == "success":
+            result_json_str = status_data.get("resultJson")
+            if not result_json_str:
+                logger.error("❌ resultJson отсутствует")
+                return True, None
+            try:
+                result_json = json.loads(result_json_str) if isinstance(result_json_str, str) else result_json_str
+            except json.JSONDecodeError as e:
+                logger.error(f"❌ Не удалось распарсить resultJson: {e}")
+                return True, None
+
+            result_urls = result_json.get("resultUrls", [])
+            if result_urls:
+                logger.info(f"✅ Результат готов: {result_urls[0]}")
+                return True, result_urls[0]
+            logger.error("❌ resultUrls пустой")
+            return True, None
+
+        # ❌ Ошибка генерации
+        if state == "fail":
+            fail_msg = status_data.get("failMsg", "Unknown error")
+            logger.error(f"❌ Генерация провалилась: {fail_msg}")
+            return True, None
+
+        if state not in ["waiting", "queuing", "generating"]:
+            logger.warning(f"⚠️  Неизвестный state: {state}")
+        return False, None
+
     async def poll_task_result(
         self,
         task_id: str,
         max_polls: int = KIE_API_MAX_POLLS,
         poll_interval: int = KIE_API_POLLING_INTERVAL,
+        model_key: Optional[str] = None,
     ) -> Optional[str]:
         """
-        Ожидать результат генерации (polling).
+        Ожидать результат генерации.
+
+        [2026-10-18] Ожидание делегировано общему kie_task_tracker: все задачи процесса
+        опрашиваются одним таймером (интервал - poll_scheduler по model_key, при
+        включенном callback - редкий страховочный опрос), результат раздаётся всем
+        ожидающим. Отмена вызывающего обработчика снимает задачу с опроса.
+        Общее время ожидания - max_polls * poll_interval.
 
         Returns:
             URL результата или None
         """
         logger.info(f"⏳ Ожидание результата (Task: {task_id})...")
 
-        for attempt in range(max_polls):
-            status_data = await self.get_task_status(task_id)
-
-            if not status_data:
-                logger.debug(f"⏳ [{attempt+1}/{max_polls}] Нет данных, повтор через {poll_interval}s...")
-                await asyncio.sleep(poll_interval)
-                continue
-
-            state = status_data.get("state")
-            logger.debug(f"📈 [{attempt+1}/{max_polls}] State: {state}")
-
-            # ✅ Успешная генерация
-            if state == "success":
-                result_json_str = status_data.get("resultJson")
-                if result_json_str:
-                    try:
-                        result_json = json.loads(result_json_str)
-                        result_urls = result_json.get("resultUrls", [])
-                        
-                        if result_urls and len(result_urls) > 0:
-                            result_url = result_urls[0]
-                            logger.info(f"✅ Результат готов: {result_url}")
-                            return result_url
-                        else:
-                            logger.error("❌ resultUrls пустой")
-                            return None
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Не удалось распарсить resultJson: {e}")
-                        return None
-                else:
-                    logger.error("❌ resultJson отсутствует")
-                    return None
-
-            # ❌ Ошибка генерации
-            elif state == "fail":
-                fail_msg = status_data.get("failMsg", "Unknown error")
-                logger.error(f"❌ Генерация провалилась: {fail_msg}")
-                return None
-
-            # ⏳ Генерация в процессе
-            elif state in ["waiting", "queuing", "generating"]:
-                elapsed = (attempt + 1) * poll_interval
-                remaining = (max_polls - attempt - 1) * poll_interval
-                logger.debug(f"⏳ [{attempt+1}/{max_polls}] State={state}, Elapsed: {elapsed}s, Remaining: {remaining}s")
-                await asyncio.sleep(poll_interval)
-
-            else:
-                logger.warning(f"⚠️  Неизвестный state: {state}")
-                await asyncio.sleep(poll_interval)
-
-        logger.error(f"❌ Тайм-аут: результат не получен за {max_polls * poll_interval}s")
-        return None
+        total_wait = max_polls * poll_interval
+        result_url = await kie_task_tracker.wait(
+            task_id, model_key=model_key, timeout=total_wait, poll_interval=poll_interval
+        )
+        if result_url is None:
+            logger.error(f"❌ Результат не получен (Task: {task_id})")
+        return result_url
 
 
 class NanoBananaClient(KieApiClient):
@@ -325,12 +339,16 @@ class NanoBananaClient(KieApiClient):
         task_id = await self.create_generation_task(
             model=model,
             input_data=input_data,
+            callback_url=kie_callbacks.callback_url if kie_callbacks.enabled else None,
         )
 
         if not task_id:
             return None
 
-        result_url = await self.poll_task_result(task_id)
+        model_key = f"{model}:{input_data['resolution']}" if use_pro_mode else model
+        # Задание генерации (если есть) продолжит ждать эту задачу после перезапуска бота
+        await generation_jobs.attach_task('kie', task_id, model_key)
+        result_url = await self.poll_task_result(task_id, model_key=model_key)
         return result_url
 
     async def edit_image(
@@ -389,12 +407,16 @@ class NanoBananaClient(KieApiClient):
         task_id = await self.create_generation_task(
             model=model,
             input_data=input_data,
+            callback_url=kie_callbacks.callback_url if kie_callbacks.enabled else None,
         )
 
         if not task_id:
             return None
 
-        result_url = await self.poll_task_result(task_id)
+        model_key = f"{model}:{input_data['resolution']}" if use_pro_mode else model
+        # Задание генерации (если есть) продолжит ждать эту задачу после перезапуска бота
+        await generation_jobs.attach_task('kie', task_id, model_key)
+        result_url = await self.poll_task_result(task_id, model_key=model_key)
         return result_url
 
 
@@ -402,36 +424,6 @@ class NanoBananaClient(KieApiClient):
 # ИНТЕГРИРОВАННЫЕ ФУНКЦИИ ДЛЯ БОТА
 # ========================================
 
-async def get_telegram_file_url(photo_file_id: str, bot_token: str) -> Optional[str]:
-    """
-    Получить URL файла из Telegram.
-    """
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.telegram.org/bot{bot_token}/getFile",
-                params={"file_id": photo_file_id}
-            )
-
-            if response.status_code != 200:
-                logger.error(f"❌ Не удалось получить файл: {response.text}")
-                return None
-
-            result = response.json()
-            if not result.get('ok'):
-                logger.error(f"❌ API ошибка: {result}")
-                return None
-
-            file_path = result['result']['file_path']
-            file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-            logger.info(f"✅ Получен URL файла: {file_url}")
-            return file_url
-
-    except Exception as e:
-        logger.error(f"❌ Ошибка при получении URL: {e}")
-        return None
-
-
 async def generate_interior_with_nano_banana(
     photo_file_id: str,
     room: str,
@@ -465,6 +457,9 @@ async def generate_interior_with_nano_banana(
 
         # [НОВОЕ 2025-12-24] Передать режим PRO в клиент
         use_pro_mode = use_pro if use_pro is not None else config_kie.USE_PRO_MODEL
+
+        # [2026-10-18] Уменьшенная копия без EXIF (или исходный URL, если предобработка недоступна)
+        image_url = await image_preprocessor.prepare(photo_file_id, image_url, use_pro_mode)
         
         client = NanoBananaClient(use_pro=use_pro_mode)
         result = await client.edit_image(
@@ -557,6 +552,11 @@ async def apply_style_to_room(
         
         # Установить режим PRO
         use_pro_mode = use_pro if use_pro is not None else config_kie.USE_PRO_MODEL
+
+        # [2026-10-18] Уменьшенные копии без EXIF (или исходные URL, если предобработка недоступна)
+        main_image_url, sample_image_url = await image_preprocessor.prepare_many(
+            [(main_photo_file_id, main_image_url), (sample_photo_file_id, sample_image_url)], use_pro_mode
+        )
         
         # Вызываем edit_image с трюмя фото (основные + образец)
         logger.info("📈 Отправка запроса к KIE.AI...")
@@ -659,6 +659,11 @@ async def apply_facade_style_to_house(
         
         # Установить режим PRO
         use_pro_mode = use_pro if use_pro is not None else config_kie.USE_PRO_MODEL
+
+        # [2026-10-18] Уменьшенные копии без EXIF (или исходные URL, если предобработка недоступна)
+        main_facade_url, sample_facade_url = await image_preprocessor.prepare_many(
+            [(main_facade_file_id, main_facade_url), (sample_facade_file_id, sample_facade_url)], use_pro_mode
+        )
         
         # Вызываем edit_image с двумя фото (основное фасад + образец фасад)
         logger.info("📈 Отправка запроса к KIE.AI...")
@@ -0,0 +1,77 @@
+# bot/services/kie_callbacks.py
+# --- СОЗДАН: 2026-10-18 - Реестр ожидающих задач Kie.ai для callback (callBackUrl) ---
+
+"""
+Реестр задач Kie.ai, ожидающих callback.
+
+kie_task_tracker регистрирует task_id и ждёт future, а endpoint
+POST {KIE_CALLBACK_PATH} (handlers/kie_webhook.py) разрешает её данными задачи.
+Callback может прийти раньше, чем задача зарегистрирована (createTask
+ответил позже, чем Kie.ai закончил) - такие данные держим early_ttl секунд.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any, Tuple
+
+from config_kie import config_kie
+
+logger = logging.getLogger(__name__)
+
+
+class KieCallbackRegistry:
+    """📬 task_id → future с данными задачи (state, resultJson, failMsg)"""
+
+    def __init__(self, callback_url: Optional[str] = None, early_ttl: int = 600):
+        self.callback_url = callback_url
+        self.early_ttl = early_ttl
+        # Включается из main.py только после успешного старта веб-сервера
+        self.enabled = False
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._early: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.stats = {'received': 0, 'resolved': 0, 'early': 0, 'unknown': 0}
+
+    def register(self, task_id: str) -> asyncio.Future:
+        """Future, которая разрешится данными задачи из callback"""
+        future = self._waiters.get(task_id)
+        if future is None or future.done():
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[task_id] = future
+
+        early = self._early.pop(task_id, None)
+        if early is not None and not future.done():
+            future.set_result(early[1])
+        return future
+
+    def discard(self, task_id: str) -> None:
+        """Задача больше никого не интересует (результат получен / тайм-аут / отмена)"""
+        future = self._waiters.pop(task_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def resolve(self, task_id: str, data: Dict[str, Any]) -> bool:
+        """Данные из callback → ожидающая future. False - задача пока не зарегистрирована."""
+        self.stats['received'] += 1
+        future = self._waiters.get(task_id)
+        if future is not None and not future.done():
+            future.set_result(data)
+            self.stats['resolved'] += 1
+            return True
+
+        self._cleanup_early()
+        self._early[task_id] = (time.monotonic(), data)
+        self.stats['early'] += 1
+        return False
+
+    def _cleanup_early(self) -> None:
+        threshold = time.monotonic() - self.early_ttl
+        for task_id in [t for t, (ts, _) in self._early.items() if ts < threshold]:
+            self._early.pop(task_id, None)
+            self.stats['unknown'] += 1
+
+    def pending_count(self) -> int:
+        return len(self._waiters)
+
+
+kie_callbacks = KieCallbackRegistry(callback_url=config_kie.KIE_CALLBACK_URL)
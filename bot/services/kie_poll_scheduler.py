@@ -0,0 +1,115 @@
+# bot/services/kie_poll_scheduler.py
+# --- СОЗДАН: 2026-10-18 - Адаптивный интервал опроса задач Kie.ai (по истории времени генерации) ---
+
+"""
+Адаптивное расписание опроса recordInfo.
+
+Вместо постоянного KIE_API_POLLING_INTERVAL для всех моделей планировщик
+запоминает, сколько реально длились последние задачи каждой модели
+(BASE, PRO 1K/2K/4K ...) и по перцентилям p10/p90 решает, когда спрашивать:
+- до p10 - почти наверняка не готово: один запрос ровно к p10
+- между p10 и p90 - часто (основная масса задач завершается тут)
+- после p90 - хвост: интервал растёт с каждым опросом
+- пустой ответ / ошибка API - экспоненциальный backoff с jitter
+
+Пока истории мало (< min_samples), используется обычный интервал.
+Ко всем задержкам добавляется jitter, чтобы опросы разных задач не шли пачкой.
+"""
+
+import logging
+import random
+from collections import deque
+from typing import Optional, Dict, Any, Deque
+
+from config_kie import config_kie
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePollScheduler:
+    """⏱️ Per-model распределение времени генерации → задержка до следующего опроса"""
+
+    def __init__(self, min_interval: float = 1.0, max_interval: float = 20.0,
+                 min_samples: int = 5, history_size: int = 200, jitter: float = 0.1):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_samples = min_samples
+        self.history_size = history_size
+        self.jitter = jitter
+        self._durations: Dict[str, Deque[float]] = {}
+        self._sorted_cache: Dict[str, list] = {}
+
+    # ===== ИСТОРИЯ =====
+
+    def record(self, model: Optional[str], duration: float) -> None:
+        """Запомнить длительность успешной задачи (секунды от создания до результата)"""
+        if not model or duration <= 0:
+            return
+        history = self._durations.setdefault(model, deque(maxlen=self.history_size))
+        history.append(duration)
+        self._sorted_cache.pop(model, None)
+
+    def percentile(self, model: Optional[str], q: float) -> Optional[float]:
+        """q-перцентиль (0..1) длительности или None, если истории мало"""
+        history = self._durations.get(model) if model else None
+        if not history or len(history) < self.min_samples:
+            return None
+        values = self._sorted_cache.get(model)
+        if values is None:
+            values = self._sorted_cache[model] = sorted(history)
+        index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+        return values[index]
+
+    # ===== РАСПИСАНИЕ =====
+
+    def next_delay(self, model: Optional[str], elapsed: float, empty_streak: int = 0,
+                   default_interval: float = 3.0) -> float:
+        """
+        Сколько ждать до следующего опроса.
+
+        elapsed - секунд с создания задачи, empty_streak - сколько опросов подряд
+        вернули пустой ответ/ошибку.
+        """
+        if empty_streak > 0:
+            # Экспоненциальный backoff с «полным» jitter
+            ceiling = min(self.max_interval, default_interval * (2 ** (empty_streak - 1)))
+            return max(self.min_interval, random.uniform(ceiling / 2, ceiling))
+
+        p10 = self.percentile(model, 0.10)
+        p90 = self.percentile(model, 0.90)
+        if p10 is None or p90 is None:
+            return self._with_jitter(default_interval)
+
+        if elapsed < p10:
+            # Рано: один запрос к моменту, когда начинают завершаться самые быстрые задачи
+            delay = p10 - elapsed
+        elif elapsed <= p90:
+            # Окно завершения большинства задач: часто
+            delay = (p90 - p10) / 4
+        else:
+            # Хвост: чем дольше ждём, тем реже спрашиваем
+            delay = (elapsed - p90) / 2
+
+        delay = min(self.max_interval, max(self.min_interval, delay))
+        return self._with_jitter(delay)
+
+    def _with_jitter(self, delay: float) -> float:
+        return max(self.min_interval, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """📊 Распределения по моделям: samples, p50, p90"""
+        return {
+            model: {
+                'samples': len(history),
+                'p50': self.percentile(model, 0.5),
+                'p90': self.percentile(model, 0.9),
+            }
+            for model, history in self._durations.items()
+        }
+
+
+poll_scheduler = AdaptivePollScheduler(
+    min_interval=config_kie.KIE_POLL_MIN_INTERVAL,
+    max_interval=config_kie.KIE_POLL_MAX_INTERVAL,
+    min_samples=config_kie.KIE_POLL_MIN_SAMPLES,
+)
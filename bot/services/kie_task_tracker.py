@@ -0,0 +1,273 @@
+# bot/services/kie_task_tracker.py
+# --- СОЗДАН: 2026-10-18 - Единый трекер всех ожидающих задач Kie.ai (один таймер вместо цикла на каждую генерацию) ---
+
+"""
+Единый трекер задач Kie.ai.
+
+Раньше каждый обработчик, ждущий результат, крутил свой цикл опроса:
+200 пользователей = 200 независимых циклов poll_task_result. Теперь все
+ожидающие task_id живут в одном KieTaskTracker:
+- один фоновый таймер; на каждом тике все «созревшие» задачи проверяются
+  одной пачкой (параллельно, не больше max_concurrent_checks запросов -
+  у recordInfo нет пакетного запроса на несколько taskId)
+- когда проверять задачу, решает poll_scheduler (адаптивный интервал), а при
+  включенном callback - редкий страховочный интервал
+- результат (из опроса или callback) раздаётся всем ожидающим future
+- отмена обработчика снимает его future; задача без ожидающих сразу
+  перестаёт опрашиваться - ничего не «утекает»
+
+Метрики: get_stats() - задачи в работе, гистограмма возраста, счётчики.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, Set
+
+from config_kie import config_kie
+from services.kie_callbacks import kie_callbacks
+from services.kie_poll_scheduler import poll_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы возраста задач (секунды)
+AGE_BUCKETS = (10, 30, 60, 120, 300)
+
+
+class _TrackedTask:
+    __slots__ = ('task_id', 'model_key', 'created_at', 'deadline', 'next_check_at',
+                 'poll_interval', 'empty_streak', 'checks', 'waiters', 'callback_future')
+
+    def __init__(self, task_id: str, model_key: Optional[str], now: float, timeout: float, poll_interval: float):
+        self.task_id = task_id
+        self.model_key = model_key
+        self.created_at = now
+        self.deadline = now + timeout
+        self.next_check_at = now
+        self.poll_interval = poll_interval
+        self.empty_streak = 0
+        self.checks = 0
+        self.waiters: Set[asyncio.Future] = set()
+        self.callback_future: Optional[asyncio.Future] = None
+
+
+class KieTaskTracker:
+    """🛰️ Все ожидающие задачи Kie.ai: один таймер, пачки проверок, раздача результатов"""
+
+    def __init__(self, max_concurrent_checks: int = 10, check_timeout: float = 15.0, max_tick: float = 1.0):
+        self.max_concurrent_checks = max(1, max_concurrent_checks)
+        # Один зависший recordInfo не должен задерживать весь тик
+        self.check_timeout = check_timeout
+        self.max_tick = max_tick
+        self._tasks: Dict[str, _TrackedTask] = {}
+        self._client = None
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.counters = {
+            'tracked': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'abandoned': 0,
+            'checks': 0, 'ticks': 0, 'callbacks': 0,
+        }
+
+    # ===== ОЖИДАНИЕ РЕЗУЛЬТАТА =====
+
+    async def wait(self, task_id: str, model_key: Optional[str] = None,
+                   timeout: float = 300, poll_interval: float = 3) -> Optional[str]:
+        """
+        ⏳ Дождаться результата задачи. Возвращает URL или None (ошибка / тайм-аут).
+
+        Можно ждать одну задачу из нескольких мест - опрос всё равно один.
+        """
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(task_id)
+        if task is None:
+            task = _TrackedTask(task_id, model_key, loop.time(), timeout, poll_interval)
+            # Первая проверка не сразу: задача только что создана
+            task.next_check_at = task.created_at + self._next_delay(task)
+            self._tasks[task_id] = task
+            self.counters['tracked'] += 1
+            self._attach_callback(task)
+        else:
+            task.deadline = max(task.deadline, loop.time() + timeout)
+
+        waiter = loop.create_future()
+        task.waiters.add(waiter)
+        self._ensure_running()
+        self._wakeup.set()
+
+        try:
+            return await waiter
+        finally:
+            task.waiters.discard(waiter)
+            if not task.waiters and self._tasks.get(task_id) is task:
+                # Обработчик отменён и больше никто не ждёт - перестаём опрашивать
+                self._drop(task)
+                self.counters['abandoned'] += 1
+                logger.debug(f"🛰️ [TRACKER] Task {task_id} снят (ожидающих нет)")
+
+    # ===== ЗАВЕРШЕНИЕ =====
+
+    def _complete(self, task: _TrackedTask, result_url: Optional[str], reason: str) -> None:
+        if self._tasks.get(task.task_id) is not task:
+            return
+        self._drop(task)
+        if result_url:
+            self.counters['completed'] += 1
+            poll_scheduler.record(task.model_key, asyncio.get_running_loop().time() - task.created_at)
+        elif reason == 'timeout':
+            self.counters['timeouts'] += 1
+        else:
+            self.counters['failed'] += 1
+        for waiter in list(task.waiters):
+            if not waiter.done():
+                waiter.set_result(result_url)
+
+    def _drop(self, task: _TrackedTask) -> None:
+        self._tasks.pop(task.task_id, None)
+        if task.callback_future is not None:
+            kie_callbacks.discard(task.task_id)
+            task.callback_future = None
+
+    # ===== CALLBACK =====
+
+    def _attach_callback(self, task: _TrackedTask) -> None:
+        if not kie_callbacks.enabled:
+            return
+        future = kie_callbacks.register(task.task_id)
+        task.callback_future = future
+        future.add_done_callback(lambda f, t=task: self._on_callback(t, f))
+
+    def _on_callback(self, task: _TrackedTask, future: asyncio.Future) -> None:
+        if future.cancelled() or self._tasks.get(task.task_id) is not task:
+            return
+        self.counters['callbacks'] += 1
+        data = future.result()
+        logger.debug(f"📬 [TRACKER] Callback для Task {task.task_id}: state={data.get('state')}")
+        done, result_url = self._get_client()._parse_task_result(data)
+        if done:
+            self._complete(task, result_url, 'callback')
+        else:
+            self._attach_callback(task)
+
+    # ===== ТАЙМЕР =====
+
+    def _ensure_running(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    def _next_delay(self, task: _TrackedTask) -> float:
+        if task.callback_future is not None or kie_callbacks.enabled:
+            return max(task.poll_interval, config_kie.KIE_CALLBACK_SAFETY_POLL_INTERVAL)
+        now = asyncio.get_running_loop().time()
+        return poll_scheduler.next_delay(
+            task.model_key, now - task.created_at, task.empty_streak, default_interval=task.poll_interval
+        )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+
+            for task in [t for t in self._tasks.values() if now >= t.deadline]:
+                logger.error(f"❌ [TRACKER] Тайм-аут Task {task.task_id} ({now - task.created_at:.0f}s)")
+                self._complete(task, None, 'timeout')
+
+            due = [t for t in self._tasks.values() if now >= t.next_check_at]
+            if due:
+                self.counters['ticks'] += 1
+                await self._check_batch(due)
+                continue
+
+            if self._tasks:
+                sleep_for = min(t.next_check_at for t in self._tasks.values()) - now
+                sleep_for = min(max(sleep_for, 0.05), self.max_tick)
+            else:
+                sleep_for = None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check_batch(self, due: List[_TrackedTask]) -> None:
+        """Проверить пачку задач параллельно (не больше max_concurrent_checks запросов сразу)"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_checks)
+        client = self._get_client()
+        loop = asyncio.get_running_loop()
+
+        async def check(task: _TrackedTask) -> None:
+            async with semaphore:
+                if self._tasks.get(task.task_id) is not task:
+                    return
+                task.checks += 1
+                self.counters['checks'] += 1
+                try:
+                    status_data = await asyncio.wait_for(
+                        client.get_task_status(task.task_id), timeout=self.check_timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"⚠️ [TRACKER] recordInfo Task {task.task_id} дольше {self.check_timeout}s")
+                    status_data = None
+                except Exception as e:
+                    logger.error(f"❌ [TRACKER] Ошибка проверки Task {task.task_id}: {e}")
+                    status_data = None
+
+            if self._tasks.get(task.task_id) is not task:
+                return
+            if not status_data:
+                task.empty_streak += 1
+            else:
+                task.empty_streak = 0
+                done, result_url = client._parse_task_result(status_data)
+                if done:
+                    self._complete(task, result_url, 'poll')
+                    return
+                logger.debug(f"⏳ [TRACKER] Task {task.task_id}: state={status_data.get('state')}, "
+                             f"проверок: {task.checks}, возраст: {loop.time() - task.created_at:.0f}s")
+            task.next_check_at = loop.time() + self._next_delay(task)
+
+        # Задачи отделены от ожидающих: отмена обработчика не прерывает проверку
+        await asyncio.gather(*(check(task) for task in due), return_exceptions=True)
+
+    def _get_client(self):
+        if self._client is None:
+            # Локальный импорт: kie_api сам использует трекер
+            from services.kie_api import KieApiClient
+            self._client = KieApiClient()
+        return self._client
+
+    # ===== ЖИЗНЕННЫЙ ЦИКЛ И МЕТРИКИ =====
+
+    async def stop(self) -> None:
+        """⏹️ Остановить таймер (при выключении бота); ожидающие получают None"""
+        if self._runner is not None and not self._runner.done():
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+        self._runner = None
+        for task in list(self._tasks.values()):
+            self._complete(task, None, 'stopped')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Задачи в работе, гистограмма возраста (сек), счётчики"""
+        now = asyncio.get_running_loop().time() if self._tasks else 0
+        labels = [f"<{b}s" for b in AGE_BUCKETS] + [f">={AGE_BUCKETS[-1]}s"]
+        histogram = dict.fromkeys(labels, 0)
+        for task in self._tasks.values():
+            age = now - task.created_at
+            index = next((i for i, bound in enumerate(AGE_BUCKETS) if age < bound), len(AGE_BUCKETS))
+            histogram[labels[index]] += 1
+        return {
+            'in_flight': len(self._tasks),
+            'waiters': sum(len(t.waiters) for t in self._tasks.values()),
+            'age_histogram': histogram,
+            **self.counters,
+        }
+
+
+kie_task_tracker = KieTaskTracker(
+    max_concurrent_checks=config_kie.KIE_TRACKER_MAX_CONCURRENT_CHECKS,
+    check_timeout=config_kie.KIE_TRACKER_CHECK_TIMEOUT,
+)
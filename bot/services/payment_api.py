@@ -1,5 +1,7 @@
 # bot/services/payment_api.py
 # --- СОЗДАН: 2025-12-10 - Полная интеграция YooKassa с официальным SDK ---
+# --- ОБНОВЛЕН: 2026-10-18 - Стабильный Idempotence-Key на нажатие кнопки оплаты, повтор запроса при сетевой ошибке / 5xx ---
+# --- ОБНОВЛЕН: 2026-10-18 - PERF: создание и проверка платежа - async через общий httpx клиент (без блокировки event loop) ---
 
 """
 Модуль для работы с платежами через YooKassa API.
@@ -10,20 +12,39 @@
 - Валидация вебхуков от YooKassa
 - Обработка ошибок и логирование
 
+[2026-10-18] create_payment_yookassa / find_payment / is_payment_successful - async.
+Синхронный SDK (Payment.create / Payment.find_one) делал HTTPS-запрос прямо в
+event loop: каждое нажатие "Проверить оплату" останавливало бота для всех.
+Теперь запросы идут в REST API v3 через общий httpx клиент (keep-alive),
+одновременно не больше YOOKASSA_MAX_CONCURRENT. SDK нужен только для
+разбора вебхуков (validate_webhook_signature).
+
+При сетевой ошибке или 5xx запрос повторяется (YOOKASSA_RETRIES). Создание
+платежа повторяется с тем же Idempotence-Key: он выводится из user_id, пакета и
+id нажатия кнопки (callback.id), поэтому ни повтор, ни повторная доставка того же
+нажатия не создают второй платёж.
+
 Требования:
-- pip install yookassa
+- pip install yookassa (для вебхуков)
 - Переменные окружения: YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
 
 Документация: https://yookassa.ru/developers/using-api/using-sdks
 """
 
 import os
+import uuid
+import asyncio
 import logging
 from typing import Optional, Dict, Any
+
+import httpx
 from dotenv import load_dotenv
 
+from config import config
+from services.http_client import get_http_client
+
 try:
-    from yookassa import Payment, Configuration
+    from yookassa import Configuration
     from yookassa.domain.notification import (
         WebhookNotificationEventType,
         WebhookNotificationFactory
@@ -41,28 +62,82 @@ BOT_LINK = os.getenv('BOT_LINK', 'Interior_Bot1_bot')
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+YOOKASSA_API_URL = "https://api.yookassa.ru/v3"
+
 # Настройка YooKassa
-if YOOKASSA_AVAILABLE:
-    YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
-    YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
+YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
+YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
 
-    if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
+if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
+    if YOOKASSA_AVAILABLE:
         Configuration.account_id = YOOKASSA_SHOP_ID
         Configuration.secret_key = YOOKASSA_SECRET_KEY
-        logger.info("✅ YooKassa конфигурация загружена")
-    else:
-        logger.error(
-            "❌ Отсутствуют YOOKASSA_SHOP_ID или YOOKASSA_SECRET_KEY в .env! "
-            "Платежи работать НЕ будут!"
-        )
+    logger.info("✅ YooKassa конфигурация загружена")
+else:
+    logger.error(
+        "❌ Отсутствуют YOOKASSA_SHOP_ID или YOOKASSA_SECRET_KEY в .env! "
+        "Платежи работать НЕ будут!"
+    )
+
+# Ограничение одновременных запросов к API YooKassa
+_yookassa_semaphore = asyncio.Semaphore(config.YOOKASSA_MAX_CONCURRENT)
+
 
+async def _yookassa_request(method: str, path: str, payload: Optional[dict] = None,
+                            idempotence_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Запрос к REST API YooKassa через общий httpx клиент.
 
-def create_payment_yookassa(
+    Возвращает JSON ответа; при HTTP-ошибке - исключение RuntimeError.
+    Сетевая ошибка или 5xx - до config.YOOKASSA_RETRIES повторов. POST отправляется
+    с Idempotence-Key (без idempotence_key - случайный): все повторы идут с одним
+    ключом, YooKassa вернёт уже созданный платёж вместо второго.
+    """
+    headers = None
+    if method == "POST":
+        headers = {"Idempotence-Key": idempotence_key or str(uuid.uuid4())}
+
+    attempts = max(0, config.YOOKASSA_RETRIES) + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            async with _yookassa_semaphore:
+                response = await get_http_client().request(
+                    method,
+                    f"{YOOKASSA_API_URL}{path}",
+                    json=payload,
+                    headers=headers,
+                    auth=(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY),
+                    timeout=config.YOOKASSA_TIMEOUT,
+                )
+        except httpx.TransportError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"[YOOKASSA] ⚠️ {method} {path}: {e!r}, повтор {attempt}/{attempts - 1}")
+        else:
+            if response.status_code < 500 or attempt == attempts:
+                break
+            logger.warning(f"[YOOKASSA] ⚠️ {method} {path}: HTTP {response.status_code}, повтор {attempt}/{attempts - 1}")
+        await asyncio.sleep(0.5 * attempt)
+
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:300]}")
+    return response.json()
+
+
+def _credentials_configured() -> bool:
+    if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY):
+        logger.error("❌ YooKassa не настроена (YOOKASSA_SHOP_ID / YOOKASSA_SECRET_KEY)!")
+        return False
+    return True
+
+
+async def create_payment_yookassa(
     amount: int,
     user_id: int,
     tokens: int,
     description: str = "Покупка токенов",
-    return_url: Optional[str] = None
+    return_url: Optional[str] = None,
+    request_id: Optional[str] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Создание платежа в YooKassa.
@@ -73,12 +148,13 @@ def create_payment_yookassa(
         tokens: Количество генераций для начисления
         description: Описание платежа
         return_url: URL возврата после оплаты (опционально)
+        request_id: ID запроса на оплату (callback.id нажатия кнопки) - из него
+            строится Idempotence-Key; без него ключ случайный
 
     Returns:
         dict: Данные о платеже или None при ошибке
     """
-    if not YOOKASSA_AVAILABLE:
-        logger.error("❌ YooKassa SDK не установлен!")
+    if not _credentials_configured():
         return None
 
     if amount <= 0 or tokens <= 0:
@@ -126,17 +202,22 @@ def create_payment_yookassa(
 
         logger.info(f"[YOOKASSA] Создание платежа: user_id={user_id}, amount={amount}₽, tokens={tokens}")
 
-        # Создаем платеж через YooKassa SDK
-        payment = Payment.create(payment_data)
+        # Один ключ на нажатие: повтор запроса вернёт тот же платёж (ключ YooKassa - до 64 символов)
+        idempotence_key = None
+        if request_id:
+            idempotence_key = str(uuid.uuid5(uuid.NAMESPACE_URL, f"yookassa:{user_id}:{tokens}:{amount}:{request_id}"))
+
+        # Создаем платеж через REST API YooKassa
+        payment = await _yookassa_request("POST", "/payments", payment_data, idempotence_key=idempotence_key)
 
-        logger.info(f"[YOOKASSA] ✅ Платёж создан: {payment.id}, статус: {payment.status}")
+        logger.info(f"[YOOKASSA] ✅ Платёж создан: {payment['id']}, статус: {payment['status']}")
 
         return {
-            'id': payment.id,
+            'id': payment['id'],
             'amount': amount,
             'tokens': tokens,
-            'confirmation_url': payment.confirmation.confirmation_url,
-            'status': payment.status
+            'confirmation_url': payment['confirmation']['confirmation_url'],
+            'status': payment['status']
         }
 
     except Exception as e:
@@ -144,7 +225,7 @@ def create_payment_yookassa(
         return None
 
 
-def find_payment(payment_id: str) -> Optional[Dict[str, Any]]:
+async def find_payment(payment_id: str) -> Optional[Dict[str, Any]]:
     """
     Получение информации о платеже из YooKassa.
 
@@ -160,8 +241,7 @@ def find_payment(payment_id: str) -> Optional[Dict[str, Any]]:
                 'metadata': dict - Метаданные (user_id, tokens)
             }
     """
-    if not YOOKASSA_AVAILABLE:
-        logger.error("❌ YooKassa SDK не установлен!")
+    if not _credentials_configured():
         return None
 
     if not payment_id:
@@ -172,19 +252,19 @@ def find_payment(payment_id: str) -> Optional[Dict[str, Any]]:
         logger.info(f"[YOOKASSA] Проверка платежа: {payment_id}")
 
         # Получаем данные платежа
-        payment = Payment.find_one(payment_id)
+        payment = await _yookassa_request("GET", f"/payments/{payment_id}")
 
         if not payment:
             logger.warning(f"[YOOKASSA] Платёж {payment_id} не найден")
             return None
 
-        logger.info(f"[YOOKASSA] Платёж {payment_id}: статус={payment.status}")
+        logger.info(f"[YOOKASSA] Платёж {payment_id}: статус={payment['status']}")
 
         return {
-            'id': payment.id,
-            'status': payment.status,
-            'amount': int(float(payment.amount.value)),
-            'metadata': payment.metadata or {}
+            'id': payment['id'],
+            'status': payment['status'],
+            'amount': int(float(payment['amount']['value'])),
+            'metadata': payment.get('metadata') or {}
         }
 
     except Exception as e:
@@ -192,7 +272,7 @@ def find_payment(payment_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def is_payment_successful(payment_id: str) -> bool:
+async def is_payment_successful(payment_id: str) -> bool:
     """
     Проверка успешности платежа.
 
@@ -202,11 +282,7 @@ def is_payment_successful(payment_id: str) -> bool:
     Returns:
         bool: True если платёж успешен, False в противном случае
     """
-    if not YOOKASSA_AVAILABLE:
-        logger.error("❌ YooKassa SDK не установлен!")
-        return False
-
-    payment_data = find_payment(payment_id)
+    payment_data = await find_payment(payment_id)
 
     if not payment_data:
         return False
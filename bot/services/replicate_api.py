@@ -10,11 +10,19 @@
 #           Удалена функция get_prompt() - заменена на build_design_prompt()
 # ========================================
 # [‵2025-12-23 15:30] ОБНОВЛЕНО: интеграция с translator.py для автоматического перевода
+# [2026-10-18] PERF: getFile через общий httpx клиент (services/http_client.py)
+# [2026-10-18] PERF: getFile через общий кэш services/telegram_files.py (TTL LRU, один запрос на file_id)
+# [2026-10-18] PERF: синхронный replicate.run() заменён на predictions API через общий httpx клиент
+#              (_run_prediction): создание + опрос статуса не блокируют event loop, при отмене
+#              задачи (hedge, остановка бота) prediction отменяется и на стороне Replicate
 
-import os
+import asyncio
 import logging
-import httpx
+from typing import Any, Dict, Optional
+
 from config import config
+from services.http_client import get_http_client
+from services.telegram_files import get_telegram_file_url
 from services.design_styles import get_room_name, get_style_description, is_valid_room, is_valid_style
 from services.prompts import build_design_prompt, build_clear_space_prompt
 from services.translator import translate_prompt_to_english
@@ -35,39 +43,75 @@ USE_NANO_BANANA_PRO = False  # ← Ставь True/False для переключ
 MODEL_ID = "google/nano-banana"
 MODEL_ID_PRO = "google/nano-banana-pro"
 
+REPLICATE_API_URL = "https://api.replicate.com/v1"
+
 # ========================================
-# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# PREDICTIONS API (НЕ БЛОКИРУЕТ EVENT LOOP)
 # ========================================
 
-async def get_telegram_file_url(photo_file_id: str, bot_token: str) -> str | None:
-    """
-    Получение URL файла из Telegram Bot API.
-    """
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.telegram.org/bot{bot_token}/getFile",
-                params={"file_id": photo_file_id}
-            )
+def _extract_output_url(output: Any) -> Optional[str]:
+    """output модели: строка URL или список URL (берём первый)"""
+    if isinstance(output, list):
+        output = output[0] if output else None
+    return str(output) if output else None
 
-            if response.status_code != 200:
-                logger.error(f"❌ Не удалось получить файл: {response.text}")
-                return None
 
-            result = response.json()
-            if not result.get('ok'):
-                logger.error(f"❌ API ошибка: {result}")
-                return None
+async def _cancel_prediction(cancel_url: Optional[str], headers: Dict[str, str]) -> None:
+    if not cancel_url:
+        return
+    try:
+        await get_http_client().post(cancel_url, headers=headers)
+        logger.info(f"🛑 Prediction отменён: {cancel_url}")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось отменить prediction: {e}")
 
-            file_path = result['result']['file_path']
-            file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
 
-            logger.info(f"✅ Получен URL файла: {file_url}")
-            return file_url
+async def _run_prediction(model_id: str, model_input: Dict[str, Any]) -> Optional[str]:
+    """
+    Запуск модели через Replicate predictions API с опросом статуса.
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка при получении URL файла: {e}")
-        return None
+    Возвращает URL результата или None (пустой output). Исключение - если
+    prediction завершился ошибкой или не уложился в REPLICATE_TIMEOUT.
+    При отмене задачи prediction отменяется на стороне Replicate.
+    """
+    client = get_http_client()
+    headers = {"Authorization": f"Bearer {config.REPLICATE_API_TOKEN}"}
+
+    response = await client.post(
+        f"{REPLICATE_API_URL}/models/{model_id}/predictions",
+        headers=headers,
+        json={"input": model_input},
+    )
+    if response.status_code not in (200, 201):
+        raise RuntimeError(f"createPrediction HTTP {response.status_code}: {response.text[:200]}")
+
+    prediction = response.json()
+    urls = prediction.get("urls") or {}
+    get_url = urls.get("get") or f"{REPLICATE_API_URL}/predictions/{prediction['id']}"
+    logger.info(f"📨 Prediction создан: {prediction.get('id')}")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config.REPLICATE_TIMEOUT
+    try:
+        while True:
+            status = prediction.get("status")
+            if status == "succeeded":
+                return _extract_output_url(prediction.get("output"))
+            if status in ("failed", "canceled"):
+                raise RuntimeError(f"Prediction {status}: {prediction.get('error')}")
+            if loop.time() >= deadline:
+                raise asyncio.TimeoutError(f"Prediction не завершился за {config.REPLICATE_TIMEOUT:.0f}s")
+
+            await asyncio.sleep(config.REPLICATE_POLL_INTERVAL)
+            response = await client.get(get_url, headers=headers)
+            if response.status_code != 200:
+                logger.warning(f"⚠️ Статус prediction: HTTP {response.status_code}")
+                continue
+            prediction = response.json()
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # shield: отмена должна дойти до Replicate, даже если нас самих отменяют
+        await asyncio.shield(_cancel_prediction(urls.get("cancel"), headers))
+        raise
 
 
 # ========================================
@@ -101,10 +145,6 @@ async def generate_image(
         return None
 
     try:
-        import replicate
-
-        os.environ["REPLICATE_API_TOKEN"] = config.REPLICATE_API_TOKEN
-
         logger.info("📃 Получение фото из Telegram...")
         image_url = await get_telegram_file_url(photo_file_id, bot_token)
 
@@ -118,32 +158,21 @@ async def generate_image(
         logger.info(f"\ud83d\udc4b Начало промпта:\n{prompt[:500]}...")
 
         logger.info(f"⏳ Запуск {MODEL_ID}...")
-        output = replicate.run(
+        result_url = await _run_prediction(
             MODEL_ID,
-            input={
+            {
                 "prompt": prompt,
                 "image_input": [image_url]
             }
         )
 
-        if output:
-            if hasattr(output, 'url'):
-                result_url = output.url
-            elif isinstance(output, str):
-                result_url = output
-            else:
-                result_url = str(output)
-
+        if result_url:
             logger.info(f"✅ Генерация успешна: {result_url}")
             return result_url
 
         logger.error("❌ Пустой результат от Replicate")
         return None
 
-    except ImportError:
-        logger.error("❌ Библиотека replicate не установлена. Установите: pip install replicate")
-        return None
-
     except Exception as e:
         logger.error(f"❌ Ошибка при генерации: {e}")
         return None
@@ -189,10 +218,6 @@ async def generate_image_pro(
         return None
 
     try:
-        import replicate
-
-        os.environ["REPLICATE_API_TOKEN"] = config.REPLICATE_API_TOKEN
-
         logger.info("📃 [PRO] Получение фото из Telegram...")
         image_url = await get_telegram_file_url(photo_file_id, bot_token)
 
@@ -206,9 +231,9 @@ async def generate_image_pro(
         logger.info(f"\ud83d\udc4b [PRO] Начало промпта:\n{prompt[:500]}...")
 
         logger.info(f"⏳ [PRO] Запуск {MODEL_ID_PRO}...")
-        output = replicate.run(
+        result_url = await _run_prediction(
             MODEL_ID_PRO,
-            input={
+            {
                 "prompt": prompt,
                 "resolution": resolution,
                 "image_input": [image_url],
@@ -218,18 +243,10 @@ async def generate_image_pro(
             }
         )
 
-        if not output:
+        if not result_url:
             logger.error("❌ [PRO] Пустой результат от Replicate PRO")
             return None
 
-        # ИСПРАВЛЕНО: output.url - это АТРИБУТ, НЕ МЕТОД!
-        try:
-            result_url = output.url  # БЕЗ СКОБОК!
-        except Exception as e:
-            logger.error(f"❌ [PRO] Ошибка при получении output.url: {e}")
-            logger.error(f"    Тип output: {type(output)}")
-            return None
-
         logger.info(f"✅ [PRO] Генерация успешна!")
         logger.info(f"    URL: {result_url}")
         logger.info(f"    Формат: {output_format}")
@@ -237,10 +254,6 @@ async def generate_image_pro(
 
         return result_url
 
-    except ImportError:
-        logger.error("❌ [PRO] Библиотека replicate не установлена. Установите: pip install replicate")
-        return None
-
     except Exception as e:
         logger.error(f"❌ [PRO] Ошибка при генерации: {e}")
         return None
@@ -304,9 +317,6 @@ async def clear_space_image(photo_file_id: str, bot_token: str) -> str | None:
         return None
 
     try:
-        import replicate
-        os.environ["REPLICATE_API_TOKEN"] = config.REPLICATE_API_TOKEN
-
         logger.info("📃 Получение фото из Telegram...")
         image_url = await get_telegram_file_url(photo_file_id, bot_token)
 
@@ -320,32 +330,21 @@ async def clear_space_image(photo_file_id: str, bot_token: str) -> str | None:
 
         logger.info(f"⏳ Запуск {MODEL_ID}...")
 
-        output = replicate.run(
+        result_url = await _run_prediction(
             MODEL_ID,
-            input={
+            {
                 "prompt": prompt,
                 "image_input": [image_url]
             }
         )
 
-        if output:
-            if hasattr(output, 'url'):
-                result_url = output.url
-            elif isinstance(output, str):
-                result_url = output
-            else:
-                result_url = str(output)
-
+        if result_url:
             logger.info(f"✅ Очистка успешна: {result_url}")
             return result_url
 
         logger.error("❌ Пустой результат от Replicate")
         return None
 
-    except ImportError:
-        logger.error("❌ Библиотека replicate не установлена. Установите: pip install replicate")
-        return None
-
     except Exception as e:
         logger.error(f"❌ Ошибка при очистке: {e}")
         return None
@@ -394,9 +393,6 @@ async def generate_with_text_prompt(
         return None
 
     try:
-        import replicate
-        os.environ["REPLICATE_API_TOKEN"] = config.REPLICATE_API_TOKEN
-
         logger.info("📃 Получение фото из Telegram...")
         image_url = await get_telegram_file_url(photo_file_id, bot_token)
 
@@ -411,32 +407,21 @@ async def generate_with_text_prompt(
         logger.info(f"📄 Финальный промпт (переведен):\n{final_prompt[:500]}...")
         logger.info(f"⏳ Запуск {MODEL_ID}...")
 
-        output = replicate.run(
+        result_url = await _run_prediction(
             MODEL_ID,
-            input={
+            {
                 "prompt": final_prompt,
                 "image_input": [image_url]
             }
         )
 
-        if output:
-            if hasattr(output, 'url'):
-                result_url = output.url
-            elif isinstance(output, str):
-                result_url = output
-            else:
-                result_url = str(output)
-
+        if result_url:
             logger.info(f"✅ Генерация с текстовым промптом успешна: {result_url}")
             return result_url
 
         logger.error("❌ Пустой результат от Replicate")
         return None
 
-    except ImportError:
-        logger.error("❌ Библиотека replicate не установлена. Установите: pip install replicate")
-        return None
-
     except Exception as e:
         logger.error(f"❌ Ошибка при генерации с текстовым промптом: {e}")
         return None
@@ -0,0 +1,164 @@
+# bot/services/result_images.py
+# --- СОЗДАН: 2026-10-18 - Отправка результатов генерации: file_id Telegram по URL провайдера + дисковый кэш картинок ---
+# --- ОБНОВЛЕН: 2026-10-18 - Скачивание через services/downloads.py: временный файл + ограничение размера (max_download_bytes) ---
+
+"""
+Отправка картинок-результатов (URL от KIE / Replicate) в Telegram.
+
+Раньше каждый обработчик делал answer_photo(photo=url), а style_choice_handler
+при ошибке скачивал картинку новой aiohttp.ClientSession целиком в память и
+загружал её заново как BufferedInputFile. Теперь всё идёт через result_images.send():
+- если этот URL уже отправлялся - повторно шлём file_id Telegram (0 байт трафика)
+- иначе answer_photo(photo=url) - Telegram сам скачивает картинку
+- если Telegram не смог - картинка потоково скачивается общим httpx клиентом
+  в дисковый кэш (download_to_file, не больше max_download_bytes) и
+  отправляется как FSInputFile
+- file_id из ответа Telegram запоминается (память, LRU на max_entries URL)
+
+Дисковый кэш ограничен max_disk_bytes: при превышении удаляются самые
+давно использованные файлы.
+
+Использование:
+    from services.result_images import result_images
+    msg = await result_images.send(message.answer_photo, url, caption=..., parse_mode="HTML")
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+from aiogram.types import FSInputFile, Message
+
+from config import config
+from services.downloads import download_to_file
+
+logger = logging.getLogger(__name__)
+
+SendPhoto = Callable[..., Awaitable[Message]]
+
+
+class ResultImageRelay:
+    """🖼 URL результата → file_id Telegram (память) + байты картинки (диск)"""
+
+    def __init__(self, cache_dir: str = 'cache/results', max_disk_bytes: int = 200 * 1024 * 1024,
+                 max_entries: int = 1000, download_timeout: float = 30.0,
+                 max_download_bytes: int = 10 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_entries = max_entries
+        self.download_timeout = download_timeout
+        self.max_download_bytes = max_download_bytes
+        self._file_ids: 'OrderedDict[str, str]' = OrderedDict()
+        # Один download на URL, даже если отправок несколько
+        self._download_locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {'file_id_sends': 0, 'url_sends': 0, 'disk_sends': 0,
+                      'downloads': 0, 'downloaded_bytes': 0, 'evicted_files': 0}
+
+    # ===== file_id =====
+
+    def get_file_id(self, url: str) -> Optional[str]:
+        file_id = self._file_ids.get(url)
+        if file_id is not None:
+            self._file_ids.move_to_end(url)
+        return file_id
+
+    def remember(self, url: str, message: Message) -> None:
+        """Запомнить file_id самой большой версии фото из ответа Telegram"""
+        if not message or not message.photo:
+            return
+        self._file_ids[url] = message.photo[-1].file_id
+        self._file_ids.move_to_end(url)
+        while len(self._file_ids) > self.max_entries:
+            self._file_ids.popitem(last=False)
+
+    # ===== ОТПРАВКА =====
+
+    async def send(self, send_photo: SendPhoto, url: str, **kwargs) -> Message:
+        """
+        Отправить результат: file_id → URL → файл с диска.
+
+        send_photo - message.answer_photo или functools.partial(bot.send_photo, chat_id).
+        Исключение - если не сработал ни один способ.
+        """
+        file_id = self.get_file_id(url)
+        if file_id:
+            try:
+                message = await send_photo(photo=file_id, **kwargs)
+                self.stats['file_id_sends'] += 1
+                return message
+            except Exception as e:
+                logger.warning(f"⚠️ [RESULT] file_id не принят Telegram, отправляю заново: {e}")
+                self._file_ids.pop(url, None)
+
+        try:
+            message = await send_photo(photo=url, **kwargs)
+            self.stats['url_sends'] += 1
+        except Exception as url_error:
+            logger.warning(f"⚠️ [RESULT] Telegram не смог загрузить по URL: {url_error} - отправляю файлом")
+            path = await self.fetch(url)
+            message = await send_photo(photo=FSInputFile(path, filename='design.jpg'), **kwargs)
+            self.stats['disk_sends'] += 1
+
+        self.remember(url, message)
+        return message
+
+    # ===== ДИСКОВЫЙ КЭШ =====
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode()).hexdigest() + '.img')
+
+    async def fetch(self, url: str) -> str:
+        """Путь к картинке в дисковом кэше (скачать потоково, если её там нет)"""
+        path = self._path(url)
+        lock = self._download_locks.setdefault(url, asyncio.Lock())
+        try:
+            async with lock:
+                if os.path.exists(path):
+                    os.utime(path)
+                    return path
+                await self._download(url, path)
+        finally:
+            if not lock.locked():
+                self._download_locks.pop(url, None)
+        self._evict()
+        return path
+
+    async def _download(self, url: str, path: str) -> None:
+        size = await download_to_file(url, path, self.max_download_bytes, timeout=self.download_timeout)
+        self.stats['downloads'] += 1
+        self.stats['downloaded_bytes'] += size
+        logger.info(f"💾 [RESULT] Скачано в кэш: {size // 1024} KB")
+
+    def _evict(self) -> None:
+        """Удалить самые давно использованные файлы, пока кэш больше max_disk_bytes"""
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir)
+                       if entry.is_file() and entry.name.endswith('.img')]
+        except FileNotFoundError:
+            return
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            self.stats['evicted_files'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'file_ids': len(self._file_ids), **self.stats}
+
+
+result_images = ResultImageRelay(
+    cache_dir=config.RESULT_CACHE_DIR,
+    max_disk_bytes=config.RESULT_CACHE_MAX_MB * 1024 * 1024,
+    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+    download_timeout=config.RESULT_DOWNLOAD_TIMEOUT,
+    max_download_bytes=config.RESULT_DOWNLOAD_MAX_MB * 1024 * 1024,
+)
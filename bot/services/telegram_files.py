@@ -0,0 +1,135 @@
+# bot/services/telegram_files.py
+# --- СОЗДАН: 2026-10-18 - Общий getFile Telegram: TTL LRU кэш file_id → URL и объединение одновременных запросов ---
+# --- ОБНОВЛЕН: 2026-10-18 - file_unique_id из ответа getFile (ключ кэша результатов генераций) ---
+
+"""
+Получение URL файла Telegram по file_id (Bot API getFile).
+
+Раньше get_telegram_file_url был продублирован в kie_api и replicate_api и
+вызывал getFile на каждую генерацию, хотя пользователь часто генерирует по
+одному и тому же фото много раз (use_current_photo, change_style_after_gen).
+Теперь:
+- URL кэшируется по file_id на ttl секунд (ссылка Telegram живёт не меньше
+  часа, берём с запасом), не больше max_size записей - старые вытесняются (LRU)
+- одновременные запросы одного file_id ждут один общий getFile
+- ошибки не кэшируются
+- из того же ответа запоминается file_unique_id (одинаков для одного файла
+  при разных file_id) - get_file_unique_id() для services/generation_cache.py
+
+Использование:
+    from services.telegram_files import get_telegram_file_url
+    url = await get_telegram_file_url(photo_file_id, bot_token)
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from config import config
+from services.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramFileResolver:
+    """📎 file_id → URL файла Telegram (TTL LRU + один getFile на file_id)"""
+
+    def __init__(self, ttl: float = 3300.0, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # file_id → (url, истекает в monotonic)
+        self._cache: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # file_id → file_unique_id (не устаревает, только LRU)
+        self._unique_ids: 'OrderedDict[str, str]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'joined': 0, 'errors': 0}
+
+    async def resolve(self, file_id: str, bot_token: str) -> Optional[str]:
+        cached = self._cache.get(file_id)
+        if cached is not None:
+            url, expires_at = cached
+            if time.monotonic() < expires_at:
+                self._cache.move_to_end(file_id)
+                self.stats['hits'] += 1
+                return url
+            del self._cache[file_id]
+
+        future = self._in_flight.get(file_id)
+        if future is not None:
+            self.stats['joined'] += 1
+        else:
+            self.stats['misses'] += 1
+            future = asyncio.ensure_future(self._fetch(file_id, bot_token))
+            self._in_flight[file_id] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(file_id, None))
+        # shield: отмена одного ожидающего не отменяет getFile для остальных
+        return await asyncio.shield(future)
+
+    async def _fetch(self, file_id: str, bot_token: str) -> Optional[str]:
+        try:
+            client = get_http_client()
+            response = await client.get(
+                f"https://api.telegram.org/bot{bot_token}/getFile",
+                params={"file_id": file_id}
+            )
+
+            if response.status_code != 200:
+                logger.error(f"❌ Не удалось получить файл: {response.text}")
+                self.stats['errors'] += 1
+                return None
+
+            result = response.json()
+            if not result.get('ok'):
+                logger.error(f"❌ API ошибка: {result}")
+                self.stats['errors'] += 1
+                return None
+
+            file_path = result['result']['file_path']
+            file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
+            logger.info(f"✅ Получен URL файла: {file_url}")
+            self._store(file_id, file_url)
+            unique_id = result['result'].get('file_unique_id')
+            if unique_id:
+                self._unique_ids[file_id] = unique_id
+                self._unique_ids.move_to_end(file_id)
+                while len(self._unique_ids) > self.max_size:
+                    self._unique_ids.popitem(last=False)
+            return file_url
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка при получении URL файла: {e}")
+            self.stats['errors'] += 1
+            return None
+
+    async def get_file_unique_id(self, file_id: str, bot_token: str) -> str:
+        """file_unique_id файла (через getFile, если ещё неизвестен). Если getFile не удался - сам file_id"""
+        unique_id = self._unique_ids.get(file_id)
+        if unique_id is None:
+            await self.resolve(file_id, bot_token)
+            unique_id = self._unique_ids.get(file_id)
+        if unique_id is None:
+            return file_id
+        self._unique_ids.move_to_end(file_id)
+        return unique_id
+
+    def _store(self, file_id: str, url: str) -> None:
+        self._cache[file_id] = (url, time.monotonic() + self.ttl)
+        self._cache.move_to_end(file_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'cached': len(self._cache), 'in_flight': len(self._in_flight), **self.stats}
+
+
+telegram_file_resolver = TelegramFileResolver(
+    ttl=config.TELEGRAM_FILE_URL_TTL,
+    max_size=config.TELEGRAM_FILE_CACHE_SIZE,
+)
+
+
+async def get_telegram_file_url(photo_file_id: str, bot_token: str) -> Optional[str]:
+    """Получить URL файла из Telegram (через общий кэш)"""
+    return await telegram_file_resolver.resolve(photo_file_id, bot_token)
@@ -7,9 +7,11 @@
 # [2025-12-27 09:41] КРИТИЧНО ИСПРАВЛЕНО: Surrogate characters заменены на правильные Unicode escapes (U+1F527, U+1F4CB)
 # [2025-12-30 01:26] 🔥 CRITICAL FIX: Добавлен 3-й аргумент work_mode для отображения режима работы
 # [2026-01-05 15:16] 🔥 CRITICAL FIX: Заменены Unicode escapes на прямые символы для совместимости с Markdown парсингом Telegram
+# [2026-10-18] Добавлена queue_position_notifier - позиция в очереди генераций в сообщении прогресса
 
 import asyncio
 import logging
+from typing import Optional, Callable, Awaitable
 
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
@@ -136,3 +138,29 @@ async def add_balance_and_mode_to_text(
         logger.error(f"Ошибка формирования footer для user {user_id}: {e}")
         # Возвращаем исходный текст без footer'а если ошибка
         return text
+
+
+def queue_position_notifier(message: Optional[Message], text: str,
+                            parse_mode: Optional[str] = None) -> Optional[Callable[[int], Awaitable[None]]]:
+    """
+    Callback on_queue_position для smart_generate_*: дописывает позицию в очереди
+    генераций к сообщению прогресса, а когда генерация началась - возвращает исходный текст.
+    """
+    if not isinstance(message, Message):
+        return None
+
+    async def on_position(position: int) -> None:
+        if position:
+            queued_text = f"{text}\n\n⏳ Вы в очереди: {position}-й. Генерация начнётся автоматически."
+        else:
+            queued_text = text
+        try:
+            # Без parse_mode - режим разметки бота по умолчанию
+            if parse_mode is None:
+                await message.edit_text(queued_text)
+            else:
+                await message.edit_text(queued_text, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            logger.debug(f"Не удалось обновить позицию в очереди: {e}")
+
+    return on_position